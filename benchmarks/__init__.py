@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmarks for Pipewelder.
+
+Run with ``python -m benchmarks --help`` from the project root.
+"""
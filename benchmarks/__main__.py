@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from benchmarks.suite import main
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+"""
+In-process stand-ins for the Data Pipeline and S3 connections.
+
+They implement the subset of the boto API that Pipewelder uses, keep
+all state in memory, and can inject per-call latency and a request
+rate limit to imitate service throttling.
+"""
+
+import time
+import hashlib
+import threading
+from copy import deepcopy
+from collections import defaultdict
+
+from boto.exception import JSONResponseError, S3ResponseError
+
+# the activity of the example template, whose instances are its runs
+RUN_COMPONENT = 'PipewelderShellCommandActivity'
+
+
+class FakeBackend(object):
+    """
+    Shared bookkeeping for fake connections.
+
+    Every call sleeps for *latency* seconds.  When *rate_limit* is set,
+    Data Pipeline calls beyond that many per second, after a burst of
+    *burst*, fail with a ``ThrottlingException`` as the service's would,
+    and S3 calls are delayed as S3 slows clients down; both are counted
+    in ``throttled``.
+    """
+    def __init__(self, latency=0.0, rate_limit=None, burst=1):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.calls = defaultdict(int)
+        self.throttled = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, name):
+        wait = self.latency
+        throttled = False
+        with self._lock:
+            self.calls[name] += 1
+            if self.rate_limit:
+                interval = 1.0 / self.rate_limit
+                now = time.time()
+                slot = max(now, self._next_slot)
+                if name.startswith('s3.'):
+                    self._next_slot = slot + interval
+                    if slot > now:
+                        self.throttled += 1
+                        wait += slot - now
+                elif slot - now > (self.burst - 1) * interval:
+                    self.throttled += 1
+                    throttled = True
+                else:
+                    self._next_slot = slot + interval
+        if throttled:
+            raise JSONResponseError(
+                400, 'Bad Request',
+                {'__type': 'com.amazon.coral.availability#ThrottlingException',
+                 'message': 'Rate exceeded'})
+        if wait > 0:
+            time.sleep(wait)
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled = 0
+
+
+class FakeDataPipelineConnection(object):
+    """
+    Imitates :class:`boto.datapipeline.layer1.DataPipelineConnection`.
+    """
+    # page sizes of ListPipelines and QueryObjects, and the batch limit of
+    # DescribeObjects
+    LIST_LIMIT = 100
+    QUERY_LIMIT = 100
+    DESCRIBE_LIMIT = 25
+
+    def __init__(self, backend=None):
+        self.backend = backend or FakeBackend()
+        self.pipelines = {}
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def create_pipeline(self, name, unique_id, description=None, tags=None):
+        self.backend.call('create_pipeline')
+        with self._lock:
+            key = (name, unique_id)
+            if key not in self._ids:
+                pipeline_id = 'df-{0:019d}'.format(len(self._ids) + 1)
+                self._ids[key] = pipeline_id
+                self.pipelines[pipeline_id] = {
+                    'name': name,
+                    'unique_id': unique_id,
+                    'description': description,
+                    'tags': tags or [],
+                    'state': 'PENDING',
+                    'definition': {'pipelineObjects': []},
+                    'instances': {},
+                }
+            return {'pipelineId': self._ids[key]}
+
+    def validate_pipeline_definition(self, pipeline_objects, pipeline_id,
+                                     parameter_objects=None,
+                                     parameter_values=None):
+        self.backend.call('validate_pipeline_definition')
+        self._get(pipeline_id)
+        return {'errored': False,
+                'validationErrors': [],
+                'validationWarnings': []}
+
+    def put_pipeline_definition(self, pipeline_objects, pipeline_id,
+                                parameter_objects=None,
+                                parameter_values=None):
+        self.backend.call('put_pipeline_definition')
+        definition = {'pipelineObjects': deepcopy(pipeline_objects)}
+        if parameter_objects is not None:
+            definition['parameterObjects'] = deepcopy(parameter_objects)
+        if parameter_values is not None:
+            definition['parameterValues'] = deepcopy(parameter_values)
+        self._get(pipeline_id)['definition'] = definition
+        return {'errored': False,
+                'validationErrors': [],
+                'validationWarnings': []}
+
+    def get_pipeline_definition(self, pipeline_id, version=None):
+        self.backend.call('get_pipeline_definition')
+        return deepcopy(self._get(pipeline_id)['definition'])
+
+    def describe_pipelines(self, pipeline_ids):
+        self.backend.call('describe_pipelines')
+        descriptions = []
+        for pipeline_id in pipeline_ids:
+            pipeline = self._get(pipeline_id)
+            descriptions.append({
+                'pipelineId': pipeline_id,
+                'name': pipeline['name'],
+                'description': pipeline['description'],
+                'fields': [{'key': '@pipelineState',
+                            'stringValue': pipeline['state']},
+                           {'key': 'uniqueId',
+                            'stringValue': pipeline['unique_id']}],
+                'tags': pipeline['tags'],
+            })
+        return {'pipelineDescriptionList': descriptions}
+
+    def activate_pipeline(self, pipeline_id):
+        self.backend.call('activate_pipeline')
+        self._get(pipeline_id)['state'] = 'SCHEDULED'
+        return {}
+
+    def delete_pipeline(self, pipeline_id):
+        self.backend.call('delete_pipeline')
+        with self._lock:
+            self.pipelines.pop(pipeline_id)
+            for key, value in list(self._ids.items()):
+                if value == pipeline_id:
+                    del self._ids[key]
+
+    def list_pipelines(self, marker=None):
+        self.backend.call('list_pipelines')
+        with self._lock:
+            ids = [{'id': pipeline_id, 'name': pipeline['name']}
+                   for pipeline_id, pipeline in sorted(self.pipelines.items())]
+        start = int(marker or 0)
+        end = start + self.LIST_LIMIT
+        response = {'pipelineIdList': ids[start:end],
+                    'hasMoreResults': end < len(ids)}
+        if end < len(ids):
+            response['marker'] = str(end)
+        return response
+
+    def query_objects(self, pipeline_id, sphere, marker=None, query=None,
+                      limit=None):
+        self.backend.call('query_objects')
+        if sphere != 'INSTANCE':
+            raise ValueError("Only the INSTANCE sphere is imitated")
+        selectors = (query or {}).get('selectors', [])
+        with self._lock:
+            instances = self._get_unlocked(pipeline_id)['instances']
+            ids = sorted(instance_id
+                         for instance_id, instance in instances.items()
+                         if all(_selected(instance, selector)
+                                for selector in selectors))
+        start = int(marker or 0)
+        end = start + (limit or self.QUERY_LIMIT)
+        response = {'ids': ids[start:end], 'hasMoreResults': end < len(ids)}
+        if end < len(ids):
+            response['marker'] = str(end)
+        return response
+
+    def describe_objects(self, object_ids, pipeline_id, marker=None,
+                         evaluate_expressions=None):
+        self.backend.call('describe_objects')
+        if len(object_ids) > self.DESCRIBE_LIMIT:
+            raise ValueError("At most {0} objects may be described at once"
+                             .format(self.DESCRIBE_LIMIT))
+        with self._lock:
+            instances = self._get_unlocked(pipeline_id)['instances']
+            objects = [deepcopy(instances[object_id])
+                       for object_id in object_ids]
+        return {'pipelineObjects': objects, 'hasMoreResults': False}
+
+    def set_status(self, object_ids, status, pipeline_id):
+        """
+        Set instances' ``@status`` as Data Pipeline would once it acts on
+        *status*: reruns wait for their dependencies again, cancellations
+        and runs marked finished take effect at once.
+        """
+        self.backend.call('set_status')
+        if len(object_ids) > self.DESCRIBE_LIMIT:
+            raise ValueError("At most {0} objects may be set at once"
+                             .format(self.DESCRIBE_LIMIT))
+        new_status = SET_STATUSES[status]
+        with self._lock:
+            instances = self._get_unlocked(pipeline_id)['instances']
+            for object_id in object_ids:
+                fields = [field for field in instances[object_id]['fields']
+                          if field['key'] not in ('@status',
+                                                  '@failureReason')]
+                fields.append({'key': '@status', 'stringValue': new_status})
+                instances[object_id]['fields'] = fields
+        return {}
+
+    def add_instance(self, pipeline_id, instance_id, fields):
+        """
+        Add an instance object to *pipeline_id*, with *fields* mapping
+        keys to strings or, for references, ``{'ref': id}`` dicts.
+        """
+        api_fields = []
+        for key, value in sorted(fields.items()):
+            if isinstance(value, dict):
+                api_fields.append({'key': key, 'refValue': value['ref']})
+            else:
+                api_fields.append({'key': key, 'stringValue': value})
+        with self._lock:
+            self._get_unlocked(pipeline_id)['instances'][instance_id] = {
+                'id': instance_id, 'name': instance_id, 'fields': api_fields}
+
+    def add_run(self, pipeline_id, run_id, scheduled, status='FINISHED',
+                started=None, ended=None, component=RUN_COMPONENT,
+                error=None):
+        """
+        Add an instance of *component* to *pipeline_id*, scheduled at
+        datetime *scheduled*, with *status* and, if given, its actual
+        start and end datetimes and failure reason.
+        """
+        fields = {'@componentParent': {'ref': component},
+                  '@status': status,
+                  '@scheduledStartTime': _format_time(scheduled)}
+        if started is not None:
+            fields['@actualStartTime'] = _format_time(started)
+            fields['@attemptCount'] = '1'
+        if ended is not None:
+            fields['@actualEndTime'] = _format_time(ended)
+        if error is not None:
+            fields['@failureReason'] = error
+        self.add_instance(pipeline_id, run_id, fields)
+
+    def _get(self, pipeline_id):
+        with self._lock:
+            return self._get_unlocked(pipeline_id)
+
+    def _get_unlocked(self, pipeline_id):
+        try:
+            return self.pipelines[pipeline_id]
+        except KeyError:
+            raise ValueError("Pipeline {0} does not exist"
+                             .format(pipeline_id))
+
+
+# instance statuses resulting from SetStatus
+SET_STATUSES = {
+    'RERUN': 'WAITING_ON_DEPENDENCIES',
+    'TRY_CANCEL': 'CANCELED',
+    'MARK_FINISHED': 'FINISHED',
+}
+
+
+def _format_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _selected(instance, selector):
+    """
+    Return ``True`` if *instance* matches a QueryObjects *selector*.
+    """
+    values = [field.get('stringValue', field.get('refValue'))
+              for field in instance['fields']
+              if field['key'] == selector['fieldName']]
+    if not values:
+        return False
+    value = values[0]
+    operator = selector['operator']
+    operands = operator['values']
+    if operator['type'] in ('EQ', 'REF_EQ'):
+        return value in operands
+    if operator['type'] == 'GE':
+        return value >= operands[0]
+    if operator['type'] == 'LE':
+        return value <= operands[0]
+    if operator['type'] == 'BETWEEN':
+        return operands[0] <= value <= operands[1]
+    raise ValueError("Unknown operator {0}".format(operator['type']))
+
+
+class FakeS3Connection(object):
+    """
+    Imitates :class:`boto.s3.connection.S3Connection`.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend or FakeBackend()
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, bucket_name, validate=True, headers=None):
+        self.backend.call('s3.get_bucket')
+        with self._lock:
+            if bucket_name not in self.buckets:
+                self.buckets[bucket_name] = FakeBucket(self, bucket_name)
+            return self.buckets[bucket_name]
+
+
+class FakeResultSet(list):
+    """
+    Imitates :class:`boto.resultset.ResultSet`, a page of a listing.
+    """
+    is_truncated = False
+    next_marker = None
+
+
+class FakeBucket(object):
+    """
+    Imitates :class:`boto.s3.bucket.Bucket`.
+    """
+    LIST_LIMIT = 1000
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.contents = {}
+        # names whose deletion fails, as if denied by a bucket policy
+        self.undeletable = set()
+        # ETags of objects uploaded in parts
+        self.etags = {}
+        self._lock = threading.Lock()
+
+    def list(self, prefix='', delimiter='', marker='', headers=None):
+        self.connection.backend.call('s3.list')
+        with self._lock:
+            names = sorted(name for name in self.contents
+                           if name.startswith(prefix) and name > marker)
+        if not delimiter:
+            return [FakeKey(self, name) for name in names]
+        listed = []
+        for name in names:
+            rest = name[len(prefix):]
+            if delimiter not in rest:
+                listed.append(FakeKey(self, name))
+                continue
+            common = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+            if not listed or listed[-1].name != common:
+                listed.append(FakePrefix(self, common))
+        return listed
+
+    def get_all_keys(self, prefix='', marker='', delimiter='',
+                     max_keys=None, headers=None):
+        max_keys = max_keys or self.LIST_LIMIT
+        listed = self.list(prefix, delimiter, marker)
+        page = FakeResultSet(listed[:max_keys])
+        page.is_truncated = len(listed) > max_keys
+        return page
+
+    def new_key(self, key_name=None):
+        return FakeKey(self, key_name)
+
+    def initiate_multipart_upload(self, key_name, headers=None):
+        self.connection.backend.call('s3.create_multipart_upload')
+        return FakeMultiPartUpload(self, key_name)
+
+    def get_key(self, key_name, headers=None, version_id=None):
+        self.connection.backend.call('s3.head_object')
+        with self._lock:
+            if key_name not in self.contents:
+                return None
+        return FakeKey(self, key_name)
+
+    def delete_keys(self, keys, quiet=False, mfa_token=None, headers=None):
+        self.connection.backend.call('s3.delete_objects')
+        result = FakeMultiDeleteResult()
+        with self._lock:
+            for key in keys:
+                name = getattr(key, 'name', key)
+                if name in self.undeletable:
+                    result.errors.append(FakeDeleteError(name))
+                    continue
+                self.contents.pop(name, None)
+                self.etags.pop(name, None)
+                if not quiet:
+                    result.deleted.append(name)
+        return result
+
+
+class FakeMultiPartUpload(object):
+    """
+    Imitates :class:`boto.s3.multipart.MultiPartUpload`.
+    """
+    def __init__(self, bucket, key_name):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.parts = {}
+
+    def upload_part_from_file(self, fp, part_num, headers=None,
+                              replace=True, size=None):
+        self.bucket.connection.backend.call('s3.upload_part')
+        self.parts[part_num] = fp.read(size) if size is not None else fp.read()
+
+    def complete_upload(self):
+        self.bucket.connection.backend.call('s3.complete_multipart_upload')
+        parts = [self.parts[number] for number in sorted(self.parts)]
+        etag = '"{0}-{1}"'.format(
+            hashlib.md5(b''.join(hashlib.md5(part).digest()
+                                 for part in parts)).hexdigest(),
+            len(parts))
+        with self.bucket._lock:
+            self.bucket.contents[self.key_name] = b''.join(parts)
+            self.bucket.etags[self.key_name] = etag
+
+    def cancel_upload(self):
+        self.bucket.connection.backend.call('s3.abort_multipart_upload')
+        self.parts = {}
+
+
+class FakeMultiDeleteResult(object):
+    """
+    Imitates :class:`boto.s3.multidelete.MultiDeleteResult`.
+    """
+    def __init__(self):
+        self.deleted = []
+        self.errors = []
+
+
+class FakeDeleteError(object):
+    """
+    Imitates :class:`boto.s3.multidelete.Error`.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.code = 'AccessDenied'
+        self.message = 'Access Denied'
+
+
+class FakePrefix(object):
+    """
+    Imitates :class:`boto.s3.prefix.Prefix`, a common prefix listed
+    with a delimiter.
+    """
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+
+class FakeKey(object):
+    """
+    Imitates :class:`boto.s3.key.Key`.
+    """
+    def __init__(self, bucket, name=None):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def key(self):
+        return self.name
+
+    @property
+    def size(self):
+        return len(self.bucket.contents.get(self.name, b''))
+
+    @property
+    def etag(self):
+        if self.name in self.bucket.etags:
+            return self.bucket.etags[self.name]
+        data = self.bucket.contents.get(self.name, b'')
+        return '"{0}"'.format(hashlib.md5(data).hexdigest())
+
+    def set_contents_from_string(self, data, headers=None, replace=True):
+        self.bucket.connection.backend.call('s3.put_object')
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        with self.bucket._lock:
+            self.bucket.contents[self.name] = data
+            self.bucket.etags.pop(self.name, None)
+
+    def set_contents_from_filename(self, filename, headers=None,
+                                   replace=True):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self.set_contents_from_string(data, headers=headers, replace=replace)
+
+    def get_contents_as_string(self, headers=None):
+        self.bucket.connection.backend.call('s3.get_object')
+        with self.bucket._lock:
+            if self.name not in self.bucket.contents:
+                raise S3ResponseError(404, 'Not Found')
+            data = self.bucket.contents[self.name]
+        byte_range = (headers or {}).get('Range')
+        if byte_range:
+            # only suffix ranges, 'bytes=-N', are imitated
+            return data[-int(byte_range.split('=-')[1]):]
+        return data
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Generate synthetic Pipewelder fleets on disk.
+"""
+
+import os
+import json
+import random
+from copy import deepcopy
+
+PERIODS = ['15 minutes', '30 minutes', '1 hours', '6 hours', '1 days']
+TEMPLATE_COUNT = 3
+RUN_SCRIPT = """#!/bin/sh
+for task in tasks/*; do
+    echo "running $task"
+done
+"""
+
+
+def generate_fleet(root, size, seed=0, max_tasks=8, max_task_bytes=4096):
+    """
+    Write a fleet of *size* pipeline directories under *root*.
+
+    Pipelines are spread across several template variants, each with its
+    own group in ``pipewelder.json``.  Returns the path to that file.
+    """
+    rng = random.Random(seed)
+    template = _base_template()
+    config = {"defaults": {"region": "us-east-1"}}
+    for t in range(TEMPLATE_COUNT):
+        template_name = 'template_{0}.json'.format(t)
+        _write_json(os.path.join(root, template_name),
+                    _template_variant(template, t))
+        config['group_{0}'.format(t)] = {
+            "dirs": ['t{0}_*'.format(t)],
+            "template": template_name,
+            "values": {"myEnv": "bench"},
+        }
+    for i in range(size):
+        t = i % TEMPLATE_COUNT
+        dirpath = os.path.join(root, 't{0}_pipeline_{1:05d}'.format(t, i))
+        _write_pipeline(rng, dirpath, i, max_tasks, max_task_bytes)
+    config_path = os.path.join(root, 'pipewelder.json')
+    _write_json(config_path, config)
+    return config_path
+
+
+def _write_pipeline(rng, dirpath, index, max_tasks, max_task_bytes):
+    name = os.path.basename(dirpath)
+    s3_base = 's3://pipewelder-bench/#{myEnv}/' + name
+    values = {
+        "myName": name,
+        "myDescription": "synthetic pipeline {0}".format(index),
+        "myS3InputDir": s3_base + "/inputs",
+        "myS3OutputDir": s3_base + "/outputs",
+        "myS3LogDir": s3_base + "/logs",
+        "myStartDateTime": "{0}-{1:02d}-01T{2:02d}:00:00".format(
+            rng.randint(2014, 2020), rng.randint(1, 12), rng.randint(0, 23)),
+        "mySchedulePeriod": rng.choice(PERIODS),
+        "myTags": ["pipewelder-environment:bench",
+                   "team:team{0}".format(rng.randint(0, 9))],
+    }
+    if rng.random() < 0.5:
+        values["myTerminateAfter"] = "10 minutes"
+    os.makedirs(os.path.join(dirpath, 'tasks'))
+    _write_json(os.path.join(dirpath, 'values.json'), {"values": values})
+    with open(os.path.join(dirpath, 'run'), 'w') as f:
+        f.write(RUN_SCRIPT)
+    for t in range(rng.randint(0, max_tasks)):
+        task_path = os.path.join(dirpath, 'tasks', 'task_{0}.sql'.format(t))
+        with open(task_path, 'w') as f:
+            f.write('-- task {0}\n'.format(t))
+            f.write('x' * rng.randint(0, max_task_bytes))
+
+
+def _base_template():
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(here, os.pardir, 'tests', 'test_data',
+                        'pipeline_definition.json')
+    with open(path) as f:
+        return json.load(f)
+
+
+def _template_variant(template, variant):
+    """
+    Return *template* with *variant* extra shell activities chained on.
+    """
+    template = deepcopy(template)
+    for n in range(variant):
+        template['objects'].append({
+            "id": "PipewelderExtraActivity{0}".format(n),
+            "command": "echo extra step {0}".format(n),
+            "runsOn": {"ref": "PipewelderEC2Resource"},
+            "dependsOn": {"ref": "PipewelderShellCommandActivity"},
+            "type": "ShellCommandActivity",
+        })
+    return template
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Pipewelder benchmark suite.
+
+Generates synthetic fleets, times each stage of Pipewelder against them
+using the in-process fake AWS backend, and emits the results as JSON.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+
+from pipewelder import core, metadata, util
+from pipewelder.cli import pipewelder_configs, build_pipewelder
+from benchmarks import fleet
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+DEFAULT_SIZES = [10, 100, 1000]
+CYCLE_ACTIONS = ['validate', 'upload', 'activate']
+RESOLVED_KEYS = ['myName', 'myS3InputDir', 'myS3OutputDir', 'myS3LogDir',
+                 'myStartDateTime', 'mySchedulePeriod', 'myTerminateAfter']
+
+
+def run_suite(sizes=DEFAULT_SIZES, latency=0.0, rate_limit=None,
+              cycle_max_size=1000, seed=0, workdir=None, concurrency=1):
+    """
+    Benchmark fleets of each of *sizes* pipelines.
+
+    Full validate/upload/activate cycles are only run for fleets of at
+    most *cycle_max_size* pipelines, acting on up to *concurrency*
+    pipelines at once.  Returns a JSON-serializable dict.
+    """
+    results = []
+    for size in sizes:
+        root = tempfile.mkdtemp(prefix='pipewelder-bench-', dir=workdir)
+        try:
+            config_path = fleet.generate_fleet(root, size, seed=seed)
+            backend = FakeBackend(latency=latency, rate_limit=rate_limit)
+            with util.cd(root):
+                results.extend(_run_size(size, config_path, backend,
+                                         size <= cycle_max_size,
+                                         concurrency))
+        finally:
+            shutil.rmtree(root)
+    return {
+        'meta': {
+            'pipewelder_version': metadata.version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.time(),
+            'latency': latency,
+            'rate_limit': rate_limit,
+            'seed': seed,
+            'concurrency': concurrency,
+        },
+        'results': results,
+    }
+
+
+def _run_size(size, config_path, backend, run_cycles, concurrency):
+    results = []
+
+    def record(benchmark, seconds, **extra):
+        result = {'size': size, 'benchmark': benchmark, 'seconds': seconds,
+                  'per_pipeline': seconds / size if size else None}
+        result.update(extra)
+        results.append(result)
+
+    with _timer() as t:
+        configs = pipewelder_configs(config_path)
+    record('config_discovery', t.seconds)
+
+    conn = FakeDataPipelineConnection(backend)
+    s3_conn = FakeS3Connection(backend)
+    with _timer() as t:
+        welders = [build_pipewelder(conn, config, s3_conn, concurrency)
+                   for config in configs.values()]
+    record('pipeline_construction', t.seconds)
+    pipelines = [p for pw in welders for p in pw.pipelines.values()]
+
+    with _timer() as t:
+        for p in pipelines:
+            for key in RESOLVED_KEYS:
+                try:
+                    p._get_value(key)
+                except ValueError:
+                    pass
+    record('parameter_resolution', t.seconds)
+
+    with _timer() as t:
+        for p in pipelines:
+            p.api_objects()
+            p.api_parameters()
+            p.api_values()
+    record('translation', t.seconds)
+
+    schedules = []
+    for p in pipelines:
+        raw = util.load_json(os.path.join(p.dirpath, 'values.json'))
+        schedules.append((raw['values']['myStartDateTime'],
+                          raw['values']['mySchedulePeriod']))
+    with _timer() as t:
+        for timestamp, period in schedules:
+            core.adjusted_to_future(timestamp, period)
+    record('adjusted_to_future', t.seconds)
+
+    if not run_cycles:
+        return results
+    for action in CYCLE_ACTIONS:
+        backend.reset_counts()
+        with _timer() as t:
+            ok = all([getattr(pw, action)() for pw in welders])
+        record(action, t.seconds, ok=ok, calls=dict(backend.calls),
+               throttled=backend.throttled)
+    return results
+
+
+class _timer(object):
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.time() - self.started
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description="Benchmark Pipewelder against synthetic fleets.")
+    parser.add_argument(
+        '--sizes',
+        default=','.join(str(size) for size in DEFAULT_SIZES),
+        help="Comma-separated fleet sizes to benchmark")
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help="Seconds of latency added to every fake AWS call")
+    parser.add_argument(
+        '--rate-limit', type=float, default=None,
+        help="""Fake AWS calls per second before Data Pipeline calls are
+        throttled (and retried) and S3 calls slowed down""")
+    parser.add_argument(
+        '--cycle-max-size', type=int, default=1000,
+        help="Largest fleet for which to run validate/upload/activate")
+    parser.add_argument(
+        '--concurrency', type=int, default=1,
+        help="Pipelines acted on at once during cycles")
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help="Random seed for fleet generation")
+    parser.add_argument(
+        '--workdir', default=None,
+        help="Directory in which to generate fleets")
+    parser.add_argument(
+        '--output', default=None,
+        help="Write JSON results to this path instead of stdout")
+    args = parser.parse_args(argv[1:])
+
+    logging.getLogger().setLevel(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = run_suite(sizes, latency=args.latency,
+                       rate_limit=args.rate_limit,
+                       cycle_max_size=args.cycle_max_size,
+                       seed=args.seed, workdir=args.workdir,
+                       concurrency=args.concurrency)
+    for result in report['results']:
+        print("{size:>7} {benchmark:<24} {seconds:>10.4f}s".format(**result),
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    return 0
@@ -133,6 +133,14 @@ def run(args):
     raise SystemExit(main([CODE_DIRECTORY] + args))
 
 
+@task
+@consume_args
+def bench(args):
+    """Run the benchmark suite. All arguments are passed to it."""
+    from benchmarks.suite import main
+    raise SystemExit(main(['benchmarks'] + args))
+
+
 @task
 def commit():
     """Commit only if all the tests pass."""
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Upload pipeline files to a content-addressed blob store.
+
+Pipelines often share task files and helper scripts. In blobs mode each
+distinct file is uploaded once, to a shared S3 prefix under its SHA-256
+digest, and each pipeline's ``myS3InputDir`` holds only a manifest
+mapping relative paths to blobs and a generated ``run`` wrapper. On the
+worker, the wrapper fetches the listed blobs with the AWS CLI (present
+on Data Pipeline's default AMI) and executes the pipeline's own
+``run``, so the resource role needs read access to the blob store.
+"""
+
+import os
+import stat
+import logging
+import threading
+
+from pipewelder import profiling, tracing, hashing, storage
+
+MANIFEST_NAME = 'pipewelder-blobs.txt'
+WRAPPER_NAME = 'run'
+WRAPPER = """#!/bin/sh
+# Generated by Pipewelder: fetches the pipeline's files from the blob
+# store and runs it.
+set -e
+cd "$(dirname "$0")"
+mkdir -p files
+while read digest mode path; do
+    mkdir -p "files/$(dirname "$path")"
+    aws s3 cp --quiet "{store}/$digest" "files/$path"
+    chmod "$mode" "files/$path"
+done < {manifest}
+cd files
+exec ./run "$@"
+"""
+
+
+class BlobStore(object):
+    """
+    Blobs named by their SHA-256 digest under *prefix* in the S3 bucket
+    called *bucket_name*, reached through *s3_conn*.
+
+    The blobs already present are listed once, on first use, and each
+    blob is uploaded at most once however many pipelines share it, even
+    when pipelines are uploaded concurrently.
+    """
+    def __init__(self, s3_conn, bucket_name, prefix):
+        self.s3_conn = s3_conn
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip('/')
+        self._bucket = None
+        self._present = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def uri(self):
+        return 's3://{0}/{1}'.format(self.bucket_name, self.prefix)
+
+    def key_name(self, digest):
+        return '{0}/{1}'.format(self.prefix, digest)
+
+    def ensure(self, digest, local_path):
+        """
+        Upload the file at *local_path*, whose SHA-256 is *digest*,
+        unless the store already has it.
+        """
+        with self._lock:
+            if self._present is None:
+                self._load()
+            if digest in self._present:
+                return
+            event = self._pending.get(digest)
+            owner = event is None
+            if owner:
+                event = self._pending[digest] = threading.Event()
+        if not owner:
+            # another thread is uploading the same content
+            event.wait()
+            with self._lock:
+                if digest not in self._present:
+                    raise IOError("Upload of blob {0} failed".format(digest))
+            return
+        try:
+            k = self._bucket.new_key(self.key_name(digest))
+            with profiling.phase('network'):
+                with tracing.span('put_object', key=k.key):
+                    k.set_contents_from_filename(local_path)
+            logging.info("Uploaded blob {0} from {1}"
+                         .format(digest, local_path))
+            with self._lock:
+                self._present.add(digest)
+        finally:
+            with self._lock:
+                del self._pending[digest]
+            event.set()
+
+    def _load(self):
+        with profiling.phase('network'):
+            with tracing.span('list_objects'):
+                self._bucket = self.s3_conn.get_bucket(self.bucket_name)
+                self._present = set(
+                    os.path.basename(key.name)
+                    for key in self._bucket.list(prefix=self.prefix + '/'))
+
+
+def file_digest(path):
+    """
+    Return the SHA-256 hex digest of the file at *path*.
+    """
+    return hashing.hash_file(path, [hashing.SHA256])[hashing.SHA256]
+
+
+def manifest(dirpath, store, hashes=None):
+    """
+    Upload the files beneath *dirpath* to *store*, returning the
+    manifest text: one ``<digest> <mode> <path>`` line per file.
+
+    *hashes*, from :func:`pipewelder.hashing.hash_tree` with at least
+    :data:`~pipewelder.hashing.SHA256`, saves hashing the files again.
+    """
+    if hashes is None:
+        hashes = hashing.hash_tree(dirpath, [hashing.SHA256])
+    lines = []
+    for path, digests in hashes:
+        local_path = os.path.join(dirpath, path)
+        digest = digests[hashing.SHA256]
+        store.ensure(digest, local_path)
+        executable = os.stat(local_path).st_mode & stat.S_IXUSR
+        lines.append('{0} {1} {2}\n'.format(
+            digest, executable and '755' or '644',
+            path.replace(os.sep, '/')))
+    return ''.join(lines)
+
+
+def wrapper(store):
+    """
+    Return a ``run`` script that fetches its pipeline's blobs from
+    *store* and runs it.
+    """
+    return WRAPPER.format(store=store.uri, manifest=MANIFEST_NAME)
+
+
+def upload(bucket, input_dir, dirpath, store, hashes=None):
+    """
+    Upload the files beneath *dirpath* to *store*, then make a manifest
+    of them and a wrapper the only contents of *input_dir* in *bucket*.
+    *hashes* is as for :func:`manifest`.
+
+    Returns ``True`` if successful.
+    """
+    text = manifest(dirpath, store, hashes)
+    return storage.publish(bucket, input_dir, [
+        (MANIFEST_NAME, text.encode('utf-8')),
+        (WRAPPER_NAME, wrapper(store).encode('utf-8'))])
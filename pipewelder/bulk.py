@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Rerun or cancel many pipeline runs at once.
+
+Matching runs are found with :mod:`pipewelder.instances` and their
+status set with SetStatus calls carrying up to 25 instances each,
+several at once but, across every pipeline, no faster than a shared
+rate limit. Calls that are throttled anyway are retried with backoff by
+:func:`~pipewelder.core.api_request`.
+"""
+
+import logging
+from datetime import datetime
+
+from boto.exception import JSONResponseError
+
+from pipewelder import util, instances
+from pipewelder.core import api_request
+
+RERUN = 'RERUN'
+CANCEL = 'TRY_CANCEL'
+# most instances sent per SetStatus request
+BATCH_SIZE = 25
+# Data Pipeline allows 5 SetStatus calls a second, in bursts of up to 10
+DEFAULT_RATE = 5
+DEFAULT_BURST = 10
+
+
+def matching_runs(pipeline, status, since, until=None, failed=False):
+    """
+    Return the runs of *pipeline* scheduled between datetimes *since*
+    and *until* that setting *status* applies to: runs that are done
+    (only failed ones if *failed* is set) for :data:`RERUN`, and runs
+    not yet done for :data:`CANCEL`.
+    """
+    selectors = failed and [instances.with_status(
+        instances.FAILED_STATUSES)] or []
+    runs = instances.runs(pipeline, since, until, selectors)
+    return [run for run in runs if run.done == (status == RERUN)]
+
+
+def set_status(conn, pipeline_id, instance_ids, status, limiter=None,
+               concurrency=1):
+    """
+    Set *status* on *instance_ids* of *pipeline_id*, sending
+    *concurrency* batches at once, each after waiting on
+    :class:`~pipewelder.util.RateLimiter` *limiter*.
+
+    Returns the ids whose batches failed.
+    """
+    instance_ids = list(instance_ids)
+    batches = [instance_ids[start:start + BATCH_SIZE]
+               for start in range(0, len(instance_ids), BATCH_SIZE)]
+
+    def send(batch):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            api_request(conn, 'set_status', batch, status, pipeline_id)
+        except JSONResponseError as e:
+            logging.error("Could not set %s on %d instances of %s: %s",
+                          status, len(batch), pipeline_id, e)
+            return batch
+        return []
+    failed = util.parallel_map(send, batches, concurrency)
+    return [instance_id for batch in failed for instance_id in batch]
+
+
+def apply(pipeline, status, since, until=None, failed=False, limiter=None,
+          concurrency=1, dry_run=False):
+    """
+    Set *status* on the runs of *pipeline* chosen by
+    :func:`matching_runs`, unless *dry_run* is set.
+
+    Returns a dict with the pipeline's name, the matching runs and the
+    ids of any whose status could not be set. Pipelines that have not
+    been deployed have no matching runs.
+    """
+    until = until or datetime.utcnow()
+    runs = matching_runs(pipeline, status, since, until, failed)
+    errors = []
+    if runs and not dry_run:
+        errors = set_status(pipeline.conn, pipeline.deployed_id(),
+                            [run.id for run in runs], status, limiter,
+                            concurrency)
+    return {
+        'name': pipeline.name,
+        'status': status,
+        'dry_run': dry_run,
+        'runs': [run.to_json() for run in runs],
+        'errors': errors,
+    }
+
+
+def format_results(results):
+    """
+    Return lines listing the runs in *results* from :func:`apply`.
+    """
+    lines = []
+    for result in results:
+        verb = result['dry_run'] and 'Would set' or 'Set'
+        lines.append("{0} {1} on {2} runs of {3}".format(
+            verb, result['status'], len(result['runs']) -
+            len(result['errors']), result['name']))
+        errors = set(result['errors'])
+        for run in result['runs']:
+            lines.append("  {0:<40} {1:<16} {2:<19}{3}".format(
+                run['id'], run['status'] or '-',
+                run['scheduled_start'] or '-',
+                run['id'] in errors and '  (failed)' or ''))
+    return lines
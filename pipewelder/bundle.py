@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Upload a pipeline directory as one compressed bundle.
+
+Data Pipeline stages every object under ``myS3InputDir`` at the start
+of each run, so a pipeline with hundreds of task files pays for
+hundreds of downloads per run, and as many PUTs per upload. In bundle
+mode the input directory instead holds two objects: a deterministic
+tar.gz of the pipeline directory, named by its hash, and a generated
+``run`` wrapper that unpacks it and executes the pipeline's own ``run``.
+Templates that ``chmod +x run && ./run`` in the staging directory work
+unchanged. Bundles are built in a temporary directory rather than in
+memory, and large ones are uploaded in parts.
+"""
+
+import os
+import gzip
+import stat
+import shutil
+import tarfile
+import tempfile
+
+from pipewelder import util, storage, hashing
+
+BUNDLE_PREFIX = 'pipewelder-bundle-'
+BUNDLE_SUFFIX = '.tar.gz'
+WRAPPER_NAME = 'run'
+WRAPPER = """#!/bin/sh
+# Generated by Pipewelder: unpacks the pipeline bundle and runs it.
+set -e
+cd "$(dirname "$0")"
+mkdir -p bundle
+tar -xzf {bundle} -C bundle
+cd bundle
+exec ./run "$@"
+"""
+
+
+def build(dirpath, path):
+    """
+    Write a tar.gz of the files beneath *dirpath* to *path*.
+
+    Entries are sorted and carry no timestamps or ownership, so the
+    same files always produce the same bundle.
+    """
+    with open(path, 'wb') as out:
+        gz = gzip.GzipFile(filename='', mode='wb', fileobj=out, mtime=0)
+        tar = tarfile.open(fileobj=gz, mode='w', format=tarfile.GNU_FORMAT)
+        for name in util.walk_files(dirpath):
+            local_path = os.path.join(dirpath, name)
+            executable = os.stat(local_path).st_mode & stat.S_IXUSR
+            info = tarfile.TarInfo(name.replace(os.sep, '/'))
+            info.size = os.path.getsize(local_path)
+            info.mode = executable and 0o755 or 0o644
+            with open(local_path, 'rb') as f:
+                tar.addfile(info, f)
+        tar.close()
+        gz.close()
+
+
+def bundle_name(digest):
+    """
+    Return the file name of the bundle with hex *digest*.
+    """
+    return BUNDLE_PREFIX + digest + BUNDLE_SUFFIX
+
+
+def wrapper(name):
+    """
+    Return a ``run`` script that unpacks bundle *name* and runs it.
+    """
+    return WRAPPER.format(bundle=name)
+
+
+def upload(bucket, input_dir, dirpath):
+    """
+    Upload the bundle of *dirpath* and its wrapper to *input_dir* in
+    *bucket*, skipping objects that are already there, then delete any
+    other objects in *input_dir*.
+
+    Returns ``True`` if successful.
+    """
+    staging = tempfile.mkdtemp(prefix='pipewelder-')
+    try:
+        built = os.path.join(staging, 'bundle' + BUNDLE_SUFFIX)
+        build(dirpath, built)
+        digests = hashing.hash_file(built, [hashing.SHA1, hashing.ETAG])
+        name = bundle_name(digests[hashing.SHA1])
+        contents = os.path.join(staging, 'contents')
+        os.mkdir(contents)
+        os.rename(built, os.path.join(contents, name))
+        with open(os.path.join(contents, WRAPPER_NAME), 'w') as f:
+            f.write(wrapper(name))
+        # the wrapper is replaced only once its bundle is in place
+        hashes = [(name, digests), (WRAPPER_NAME, hashing.hash_file(
+            os.path.join(contents, WRAPPER_NAME), [hashing.ETAG]))]
+        return storage.publish_files(bucket, input_dir, contents,
+                                     hashes=hashes)
+    finally:
+        shutil.rmtree(staging)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Work out which pipelines are affected by changed files.
+"""
+
+import os
+import subprocess
+
+
+def changed_paths(ref, cwd=None):
+    """
+    Return the set of absolute paths that differ between git *ref* and
+    the working tree of the repository containing *cwd*.
+
+    Uncommitted and untracked (but not ignored) files are included.
+    Only the local repository is consulted. Raises :class:`ValueError`
+    if *ref* cannot be resolved or git fails.
+    """
+    top = _git(['rev-parse', '--show-toplevel'], cwd).strip()
+    try:
+        _git(['rev-parse', '--verify', '--quiet', ref + '^{commit}'], top)
+    except ValueError:
+        raise ValueError("Unknown git revision '{0}'".format(ref))
+    names = _git(['diff', '--name-only', '--no-renames', '-z', ref, '--'],
+                 top).split('\0')
+    names += _git(['ls-files', '--others', '--exclude-standard', '-z'],
+                  top).split('\0')
+    return set(os.path.join(top, name) for name in names if name)
+
+
+def affected_dirs(config, paths, config_path=None):
+    """
+    Return those of *config*'s pipeline directories affected by changes
+    to *paths*.
+
+    A change to the configuration's template, or to *config_path*,
+    affects every directory.
+    """
+    shared = [config['template']]
+    if config_path is not None:
+        shared.append(config_path)
+    if affected(paths, [os.path.realpath(path) for path in shared]):
+        return list(config['dirs'])
+    dirs = dict((os.path.realpath(d), d) for d in config['dirs'])
+    return [dirs[d] for d in affected(paths, sorted(dirs))]
+
+
+def affected(paths, targets):
+    """
+    Return those of *targets* which are among *paths*, lie beneath one of
+    them, or contain one of them. All paths must be absolute.
+    """
+    paths = set(paths)
+    lineages = set(p for path in paths for p in _lineage(path))
+    return [target for target in targets
+            if target in lineages or not paths.isdisjoint(_lineage(target))]
+
+
+def _lineage(path):
+    """
+    Yield *path* followed by each of its parent directories.
+    """
+    path = os.path.normpath(path)
+    while True:
+        yield path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return
+        path = parent
+
+
+def _git(args, cwd=None):
+    try:
+        process = subprocess.Popen(['git'] + args, cwd=cwd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError as e:
+        raise ValueError("Unable to run git; {0}".format(e))
+    out, err = process.communicate()
+    if process.returncode != 0:
+        raise ValueError("'git {0}' failed; {1}".format(
+            ' '.join(args), err.decode('utf-8', 'replace').strip()))
+    return out.decode('utf-8')
@@ -8,22 +8,50 @@ from __future__ import print_function
 
 import argparse
 import os
+import json
 import sys
+import time
+import logging
+import threading
+import boto
 import boto.datapipeline
 
 from glob import glob
+from datetime import datetime
+from collections import defaultdict
 
-from pipewelder import metadata, util, Pipewelder
+from pipewelder import (metadata, util, profiling, tracing, transport, watch,
+                        changes, journal, schedule, sharding, local, status,
+                        instances, history, rightsize, bulk, logs,
+                        Pipewelder)
+from pipewelder.core import (ON_ERROR_POLICIES, CONTINUE, parse_period,
+                             PIPELINE_DATETIME_FORMAT)
 
-import logging
 logging.basicConfig(level="INFO")
 
 
+ACTIONS = ['validate', 'put-definition', 'upload', 'activate', 'delete',
+           'clean']
+COMMANDS = ['watch', 'schedule', 'run-local', 'status', 'durations',
+            'rightsize', 'rerun', 'cancel', 'logs']
+OFFLINE_COMMANDS = ['schedule', 'run-local']
+# commands taking the remaining arguments as operands, not actions
+OPERAND_COMMANDS = ['run-local', 'logs']
+# commands setting the status of runs, for which --since is a time
+RUN_COMMANDS = {'rerun': bulk.RERUN, 'cancel': bulk.CANCEL}
+DEFAULT_RUNS_SINCE = '1 days'
 CONFIG_DEFAULTS = {
     "dirs": ["*"],
     "region": "",
     "template": "pipeline_definition.json",
-    "values": [],
+    "values": {},
+    "stagger": None,
+    "packing": None,
+    "profile": None,
+    "shards": None,
+    "upload": "files",
+    "blob_store": None,
+    "versioned": False,
 }
 
 
@@ -56,48 +84,353 @@ URL: <{url}>
         action='version',
         version='{0} {1}'.format(metadata.project, metadata.version))
     parser.add_argument(
-        'action',
-        help="""Action to take:
+        'actions',
+        nargs='+',
+        metavar='action',
+        help="""Actions to take, in order, stopping at the first failure:
         'validate' pipeline definitions with AWS;
         'put-definition' of pipelines to AWS;
         'upload' pipeline files to myInputS3Dir;
         'activate' defined pipelines (also puts definitions if needed);
-        'delete' pipelines from AWS
+        'delete' pipelines from AWS;
+        'clean' out pipelines' myS3OutputDir and myS3LogDir;
+        or a single command:
+        'watch' the current directory, redeploying pipelines as they change;
+        'schedule' simulation of when pipelines launch instances;
+        'run-local' [DIR ...] to run pipelines here with emulated
+        data staging (all pipelines if no DIR is given);
+        'status' of deployed pipelines' recent runs;
+        'durations' of deployed pipelines' runs, against their
+        myTerminateAfter and schedule period;
+        'rightsize' to recommend each pipeline's instance type and
+        myTerminateAfter from its runs;
+        'rerun' deployed pipelines' runs, such as those that failed;
+        'cancel' deployed pipelines' runs not yet done;
+        'logs' [PIPELINE ...] to print the output of pipelines' latest
+        runs (all pipelines if no PIPELINE is given)
         """)
     parser.add_argument(
         '--group',
         default=None,
         help="Group within pipewelder.json to act on; defaults to all")
+    parser.add_argument(
+        '--since',
+        default=None,
+        metavar='REF',
+        help="""Only act on pipelines whose files changed since git
+        revision REF, including uncommitted and untracked files;
+        changes to a template or pipewelder.json affect every pipeline
+        using them. For 'rerun' and 'cancel', REF is instead a period
+        back from now, such as '6 hours', or a UTC time such as
+        2015-01-31T12:00:00, and only runs scheduled since then are
+        affected (default: {0})""".format(DEFAULT_RUNS_SINCE))
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=4,
+        metavar='N',
+        help="""Number of pipelines to act on at once within each group;
+        groups themselves are always acted on concurrently""")
+    parser.add_argument(
+        '--keep-going',
+        action='store_true',
+        help="""Keep acting on other groups when one fails, rather than
+        stopping them after their current action""")
+    parser.add_argument(
+        '--on-error',
+        choices=ON_ERROR_POLICIES,
+        default=CONTINUE,
+        help="""When a pipeline fails, 'continue' with the remaining
+        pipelines (the default) or stop the action at once with
+        'fail-fast'""")
+    parser.add_argument(
+        '--journal',
+        default=None,
+        metavar='PATH',
+        help="""Append each completed per-pipeline step to PATH, removing
+        a group's entries once all its actions succeed""")
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="""Skip steps the journal shows were already completed for
+        unchanged pipelines, e.g. after an interrupted run; also keeps a
+        journal, in {0} unless --journal is given""".format(
+            journal.DEFAULT_PATH))
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=0.5,
+        metavar='SECONDS',
+        help="""For 'watch', how long changes must settle before
+        pipelines are redeployed""")
+    parser.add_argument(
+        '--poll',
+        action='store_true',
+        help="For 'watch', poll for changes instead of using inotify")
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=1.0,
+        metavar='SECONDS',
+        help="For 'watch', seconds between scans when polling")
+    parser.add_argument(
+        '--horizon',
+        default='7 days',
+        metavar='PERIOD',
+        help="""For 'schedule', how far ahead to simulate
+        (default: %(default)s)""")
+    parser.add_argument(
+        '--hotspots',
+        type=int,
+        default=5,
+        metavar='N',
+        help="For 'schedule', how many launch hotspots to list")
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        metavar='N',
+        help="For 'run-local', number of pipelines to run at once")
+    parser.add_argument(
+        '--output-dir',
+        default=local.DEFAULT_OUTPUT_DIR,
+        metavar='PATH',
+        help="""For 'run-local', where to collect staged outputs
+        (default: %(default)s)""")
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=status.DEFAULT_RUNS,
+        metavar='N',
+        help="""For 'status' and 'logs', how many recent runs to show per
+        pipeline (default: %(default)s)""")
+    parser.add_argument(
+        '--window',
+        default=None,
+        metavar='PERIOD',
+        help="""For 'status', how far back to look for runs (default:
+        enough of each pipeline's schedule periods to hold --runs); for
+        'durations' and 'rightsize', which runs to analyze
+        (default: {0})"""
+        .format(history.DEFAULT_WINDOW))
+    parser.add_argument(
+        '--format',
+        choices=['table', 'json'],
+        default='table',
+        help="""For 'status', 'durations', 'rightsize', 'rerun' and
+        'cancel', how to print results""")
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=status.DEFAULT_CACHE_TTL,
+        metavar='SECONDS',
+        help="""For 'status', how long to reuse runs looked up by
+        earlier invocations; 0 disables the cache (default: %(default)s)""")
+    parser.add_argument(
+        '--history',
+        default=history.DEFAULT_PATH,
+        metavar='PATH',
+        help="""For 'durations' and 'rightsize', where to keep runs
+        between invocations, so that only new runs are looked up
+        (default: %(default)s)""")
+    parser.add_argument(
+        '--catalog',
+        default=None,
+        metavar='PATH',
+        help="""For 'rightsize', a JSON file mapping instance types to
+        their relative "speed" and hourly "price" (default: a built-in
+        catalog of common types)""")
+    parser.add_argument(
+        '--write',
+        action='store_true',
+        help="""For 'rightsize', write the recommendations into each
+        pipeline's values.json""")
+    parser.add_argument(
+        '--follow',
+        action='store_true',
+        help="""For 'logs', keep printing the output of new runs as it
+        lands""")
+    parser.add_argument(
+        '--follow-interval',
+        type=float,
+        default=logs.DEFAULT_FOLLOW_INTERVAL,
+        metavar='SECONDS',
+        help="""For 'logs --follow', seconds between checks for new runs
+        (default: %(default)s)""")
+    parser.add_argument(
+        '--tail',
+        type=int,
+        default=logs.DEFAULT_TAIL_BYTES,
+        metavar='BYTES',
+        help="""For 'logs', how much of the end of each run's output to
+        print; 0 prints all of it (default: %(default)s)""")
+    parser.add_argument(
+        '--failed',
+        action='store_true',
+        help="For 'rerun', rerun the runs that failed or timed out")
+    parser.add_argument(
+        '--all',
+        action='store_true',
+        help="""For 'rerun', rerun every run that is done, including
+        those that finished""")
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help="""For 'rerun' and 'cancel', list the runs that would be
+        affected without changing them""")
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=bulk.DEFAULT_RATE,
+        metavar='N',
+        help="""For 'rerun' and 'cancel', most status changes to send
+        per second, across all pipelines (default: %(default)s)""")
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="""Profile the action, writing pstats, collapsed stacks
+        (for flamegraphs) and per-phase timings""")
+    parser.add_argument(
+        '--profile-output',
+        default='pipewelder-profile',
+        metavar='PREFIX',
+        help="Path prefix for --profile output files")
+    parser.add_argument(
+        '--trace',
+        default=None,
+        metavar='PATH',
+        help="Append timing spans to PATH as JSON lines")
+    parser.add_argument(
+        '--trace-otel',
+        action='store_true',
+        help="""Send timing spans to the globally configured
+        OpenTelemetry tracer provider (requires opentelemetry-api)""")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        '--record',
+        default=None,
+        metavar='CASSETTE',
+        help="Record all AWS API interactions, with timing, to CASSETTE")
+    cassette_group.add_argument(
+        '--replay',
+        default=None,
+        metavar='CASSETTE',
+        help="Answer AWS API calls from CASSETTE without network access")
+    parser.add_argument(
+        '--replay-speed',
+        type=float,
+        default=1.0,
+        metavar='FACTOR',
+        help="""Speed-up factor for recorded latencies when replaying;
+        0 replays without delay""")
 
     args = parser.parse_args(args=argv[1:])
-    args.action = args.action.replace('-', '_')
+    args.operands = []
+    if args.actions[0] in OPERAND_COMMANDS:
+        args.operands = args.actions[1:]
+        args.actions = args.actions[:1]
+    offline = args.actions[0] in OFFLINE_COMMANDS
+    if args.actions[0] in COMMANDS:
+        if len(args.actions) > 1:
+            parser.error("'{0}' cannot be combined with other actions"
+                         .format(args.actions[0]))
+    else:
+        for action in args.actions:
+            if action not in ACTIONS:
+                parser.error("Unknown action '{0}'; choose from {1}"
+                             .format(action, ', '.join(ACTIONS + COMMANDS)))
+    args.actions = [action.replace('-', '_') for action in args.actions]
+
+    args.changed_paths = None
+    if args.actions[0] in RUN_COMMANDS:
+        if args.actions[0] == 'cancel':
+            if args.failed or args.all:
+                parser.error("--failed and --all cannot be used with "
+                             "'cancel'")
+        elif args.failed == args.all:
+            parser.error("'rerun' needs one of --failed, or --all to rerun "
+                         "finished runs too")
+        try:
+            args.since_time = runs_since(args.since or DEFAULT_RUNS_SINCE)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.since:
+        if args.actions == ['watch']:
+            parser.error("--since cannot be used with 'watch'")
+        try:
+            args.changed_paths = changes.changed_paths(args.since)
+        except ValueError as e:
+            parser.error(str(e))
+
+    for option in ['horizon', 'window']:
+        value = getattr(args, option)
+        try:
+            if value is not None:
+                parse_period(value)
+        except ValueError as e:
+            parser.error("--{0}: {1}".format(option, e))
 
     defaults = {}
 
-    if 'AWS_ACCESS_KEY_ID' not in os.environ:
-        parser.error("Must set AWS_ACCESS_KEY_ID")
-    if 'AWS_SECRET_ACCESS_KEY' not in os.environ:
-        parser.error("Must set AWS_SECRET_ACCESS_KEY")
+    if not args.replay and not offline and \
+            not uses_profiles('pipewelder.json'):
+        if 'AWS_ACCESS_KEY_ID' not in os.environ:
+            parser.error("Must set AWS_ACCESS_KEY_ID")
+        if 'AWS_SECRET_ACCESS_KEY' not in os.environ:
+            parser.error("Must set AWS_SECRET_ACCESS_KEY")
     if 'AWS_DEFAULT_REGION' in os.environ:
         defaults['region'] = os.environ['AWS_DEFAULT_REGION']
 
-    config_path = (os.path.exists('pipewelder.json') and
-                   'pipewelder.json' or None)
-    configs = pipewelder_configs(config_path, defaults)
-    print("Reading configuration from {0}".format(config_path))
+    api_transport = None
+    if args.record:
+        api_transport = transport.RecordingTransport()
+    elif args.replay:
+        cassette = transport.Cassette.load(args.replay)
+        api_transport = transport.ReplayTransport(cassette, args.replay_speed)
 
-    for name, config in configs.items():
-        if args.group and args.group != name:
-            continue
-        if name == 'defaults':
-            continue
-        print("Acting on configuration '{0}'".format(name))
-        conn = boto.datapipeline.connect_to_region(config['region'])
-        pw = build_pipewelder(conn, config)
-        if not execute_pipewelder_action(pw, args.action):
-            return 1
+    exporters = []
+    if args.trace:
+        exporters.append(tracing.FileExporter(args.trace))
+    if args.trace_otel:
+        try:
+            exporters.append(tracing.OpenTelemetryExporter())
+        except ImportError as e:
+            parser.error(str(e))
+    for exporter in exporters:
+        tracing.add_exporter(exporter)
 
-    return 0
+    profiler = None
+    if args.profile:
+        profiler = profiling.Profiler()
+        profiler.start()
+    try:
+        with tracing.span('pipewelder.run', actions=' '.join(args.actions)):
+            if args.actions == ['watch']:
+                return watch_configs(args, defaults, api_transport)
+            if args.actions == ['schedule']:
+                return schedule_configs(args, defaults)
+            if args.actions == ['run_local']:
+                return run_local_configs(args, defaults)
+            if args.actions == ['status']:
+                return status_configs(args, defaults, api_transport)
+            if args.actions == ['durations']:
+                return durations_configs(args, defaults, api_transport)
+            if args.actions == ['rightsize']:
+                return rightsize_configs(args, defaults, api_transport)
+            if args.actions[0] in RUN_COMMANDS:
+                return set_status_configs(args, defaults, api_transport)
+            if args.actions == ['logs']:
+                return logs_configs(args, defaults, api_transport)
+            return act_on_configs(args, defaults, api_transport)
+    finally:
+        if api_transport is not None:
+            report_transport(api_transport, args.record)
+        if profiler is not None:
+            profiler.stop()
+            report_profile(profiler, args.profile_output)
+        for exporter in exporters:
+            tracing.remove_exporter(exporter)
+            exporter.close()
 
 
 def entry_point():
@@ -107,19 +440,624 @@ def entry_point():
     raise SystemExit(main(sys.argv))
 
 
-def build_pipewelder(conn, config):
+def act_on_configs(args, defaults, api_transport=None):
+    """
+    Execute *args.actions* for each configuration in pipewelder.json.
+
+    Configurations are acted on concurrently, each with its own
+    connections. The actions for a configuration run in order on a single
+    :class:`Pipewelder`, so cached pipeline state is shared between them.
+    Unless *args.keep_going* is set, a failure in one configuration stops
+    the others once their current action completes.
+
+    If *api_transport* is given, AWS API calls are routed through it.
+
+    If *args.changed_paths* is set, only pipelines affected by changes
+    to those paths are acted on.
+
+    Returns a process exit code.
+    """
+    config_path = find_config()
+    with profiling.phase('config discovery'):
+        configs = pipewelder_configs(config_path, defaults)
+    print("Reading configuration from {0}".format(config_path))
+
+    selected = selected_configs(configs, args.group)
+    if args.changed_paths is not None:
+        for config in selected:
+            config['dirs'] = changes.affected_dirs(
+                config, args.changed_paths, config_path)
+        print("{0} pipelines changed since {1}".format(
+            sum(len(config['dirs']) for config in selected), args.since))
+    stop = threading.Event()
+    welders = {}
+
+    def act(config):
+        result = act_on_config(config, args, api_transport, stop, welders)
+        if result['failed'] and not args.keep_going:
+            stop.set()
+        return result
+
+    results = util.parallel_map(act, selected, len(selected))
+    if 'activate' in args.actions:
+        warn_stale_shards(selected, welders)
+    print_summary(results)
+    if any(result['failed'] for result in results):
+        return 1
+    return 0
+
+
+def act_on_config(config, args, api_transport=None, stop=None,
+                  welders=None):
     """
-    Return a Pipewelder object defined by *config*.
+    Execute *args.actions* for a single configuration.
+
+    Remaining actions are skipped once the *stop* event is set.
+    The configuration's :class:`Pipewelder` is stored by name in
+    *welders*, if given.
+    Returns a dict summarizing what was done.
+    """
+    name = config['name']
+    result = {'name': name, 'region': config['region'], 'pipelines': 0,
+              'completed': [], 'failed': None, 'skipped': [], 'seconds': 0.0}
+    started = time.time()
+    with tracing.span('pipewelder.group', group=name):
+        try:
+            print("Acting on configuration '{0}'".format(name))
+            conn, s3_conn = connect(config, api_transport)
+            steps = None
+            if args.journal or args.resume:
+                steps = journal.Journal(args.journal or journal.DEFAULT_PATH,
+                                        name, args.resume)
+            pw = build_pipewelder(
+                conn, config, s3_conn, args.concurrency, args.on_error,
+                steps)
+            if pw is None:
+                result['failed'] = 'load'
+            else:
+                result['pipelines'] = len(pw.pipelines)
+                if welders is not None:
+                    welders[name] = pw
+            for action in args.actions:
+                if result['failed'] or (stop is not None and stop.is_set()):
+                    result['skipped'].append(action)
+                elif execute_pipewelder_action(pw, action):
+                    result['completed'].append(action)
+                else:
+                    result['failed'] = action
+            if pw is not None:
+                pw.wait()
+            if steps is not None and not result['failed'] and \
+                    not result['skipped']:
+                steps.reset()
+        except Exception:
+            logging.exception("Error acting on configuration '%s'", name)
+            result['failed'] = result['failed'] or 'error'
+    result['seconds'] = time.time() - started
+    return result
+
+
+def warn_stale_shards(configs, welders):
     """
+    Warn about pipelines of sharded groups that are still deployed in a
+    shard of *configs* other than the one they are now assigned to, as
+    happens when shards or quotas change; the old copies keep running
+    until deleted. *welders* maps configuration names to their loaded
+    :class:`Pipewelder`.
+    """
+    groups = defaultdict(list)
+    for config in configs:
+        pw = welders.get(config['name'])
+        if pw is not None and config['name'] != config['group']:
+            groups[config['group']].append((config, pw))
+    for group, shards in sorted(groups.items()):
+        for config, pw in shards:
+            target = (config['region'], config['profile'])
+            elsewhere = [(unit.name, unit.unique_id)
+                         for other_config, other in shards
+                         if (other_config['region'],
+                             other_config['profile']) != target
+                         for unit in other.units()]
+            found = pw.index.existing_ids(elsewhere)
+            for (name, unique_id), pipeline_id in sorted(found.items()):
+                if pipeline_id is None:
+                    continue
+                logging.warning("Pipeline '%s' of group '%s' is assigned to "
+                                "another shard but is still deployed in %s "
+                                "as %s; delete it there to avoid duplicate "
+                                "runs", name, group,
+                                sharding.describe_target(config),
+                                pipeline_id)
+
+
+def watch_configs(args, defaults, api_transport=None):
+    """
+    Redeploy pipelines as files beneath the current directory change,
+    until interrupted.
+
+    Connections are opened once per region and credential profile, and
+    each configuration's :class:`Pipewelder` is kept loaded, so only the
+    pipelines affected by a change are validated, uploaded and activated
+    again.
+
+    Returns a process exit code.
+    """
+    connections = {}
+
+    def load_selected():
+        configs = load_configs(defaults)
+        return dict((config['name'], config)
+                    for config in selected_configs(configs, args.group))
+
+    def build(config):
+        target = (config['region'], config['profile'])
+        if target not in connections:
+            connections[target] = connect(config, api_transport)
+        conn, s3_conn = connections[target]
+        return build_pipewelder(conn, config, s3_conn, args.concurrency)
+
+    observer = watch.observer('.', args.poll_interval, args.poll)
+    watcher = watch.Watcher(load_selected, build, observer, args.debounce)
+    with profiling.phase('config discovery'):
+        watcher.start()
+    print("Watching {0} for changes; press Ctrl-C to stop"
+          .format(os.getcwd()))
     try:
-        pw = Pipewelder(conn, config['template'])
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        observer.close()
+    return 0
+
+
+def schedule_configs(args, defaults):
+    """
+    Simulate the schedules of each region's pipelines over *args.horizon*,
+    printing peak concurrency, launch hotspots and expected instance-hours.
+
+    No AWS connections are made. Returns a process exit code.
+    """
+    configs = load_configs(defaults)
+    start = datetime.utcnow().replace(second=0, microsecond=0)
+    horizon = parse_period(args.horizon)
+    minutes = horizon.days * 24 * 60 + horizon.seconds // 60
+    schedules = defaultdict(list)
+    for config in selected_configs(configs, args.group):
+        pw = build_pipewelder(None, config)
+        if pw is None:
+            return 1
+        for pipeline in sorted(pw.units(), key=lambda p: p.name):
+            try:
+                schedules[config['region']].append(
+                    schedule.Schedule.from_pipeline(pipeline, start))
+            except ValueError as e:
+                print("Skipping pipeline '{0}'; {1}".format(pipeline.name, e))
+    for region, region_schedules in sorted(schedules.items()):
+        simulation = schedule.Simulation(region_schedules, minutes, start)
+        print_simulation(region, simulation, args.horizon, args.hotspots)
+    return 0
+
+
+def run_local_configs(args, defaults):
+    """
+    Run the pipelines in *args.operands* (or all pipelines in the
+    selected configurations) on this machine, emulating data staging,
+    with up to *args.processes* at once. Outputs are collected in
+    ``<args.output_dir>/<group>/<pipeline>``. Prints each run's outcome
+    and duration.
+
+    Returns a process exit code.
+    """
+    configs = load_configs(defaults)
+    jobs = []
+    found = set()
+    wanted = set(os.path.abspath(d) for d in args.operands)
+    for config in selected_configs(configs, args.group):
+        for dirpath in config['dirs']:
+            path = os.path.abspath(dirpath)
+            if wanted and path not in wanted:
+                continue
+            found.add(path)
+            jobs.append((dirpath, config['template'], config['values'],
+                         os.path.join(args.output_dir, config['name'])))
+    for path in sorted(wanted - found):
+        print("No pipeline configured in {0}".format(path))
+        return 1
+    started = time.time()
+    results = local.run_all(jobs, args.processes)
+    for result in sorted(results, key=lambda r: r['name']):
+        if result['ok']:
+            outcome = 'ok'
+        elif result['returncode'] is not None:
+            outcome = 'FAILED (exit {0})'.format(result['returncode'])
+        else:
+            outcome = 'FAILED ({0})'.format(result['error'])
+        print("{0:<32} {1:>8.2f}s {2} {3}".format(
+            result['name'], result['seconds'], outcome,
+            result['output'] or ''))
+    print("Ran {0} pipelines in {1:.2f}s".format(
+        len(results), time.time() - started))
+    if all(result['ok'] for result in results):
+        return 0
+    return 1
+
+
+def status_configs(args, defaults, api_transport=None):
+    """
+    Print the last *args.runs* runs of each deployed pipeline, as a table
+    or as JSON according to *args.format*.
+
+    Pipelines are looked up *args.concurrency* at once. Runs looked up
+    within the last *args.cache_ttl* seconds are reused.
+
+    Returns a process exit code: 1 if any shown run failed.
+    """
+    configs = load_configs(defaults)
+    window = args.window and parse_period(args.window)
+    cache = status.StatusCache(ttl=args.cache_ttl)
+    statuses = []
+    for config in selected_configs(configs, args.group):
+        conn, s3_conn = connect(config, api_transport)
+        pw = build_pipewelder(conn, config, s3_conn)
+        if pw is None:
+            return 1
+        for result in status.fleet_status(
+                sorted(pw.units(), key=lambda p: p.name), args.runs, window,
+                cache, args.concurrency, config['name']):
+            result['group'] = config['name']
+            statuses.append(result)
+    cache.save()
+    if args.format == 'json':
+        print(json.dumps(statuses, indent=2, sort_keys=True))
+    else:
+        for line in status.format_table(statuses):
+            print(line)
+    if any(result['failures'] for result in statuses):
+        return 1
+    return 0
+
+
+def durations_configs(args, defaults, api_transport=None):
+    """
+    Print statistics on the durations of each deployed pipeline's runs
+    within *args.window*, as a table or as JSON according to
+    *args.format*.
+
+    Runs are kept in the history file *args.history*, so only runs
+    scheduled since the last invocation are looked up.
+    """
+    configs = load_configs(defaults)
+    since = datetime.utcnow() - parse_period(args.window or
+                                             history.DEFAULT_WINDOW)
+    hist = history.History(args.history)
+    reports = []
+    for config in selected_configs(configs, args.group):
+        conn, s3_conn = connect(config, api_transport)
+        pw = build_pipewelder(conn, config, s3_conn)
+        if pw is None:
+            return 1
+
+        def report(pipeline):
+            key = '{0}/{1}'.format(config['name'], pipeline.name)
+            return history.pipeline_report(hist, key, pipeline, since)
+        pipelines = sorted(pw.units(), key=lambda p: p.name)
+        instances.prefetch_ids(pipelines)
+        for result in util.parallel_map(report, pipelines, args.concurrency):
+            result['group'] = config['name']
+            reports.append(result)
+    hist.save()
+    if args.format == 'json':
+        print(json.dumps(reports, indent=2, sort_keys=True))
+    else:
+        for line in history.format_report(reports):
+            print(line)
+    return 0
+
+
+def rightsize_configs(args, defaults, api_transport=None):
+    """
+    Print a recommended instance type and myTerminateAfter for each
+    deployed pipeline, from its runs within *args.window* and the
+    instance types in *args.catalog*, writing them into values.json if
+    *args.write* is set.
+
+    Returns a process exit code: 1 if any pipeline could not be analyzed,
+    each of which is listed with the reason.
+    """
+    configs = load_configs(defaults)
+    since = datetime.utcnow() - parse_period(args.window or
+                                             history.DEFAULT_WINDOW)
+    try:
+        catalog = rightsize.load_catalog(args.catalog)
+    except ValueError as e:
+        print("Could not load instance type catalog: {0}".format(e))
+        return 1
+    hist = history.History(args.history)
+    recommendations = []
+    errors = []
+    try:
+        for config in selected_configs(configs, args.group):
+            conn, s3_conn = connect(config, api_transport)
+            pw = build_pipewelder(conn, config, s3_conn)
+            if pw is None:
+                return 1
+
+            def recommend(pipeline):
+                key = '{0}/{1}'.format(config['name'], pipeline.name)
+                try:
+                    return recommend_pipeline(args, hist, key, pipeline,
+                                              since, catalog)
+                except ValueError as e:
+                    errors.append(pipeline.name)
+                    return rightsize.unrecommended(pipeline.name, str(e))
+            pipelines = sorted(pw.units(), key=lambda p: p.name)
+            instances.prefetch_ids(pipelines)
+            for result in util.parallel_map(recommend, pipelines,
+                                            args.concurrency):
+                result['group'] = config['name']
+                recommendations.append(result)
+    finally:
+        hist.save()
+    if args.format == 'json':
+        print(json.dumps(recommendations, indent=2, sort_keys=True))
+    else:
+        for line in rightsize.format_recommendations(recommendations):
+            print(line)
+    if errors:
+        return 1
+    return 0
+
+
+def recommend_pipeline(args, hist, key, pipeline, since, catalog):
+    """
+    Return :func:`pipewelder.rightsize.recommend` for *pipeline*, from
+    its runs since datetime *since* recorded under *key* in *hist*,
+    writing it into values.json if *args.write* is set.
+
+    Raises ValueError if *pipeline*'s instance type or schedule period
+    cannot be found.
+    """
+    report = history.pipeline_report(hist, key, pipeline, since)
+    current, parameter = rightsize.instance_type_of(pipeline)
+    period = parse_period(pipeline._get_value('mySchedulePeriod'))
+    recommendation = rightsize.recommend(report, current, catalog,
+                                         util.total_seconds(period) / 60)
+    if args.write and recommendation['instance_type']:
+        if parameter is None or pipeline.dirpath is None:
+            logging.warning("Not writing recommendation for {0}: its "
+                            "instanceType is not a parameter"
+                            .format(pipeline.name))
+        else:
+            rightsize.write_values(pipeline, recommendation, parameter)
+    return recommendation
+
+
+def set_status_configs(args, defaults, api_transport=None):
+    """
+    Rerun or cancel, according to *args.actions*, the runs of each
+    deployed pipeline scheduled since *args.since_time*, or only list
+    them if *args.dry_run* is set.
+
+    Pipelines are looked up *args.concurrency* at once, and status
+    changes sent no faster than *args.rate* per second overall.
+
+    Returns a process exit code: 1 if any status could not be set.
+    """
+    configs = load_configs(defaults)
+    status = RUN_COMMANDS[args.actions[0]]
+    limiter = util.RateLimiter(args.rate, bulk.DEFAULT_BURST)
+    results = []
+    for config in selected_configs(configs, args.group):
+        conn, s3_conn = connect(config, api_transport)
+        pw = build_pipewelder(conn, config, s3_conn)
+        if pw is None:
+            return 1
+
+        def apply(pipeline):
+            return bulk.apply(pipeline, status, args.since_time,
+                              failed=args.failed, limiter=limiter,
+                              concurrency=args.concurrency,
+                              dry_run=args.dry_run)
+        pipelines = sorted(pw.units(), key=lambda p: p.name)
+        instances.prefetch_ids(pipelines)
+        for result in util.parallel_map(apply, pipelines, args.concurrency):
+            result['group'] = config['name']
+            results.append(result)
+    if args.format == 'json':
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for line in bulk.format_results(results):
+            print(line)
+    if any(result['errors'] for result in results):
+        return 1
+    return 0
+
+
+def logs_configs(args, defaults, api_transport=None, stop=None):
+    """
+    Print the output of the last *args.runs* runs of the pipelines
+    named in *args.operands* (or all pipelines in the selected
+    configurations), interleaved in order of their scheduled times.
+
+    With *args.follow*, keep printing the output of new runs until
+    interrupted or threading.Event *stop* is set.
+
+    Returns a process exit code.
+    """
+    configs = load_configs(defaults)
+    wanted = set(args.operands)
+    pipelines = []
+    for config in selected_configs(configs, args.group):
+        conn, s3_conn = connect(config, api_transport)
+        pw = build_pipewelder(conn, config, s3_conn)
+        if pw is None:
+            return 1
+        pipelines.extend(p for name, p in sorted(pw.pipelines.items())
+                         if not wanted or name in wanted)
+    for name in sorted(wanted - set(p.name for p in pipelines)):
+        print("No pipeline named {0}".format(name))
+        return 1
+    tailed = []
+    for pipeline in pipelines:
+        try:
+            logs.OutputLayout.of(pipeline)
+        except ValueError as e:
+            logging.warning("Skipping pipeline {0}: {1}"
+                            .format(pipeline.name, e))
+            continue
+        tailed.append(pipeline)
+    if pipelines and not tailed:
+        print("No pipelines with output to show")
+        return 1
+    tailer = logs.LogTailer(tailed, args.tail, args.concurrency)
+    if args.follow:
+        entries = tailer.follow(args.runs, args.follow_interval, stop)
+    else:
+        entries = tailer.latest(args.runs)
+    try:
+        for name, scheduled, text in entries:
+            for line in logs.format_entry(name, scheduled, text):
+                print(line)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def runs_since(value):
+    """
+    Return the datetime described by *value*: a period back from now or
+    a UTC time.
+    """
+    try:
+        return datetime.utcnow() - parse_period(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, PIPELINE_DATETIME_FORMAT)
+    except ValueError:
+        raise ValueError("'{0}' is neither a period nor a time like {1}"
+                         .format(value, PIPELINE_DATETIME_FORMAT))
+
+
+def print_simulation(region, simulation, horizon, hotspots=5):
+    """
+    Print a report of schedule *simulation* for *region*.
+    """
+    print("Region {0}: {1} pipelines over {2} from {3} UTC".format(
+        region or '(default)', len(simulation.schedules), horizon,
+        simulation.time_of(0)))
+    for label, series in [('Peak concurrent runs', simulation.concurrency),
+                          ('Peak launches per minute', simulation.launches)]:
+        count, minute = simulation.peak(series)
+        if minute is not None:
+            print("  {0:<26} {1:>7} at {2}".format(
+                label + ':', count, simulation.time_of(minute)))
+    print("  {0:<26} {1:>9.1f}".format('Expected instance-hours:',
+                                       simulation.instance_hours))
+    unbounded = [s.name for s in simulation.schedules if not s.bounded]
+    if unbounded:
+        print("  {0} pipelines have no myTerminateAfter; assuming each run "
+              "lasts a full period".format(len(unbounded)))
+    spots = simulation.hotspots(hotspots)
+    if spots:
+        print("  Launch hotspots:")
+    for minute, names in spots:
+        shown = ', '.join(names[:5])
+        if len(names) > 5:
+            shown += ' (+{0} more)'.format(len(names) - 5)
+        print("    {0} {1:>5} launches: {2}".format(
+            simulation.time_of(minute), len(names), shown))
+
+
+def print_summary(results):
+    """
+    Print one line per configuration describing the outcome of its actions.
+    """
+    print("Summary:")
+    for result in results:
+        if result['failed']:
+            outcome = "FAILED at '{0}'".format(result['failed'])
+        elif result['skipped']:
+            outcome = 'stopped'
+        else:
+            outcome = 'ok'
+        print("  {0:<20} {1:<12} {2:>5} pipelines {3:>8.1f}s  "
+              "{4}; completed: {5}".format(
+                  result['name'], result['region'], result['pipelines'],
+                  result['seconds'], outcome,
+                  ' '.join(result['completed']) or '-'))
+
+
+def connect(config, api_transport=None):
+    """
+    Return Data Pipeline and S3 connections for *config*.
+
+    If *api_transport* is given, it is installed on both connections.
+    """
+    credentials = {}
+    if config.get('profile'):
+        credentials = {'profile_name': config['profile']}
+    if api_transport is not None:
+        credentials = api_transport.credentials()
+    conn = boto.datapipeline.connect_to_region(config['region'],
+                                               **credentials)
+    s3_conn = boto.connect_s3(**credentials)
+    if api_transport is not None:
+        api_transport.install(conn)
+        api_transport.install(s3_conn)
+    return conn, s3_conn
+
+
+def report_transport(api_transport, cassette_path=None):
+    """
+    Summarize API calls seen by *api_transport*, saving a recording
+    to *cassette_path* if given.
+    """
+    if cassette_path:
+        api_transport.save(cassette_path)
+        print("Wrote API recording to {0}".format(cassette_path))
+    summary = api_transport.summary()
+    print("{0} API calls, {1:.3f}s of recorded latency:".format(
+        summary['total_calls'], summary['total_seconds']))
+    for operation in sorted(summary['calls']):
+        print("  {0:<32} {1:>7} calls {2:>9.3f}s".format(
+            operation, summary['calls'][operation],
+            summary['seconds'][operation]))
+
+
+def report_profile(profiler, prefix):
+    """
+    Write the results of *profiler* to files at *prefix* and summarize.
+    """
+    paths = profiler.write(prefix)
+    print("Profiled {0:.3f}s of wall-clock time:".format(
+        profiler.wall_seconds))
+    for name, seconds, calls in profiler.summary():
+        print("  {0:<24} {1:>9.3f}s {2:>7} calls".format(name, seconds, calls))
+    for path in paths:
+        print("Wrote profile data to {0}".format(path))
+
+
+def build_pipewelder(conn, config, s3_conn=None, concurrency=1,
+                     on_error=CONTINUE, journal=None):
+    """
+    Return a Pipewelder object defined by *config*,
+    or ``None`` if its template cannot be read.
+    """
+    try:
+        pw = Pipewelder(conn, config['template'], s3_conn, concurrency,
+                        config['values'], on_error, journal,
+                        config['stagger'], config['packing'],
+                        config['upload'], config['blob_store'],
+                        config['versioned'])
     except IOError as e:
         print(e)
-        return 1
+        return None
     for d in config['dirs']:
-        p = pw.add_pipeline(d)
-        for k, v in config["values"].items():
-            p.values[k] = v
+        pw.add_pipeline(d)
+    pw.stagger_pipelines()
     return pw
 
 
@@ -131,6 +1069,22 @@ def execute_pipewelder_action(pw, action):
     return return_value
 
 
+def find_config():
+    """
+    Return ``'pipewelder.json'`` if it is in the current directory,
+    otherwise ``None``.
+    """
+    return os.path.exists('pipewelder.json') and 'pipewelder.json' or None
+
+
+def load_configs(defaults=None):
+    """
+    Return the configurations in ``pipewelder.json`` in the current
+    directory, if any, with *defaults*; see :func:`pipewelder_configs`.
+    """
+    return pipewelder_configs(find_config(), defaults)
+
+
 def pipewelder_configs(filename=None, defaults=None):
     """
     Parse json from *filename* for Pipewelder object configurations.
@@ -160,16 +1114,77 @@ def pipewelder_configs(filename=None, defaults=None):
                 for item in glob(entry):
                     if os.path.exists(os.path.join(item, 'values.json')):
                         dirs.append(item)
-        outputs[name] = {
+        config = {
             "name": name,
+            "group": name,
             "dirs": dirs,
             "region": this_config['region'],
+            "profile": this_config['profile'],
             "template": this_config['template'],
             "values": this_config['values'],
+            "stagger": this_config['stagger'],
+            "packing": this_config['packing'],
+            "upload": this_config['upload'],
+            "blob_store": this_config['blob_store'],
+            "versioned": this_config['versioned'],
         }
+        if this_config['shards']:
+            for shard_config in sharded_configs(config,
+                                                this_config['shards']):
+                outputs[shard_config['name']] = shard_config
+        else:
+            outputs[name] = config
     return outputs
 
 
+def sharded_configs(config, shards):
+    """
+    Return a configuration for each of *shards*, a list of dicts from
+    pipewelder.json, splitting the pipeline directories of *config*
+    between them; see :mod:`pipewelder.sharding`.
+
+    Shard configurations are named ``<group>/<shard>``.
+    """
+    shards = [sharding.Shard.from_config(shard) for shard in shards]
+    assignment = sharding.assign(
+        [os.path.normpath(d) for d in config['dirs']], shards)
+    configs = []
+    for shard in shards:
+        configs.append(dict(
+            config,
+            name='{0}/{1}'.format(config['group'], shard.name),
+            dirs=[d for d in config['dirs']
+                  if assignment[os.path.normpath(d)] == shard.name],
+            region=shard.region,
+            profile=shard.profile or config['profile']))
+    return configs
+
+
+def uses_profiles(filename):
+    """
+    Return ``True`` if pipewelder.json at *filename* names credential
+    profiles, in which case credentials need not be in the environment.
+    """
+    if not os.path.exists(filename):
+        return False
+    data = util.load_json(filename)
+    for group in data.values():
+        if group.get('profile') or \
+                any(s.get('profile') for s in group.get('shards') or []):
+            return True
+    return False
+
+
+def selected_configs(configs, group=None):
+    """
+    Return the configurations in *configs* to act on, sorted by name;
+    only *group* (or its shards), if given.
+    """
+    return [config for name, config in sorted(configs.items())
+            if name != 'defaults' and
+            group in (None, name, config.get('group'))]
+
+
 def call_method(obj, name):
     """
     Call the method *name* on *obj*.
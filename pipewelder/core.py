@@ -7,16 +7,21 @@ from __future__ import print_function
 
 import re
 import os
+import json
+import time
+import random
 import logging
 import hashlib
+import threading
 from copy import deepcopy
 from datetime import datetime, timedelta
 
 from pipewelder import translator
 from boto import connect_s3
-from boto.s3.key import Key as S3Key
+from boto.exception import JSONResponseError
 
 from pipewelder import util
+from pipewelder import profiling, tracing, hashing, storage, bundle, blobs
 
 import six
 if six.PY2:
@@ -27,6 +32,24 @@ else:
 PIPELINE_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
 PIPELINE_FREQUENCY_RE = re.compile(r'(?P<number>\d+) (?P<unit>\w+s)')
 PIPELINE_PARAM_RE = re.compile(r'\#\{(my[a-zA-Z0-9]+)\}')
+DESCRIBE_PIPELINES_BATCH_SIZE = 25
+# throttled API requests are retried this many times, backing off
+# exponentially from this many seconds
+API_MAX_RETRIES = 6
+API_BACKOFF_SECONDS = 0.2
+THROTTLING_ERRORS = ['ThrottlingException', 'Throttling']
+FAIL_FAST = 'fail-fast'
+CONTINUE = 'continue'
+ON_ERROR_POLICIES = [FAIL_FAST, CONTINUE]
+STAGGER_HASH = 'hash'
+STAGGER_OPTIMIZE = 'optimize'
+STAGGER_MODES = [STAGGER_HASH, STAGGER_OPTIMIZE]
+UPLOAD_FILES = 'files'
+UPLOAD_BUNDLE = 'bundle'
+UPLOAD_BLOBS = 'blobs'
+UPLOAD_MODES = [UPLOAD_FILES, UPLOAD_BUNDLE, UPLOAD_BLOBS]
+# directories whose contents the 'clean' action deletes
+CLEANED_DIRS = ['myS3OutputDir', 'myS3LogDir']
 PIPEWELDER_STUB_PARAMS = {
     'name': "Pipewelder validation stub",
     'unique_id': 'stub',
@@ -41,7 +64,10 @@ class Pipewelder(object):
     """
     A collection of Pipelines sharing a definition template.
     """
-    def __init__(self, conn, template_path, s3_conn=None):
+    def __init__(self, conn, template_path, s3_conn=None, concurrency=1,
+                 values=None, on_error=CONTINUE, journal=None, stagger=None,
+                 packing=None, upload_mode=UPLOAD_FILES, blob_store=None,
+                 versioned=False):
         """
         *conn* is a :class:`boto.datapipeline.layer1.DataPipelineConnection`
         instance used to manipulate added pipelines,
@@ -49,29 +75,200 @@ class Pipewelder(object):
         used to upload pipeline tasks to S3,
         and *template_path* is the path to a local file containing the
         template pipeline definition.
+        Up to *concurrency* pipelines are acted on at once.
+        *values* override those read from each pipeline's values.json.
+
+        When a pipeline fails a step, the *on_error* policy either
+        stops the step for the remaining pipelines (``'fail-fast'``) or
+        logs the failure and carries on with them (``'continue'``).
+        Completed steps are recorded in *journal*, a
+        :class:`pipewelder.journal.Journal`, if given.
+        If *stagger* is ``'hash'`` or ``'optimize'``, pipeline start times
+        are spread out within their periods; see :meth:`stagger_pipelines`.
+        If *packing* is a dict, co-scheduled pipelines share resources;
+        its optional ``max_size`` and ``max_terminate_after`` keys are
+        passed to :func:`pipewelder.packing.pack`.
+        With *upload_mode* ``'bundle'``, each pipeline directory is
+        uploaded as a single archive; see :mod:`pipewelder.bundle`.
+        With ``'blobs'``, files are uploaded once each to the
+        content-addressed store at S3 URI *blob_store*; see
+        :mod:`pipewelder.blobs`.
+        If *versioned*, each upload goes to a new prefix that activation
+        switches pipelines to, and old versions are deleted in the
+        background; call :meth:`wait` to let that finish.
         """
+        if on_error not in ON_ERROR_POLICIES:
+            raise ValueError("Unknown error policy '{0}'".format(on_error))
+        if stagger not in STAGGER_MODES + [None]:
+            raise ValueError("Unknown stagger mode '{0}'".format(stagger))
+        if upload_mode not in UPLOAD_MODES:
+            raise ValueError("Unknown upload mode '{0}'".format(upload_mode))
+        if (upload_mode == UPLOAD_BLOBS) != (blob_store is not None):
+            raise ValueError("A blob store must be given with, and only "
+                             "with, the '{0}' upload mode"
+                             .format(UPLOAD_BLOBS))
         self.conn = conn
         self.s3_conn = s3_conn
+        self.concurrency = concurrency
+        self.values = dict(values or {})
+        self.on_error = on_error
+        self.journal = journal
+        self.stagger = stagger
+        self._staggered = False
+        self.packing = packing
+        self.upload_mode = upload_mode
+        self.versioned = versioned
+        self.background = util.Background()
+        self._units = None
         if self.s3_conn is None:
-            self.s3_conn = connect_s3()
-        template_path = os.path.normpath(template_path)
-        self.template = definition_from_file(template_path)
+            self.s3_conn = LazyConnection(connect_s3)
+        self.blob_store = None
+        if blob_store is not None:
+            self.blob_store = blobs.BlobStore(
+                self.s3_conn, *bucket_and_path(blob_store))
+        self.template_path = os.path.normpath(template_path)
+        self.load_template()
+        self.index = PipelineIndex(conn)
         self.pipelines = {}
 
+    def load_template(self):
+        """
+        (Re)read the template pipeline definition from disk.
+
+        Pipelines added afterwards are based on the new template.
+        """
+        with profiling.phase('template load'):
+            self.template = definition_from_file(self.template_path)
+        self._units = None
+
     def add_pipeline(self, dirpath):
         """
         Load a new :class:`Pipeline` object based on the files contained in
-        *dirpath*.
+        *dirpath*, replacing any pipeline previously loaded from there.
+
+        With ``'hash'`` staggering, or once :meth:`stagger_pipelines` has
+        been called, the new pipeline's start time is staggered at once.
         """
-        pipeline = Pipeline(self.conn, self.s3_conn, self.template, dirpath)
+        with profiling.phase('pipeline construction'):
+            pipeline = Pipeline(self.conn, self.s3_conn, self.template,
+                                dirpath, self.index)
+            for key, value in self.values.items():
+                pipeline.values[key] = value
+            if 'myStartDateTime' in self.values:
+                # staggering offsets the configured start time
+                pipeline.start_date_time = self.values['myStartDateTime']
+                pipeline.shift_start(0)
+            pipeline.upload_mode = self.upload_mode
+            pipeline.blob_store = self.blob_store
+            pipeline.versioned = self.versioned
+            pipeline.background = self.background
+        self.remove_pipeline(dirpath)
         self.pipelines[pipeline.name] = pipeline
+        self._units = None
+        if self.stagger == STAGGER_HASH or self._staggered:
+            self.stagger_pipelines([pipeline])
         return pipeline
 
+    def stagger_pipelines(self, pipelines=None):
+        """
+        Spread the start times of *pipelines* (by default, all of them)
+        within their periods, so they do not all launch at once.
+
+        ``'hash'`` staggering offsets each pipeline by a hash of its name;
+        ``'optimize'`` places pipelines to minimize the peak number of
+        concurrent runs, around those that are not being moved. Pipelines
+        pinned with ``"stagger": false`` in their values.json keep the
+        start time given there.
+        """
+        # schedule depends on this module, so is imported late
+        from pipewelder import schedule
+        if self.stagger is None:
+            return
+        self._staggered = True
+        self._units = None
+        if pipelines is None:
+            pipelines = list(self.pipelines.values())
+        movable = [p for p in pipelines if not p.pinned]
+        for pipeline in movable:
+            pipeline.shift_start(0)
+        if self.stagger == STAGGER_HASH:
+            # each offset is independent of the other pipelines
+            scheduled = movable
+        else:
+            scheduled = list(self.pipelines.values())
+        start = datetime.utcnow().replace(second=0, microsecond=0)
+        schedules = {}
+        for pipeline in scheduled:
+            try:
+                schedules[pipeline.name] = schedule.Schedule.from_pipeline(
+                    pipeline, start)
+            except ValueError as e:
+                logging.warning("Not staggering pipeline '{0}'; {1}"
+                                .format(pipeline.name, e))
+        movable = [p for p in movable if p.name in schedules]
+        if self.stagger == STAGGER_HASH:
+            offsets = dict(
+                (p.name, schedule.hash_offset(p.name,
+                                              schedules[p.name].period))
+                for p in movable)
+        else:
+            moving = set(p.name for p in movable)
+            offsets = schedule.optimized_offsets(
+                [schedules[name] for name in moving],
+                [s for name, s in schedules.items() if name not in moving])
+            # offsets are relative to the unstaggered start times
+            for name in moving:
+                current = schedules[name]
+                offsets[name] = (offsets[name] - current.offset) % \
+                    current.period
+        for pipeline in movable:
+            pipeline.shift_start(offsets[pipeline.name])
+
+    def remove_pipeline(self, dirpath):
+        """
+        Forget the pipeline loaded from *dirpath*, if any, and return it.
+
+        The pipeline is not deleted from AWS.
+        """
+        dirpath = os.path.normpath(dirpath)
+        for name, pipeline in list(self.pipelines.items()):
+            if pipeline.dirpath == dirpath:
+                self._units = None
+                return self.pipelines.pop(name)
+        return None
+
+    def units(self):
+        """
+        Return the pipelines to deploy: with packing, a
+        :class:`pipewelder.packing.PackedPipeline` stands in for each
+        group of pipelines sharing resources.
+        """
+        # packing depends on this module, so is imported late
+        from pipewelder import packing
+        if self._units is None:
+            if self.packing is None:
+                self._units = list(self.pipelines.values())
+            else:
+                with profiling.phase('pipeline construction'):
+                    self._units = packing.pack(self.pipelines.values(),
+                                               **self.packing)
+        return self._units
+
+    def unit_of(self, pipeline):
+        """
+        Return the unit from :meth:`units` that deploys *pipeline*.
+        """
+        for unit in self.units():
+            if unit is pipeline or pipeline in getattr(unit, 'members', ()):
+                return unit
+        return None
+
+    @tracing.traced
     def are_pipelines_valid(self):
         """
         Returns ``True`` if all pipeline definition validate with AWS.
         """
-        return all([p.is_valid() for p in self.pipelines.values()])
+        return self._each('is_valid')
 
     def validate(self):
         """
@@ -79,74 +276,387 @@ class Pipewelder(object):
         """
         return self.are_pipelines_valid()
 
+    @tracing.traced
     def upload(self):
         """
         Upload files to S3 corresponding to each pipeline and its tasks.
 
         Returns ``True`` is successful.
         """
-        return all([p.upload() for p in self.pipelines.values()])
+        return self._each('upload')
 
+    @tracing.traced
     def delete(self):
         """
-        Delete all pipeline definitions.
+        Delete all pipeline definitions, and any stale packs; see
+        :meth:`retire_stale_packs`.
 
         Returns ``True`` if successful.
         """
-        return all([p.delete() for p in self.pipelines.values()])
+        deleted = self._each('delete')
+        return self.retire_stale_packs() and deleted
 
+    @tracing.traced
     def put_definition(self):
         """
         Puts definitions for all pipelines.
 
         Returns ``True`` if successful.
         """
-        return all([p.put_definition() for p in self.pipelines.values()])
+        return self._each('put_definition')
 
+    @tracing.traced
     def activate(self):
         """
         Activate all pipeline definitions,
-        deleting existing pipeline if needed.
+        deleting existing pipeline if needed. Once all are active, stale
+        packs are deleted; see :meth:`retire_stale_packs`.
 
         Returns ``True`` if successful.
         """
         if not self.are_pipelines_valid():
             logging.error("Not activating pipelines due to validation errors.")
             return False
-        return all([p.activate() for p in self.pipelines.values()])
+        self.index.prefetch_states(self._map('create'))
+        return self._each('activate') and self.retire_stale_packs()
+
+    @tracing.traced
+    def retire_stale_packs(self):
+        """
+        With packing, delete packed pipelines in AWS holding pipelines of
+        this Pipewelder that are not among its current :meth:`units`,
+        as are left behind when packing keys or bins change; they would
+        otherwise keep running alongside the pipelines replacing them.
+
+        A pack belongs here if one of its members has the name of a
+        loaded pipeline and every tag of the pack, just as a pipeline is
+        identified by its name and tags.
+
+        Returns ``True`` if successful.
+        """
+        # packing depends on this module, so is imported late
+        from pipewelder import packing
+        if self.packing is None:
+            return True
+        current = set((unit.name, unit.unique_id) for unit in self.units())
+        succeeded = True
+        for description in self.index.describe_listed(packing.PACK_PREFIX):
+            pipeline_id = description['pipelineId']
+            key = (description['name'],
+                   fetch_field_value(description, 'uniqueId'))
+            tags = set((tag['key'], tag['value'])
+                       for tag in description.get('tags') or [])
+            members = [self.pipelines[name]
+                       for name in packing.members_of(description)
+                       if name in self.pipelines]
+            if key in current or \
+                    not any(tags <= set(m.tags.items()) for m in members):
+                continue
+            logging.info("Deleting stale pack '%s' with id %s",
+                         description['name'], pipeline_id)
+            try:
+                api_request(self.conn, 'delete_pipeline', pipeline_id)
+            except JSONResponseError:
+                logging.exception("Error deleting stale pack '%s'",
+                                  description['name'])
+                succeeded = False
+                continue
+            self.index.forget(pipeline_id)
+        return succeeded
+
+    @tracing.traced
+    def clean(self):
+        """
+        Delete the output and log files of all pipelines.
+
+        Returns ``True`` if successful.
+        """
+        return all(util.parallel_map(lambda p: p.clean(),
+                                     self.pipelines.values(),
+                                     self.concurrency))
+
+    def wait(self):
+        """
+        Wait for background work, such as deleting old versions, to finish.
+        """
+        self.background.join()
+
+    def _map(self, method):
+        """
+        Call *method* on each pipeline, returning the results in a list.
+        """
+        return util.parallel_map(lambda p: getattr(p, method)(),
+                                 self.units(), self.concurrency)
+
+    def _each(self, method):
+        """
+        Call *method* on each pipeline, returning ``True`` if all succeed.
+
+        Pipelines for which the journal shows *method* already done are
+        skipped. Failures are handled according to :attr:`on_error`;
+        under ``'fail-fast'``, exceptions propagate.
+        """
+        failed = threading.Event()
+
+        def step(pipeline):
+            if failed.is_set() and self.on_error == FAIL_FAST:
+                return False
+            if self.journal is not None and \
+                    self.journal.done(pipeline, method):
+                logging.info("Skipping '{0}' for pipeline '{1}'; "
+                             "already done".format(method, pipeline.name))
+                return True
+            try:
+                succeeded = getattr(pipeline, method)()
+            except Exception:
+                failed.set()
+                if self.on_error == FAIL_FAST:
+                    raise
+                logging.exception("Error in '%s' for pipeline '%s'",
+                                  method, pipeline.name)
+                return False
+            if not succeeded:
+                failed.set()
+            elif self.journal is not None:
+                self.journal.record(pipeline, method)
+            return succeeded
+        results = util.parallel_map(step, self.units(), self.concurrency)
+        return all(results)
+
+
+class LazyConnection(object):
+    """
+    A connection made by calling *factory* when it is first used,
+    so pipelines can be loaded and inspected without AWS credentials.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._factory()
+        return getattr(self._conn, name)
+
+
+class PipelineIndex(object):
+    """
+    Cached knowledge about pipelines reachable through one connection.
+
+    Pipelines added to the same :class:`Pipewelder` share an index, so
+    running several actions in a row does not repeat lookups of pipeline
+    ids, pipeline states or validation results.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.ids = {}
+        self.states = {}
+        self.validations = {}
+        self._lock = threading.Lock()
+        # ids of listed pipelines by name, and those already described
+        self._listed = None
+        self._described = set()
+        self._list_lock = threading.Lock()
+
+    def pipeline_id(self, name, unique_id, description=None, tags=None):
+        """
+        Return the id of the pipeline identified by *name* and *unique_id*,
+        creating it in AWS if it does not already exist; see
+        :meth:`existing_id` to look it up without creating it.
+        """
+        key = (name, unique_id)
+        with self._lock:
+            if key in self.ids:
+                return self.ids[key]
+        response = api_request(self.conn, 'create_pipeline',
+                               name, unique_id, description, tags)
+        with self._lock:
+            self.ids[key] = response['pipelineId']
+        return response['pipelineId']
+
+    def existing_id(self, name, unique_id):
+        """
+        Return the id of the pipeline identified by *name* and *unique_id*,
+        or ``None`` if it does not exist in AWS. Unlike
+        :meth:`pipeline_id`, this never creates the pipeline.
+        """
+        return self.existing_ids([(name, unique_id)])[(name, unique_id)]
+
+    def existing_ids(self, keys):
+        """
+        Return a dict mapping each ``(name, unique_id)`` of *keys* to the
+        id of that pipeline, or ``None`` if it does not exist in AWS.
+
+        Pipelines are listed once; those with a wanted name are then
+        described, in as few requests as possible, to match unique ids.
+        """
+        keys = list(keys)
+        with self._lock:
+            if all(key in self.ids for key in keys):
+                return dict((key, self.ids[key]) for key in keys)
+        listed = self._listed_ids()
+        with self._lock:
+            candidates = sorted(set(
+                pipeline_id for name, unique_id in keys
+                if (name, unique_id) not in self.ids
+                for pipeline_id in listed.get(name, [])
+                if pipeline_id not in self._described))
+        self._describe(candidates)
+        with self._lock:
+            return dict((key, self.ids.get(key)) for key in keys)
+
+    def describe_listed(self, prefix):
+        """
+        Return the API descriptions of the pipelines in AWS whose names
+        start with *prefix*.
+        """
+        listed = self._listed_ids()
+        with self._lock:
+            pipeline_ids = sorted(pipeline_id
+                                  for name, ids in listed.items()
+                                  if name.startswith(prefix)
+                                  for pipeline_id in ids)
+        return self._describe(pipeline_ids)
+
+    def _describe(self, pipeline_ids):
+        """
+        Describe *pipeline_ids* in as few requests as possible, recording
+        their ids and states, and return the descriptions.
+        """
+        descriptions = []
+        for start in range(0, len(pipeline_ids),
+                           DESCRIBE_PIPELINES_BATCH_SIZE):
+            batch = pipeline_ids[start:start + DESCRIBE_PIPELINES_BATCH_SIZE]
+            response = api_request(self.conn, 'describe_pipelines', batch)
+            with self._lock:
+                for description in response['pipelineDescriptionList']:
+                    pipeline_id = description['pipelineId']
+                    self._described.add(pipeline_id)
+                    self.states[pipeline_id] = fetch_field_value(
+                        description, '@pipelineState')
+                    key = (description['name'],
+                           fetch_field_value(description, 'uniqueId'))
+                    self.ids.setdefault(key, pipeline_id)
+                    descriptions.append(description)
+        return descriptions
+
+    def _listed_ids(self):
+        with self._list_lock:
+            if self._listed is None:
+                listed = {}
+                marker = None
+                while True:
+                    response = api_request(self.conn, 'list_pipelines',
+                                           marker)
+                    for entry in response['pipelineIdList']:
+                        listed.setdefault(entry['name'], []).append(
+                            entry['id'])
+                    if not response.get('hasMoreResults'):
+                        break
+                    marker = response['marker']
+                self._listed = listed
+            return self._listed
+
+    def stub_id(self):
+        """
+        Return the id of the pipeline used to validate definitions.
+        """
+        params = PIPEWELDER_STUB_PARAMS
+        return self.pipeline_id(params['name'], params['unique_id'],
+                                params['description'])
+
+    def forget_state(self, pipeline_id):
+        """
+        Drop the cached state of *pipeline_id*, such as after activating it.
+        """
+        with self._lock:
+            self.states.pop(pipeline_id, None)
+
+    def forget(self, pipeline_id):
+        """
+        Drop cached knowledge of *pipeline_id*, such as after deleting it.
+        """
+        with self._lock:
+            self.states.pop(pipeline_id, None)
+            for key, value in list(self.ids.items()):
+                if value == pipeline_id:
+                    del self.ids[key]
+            for ids in (self._listed or {}).values():
+                if pipeline_id in ids:
+                    ids.remove(pipeline_id)
+
+    def state(self, pipeline_id):
+        """
+        Return the *@pipelineState* of *pipeline_id*.
+        """
+        with self._lock:
+            if pipeline_id in self.states:
+                return self.states[pipeline_id]
+        state = state_from_id(self.conn, pipeline_id)
+        with self._lock:
+            self.states[pipeline_id] = state
+        return state
+
+    def prefetch_states(self, pipeline_ids):
+        """
+        Look up the states of *pipeline_ids* in as few requests as possible.
+        """
+        with self._lock:
+            missing = [i for i in pipeline_ids if i not in self.states]
+        for start in range(0, len(missing), DESCRIBE_PIPELINES_BATCH_SIZE):
+            batch = missing[start:start + DESCRIBE_PIPELINES_BATCH_SIZE]
+            response = api_request(self.conn, 'describe_pipelines', batch)
+            with self._lock:
+                for description in response['pipelineDescriptionList']:
+                    self.states[description['pipelineId']] = (
+                        fetch_field_value(description, '@pipelineState'))
 
 
 class Pipeline(object):
     """
     A class defining a single pipeline definition and associated tasks.
     """
-    def __init__(self, conn, s3_conn, template, dirpath):
+    def __init__(self, conn, s3_conn, template, dirpath, index=None):
         """
         Create a Pipeline based on definition dict *template*.
 
         *dirpath* is a directory containing a 'values.json' file,
         a 'run' executable, and a 'tasks' directory.
         *conn* is a DataPipelineConnection and *s3_conn* is an S3Connection.
+        *index* is a :class:`PipelineIndex` shared with other pipelines.
         """
         self.conn = conn
         self.s3_conn = s3_conn
+        self.index = index or PipelineIndex(conn)
         self.dirpath = os.path.normpath(dirpath)
         self.definition = template.copy()
         values_path = os.path.join(dirpath, 'values.json')
         decoded = util.load_json(values_path)
         self.values = decoded.get('values', {})
+        self.pinned = decoded.get('stagger', True) is False
         if 'myName' not in self.values:
             self.values['myName'] = os.path.basename(dirpath)
         # adjust the start timestamp to the future
         timestamp = self.values['myStartDateTime']
-        period = self.values['mySchedulePeriod']
-        adjusted_timestamp = adjusted_to_future(timestamp, period)
-        self.values['myStartDateTime'] = adjusted_timestamp
+        self.start_date_time = timestamp
+        self.upload_mode = UPLOAD_FILES
+        self.blob_store = None
+        self.versioned = False
+        self.background = None
+        self._content_hash = None
+        self._file_hashes = None
+        self.shift_start(0)
 
     @property
     def name(self):
         return self._get_value('myName')
 
+    @property
+    def span_attributes(self):
+        return {'pipeline': self.name}
+
     @property
     def description(self):
         try:
@@ -163,28 +673,36 @@ class Pipeline(object):
 
     @property
     def unique_id(self):
-        return hashlib.md5(self.name + str(self.tags)).hexdigest()
+        key = self.name + str(self.tags)
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
 
     def api_objects(self):
         """
         Return a dict containing the pipeline objects in AWS API format.
         """
-        d = deepcopy(self.definition)
-        return translator.definition_to_api_objects(d)
+        with profiling.phase('translation'):
+            d = deepcopy(self.definition)
+            return translator.definition_to_api_objects(d)
 
     def api_parameters(self):
         """
         Return a dict containing the pipeline parameters in AWS API format.
         """
-        d = deepcopy(self.definition)
-        return translator.definition_to_api_parameters(d)
+        with profiling.phase('translation'):
+            d = deepcopy(self.definition)
+            return translator.definition_to_api_parameters(d)
 
     def api_values(self):
         """
         Return a dict containing the pipeline param values in AWS API format.
         """
-        d = {'values': self.values}
-        return translator.definition_to_parameter_values(d)
+        values = self.values
+        if self.versioned:
+            values = dict(values,
+                          myS3InputDir=self._get_value('myS3InputDir'))
+        with profiling.phase('translation'):
+            d = {'values': values}
+            return translator.definition_to_parameter_values(d)
 
     def api_tags(self):
         """
@@ -200,60 +718,190 @@ class Pipeline(object):
 
         Returns the pipeline id.
         """
-        response = self.conn.create_pipeline(self.name, self.unique_id,
-                                             self.description, self.api_tags())
-        return response['pipelineId']
+        return self.index.pipeline_id(self.name, self.unique_id,
+                                      self.description, self.api_tags())
 
+    def deployed_id(self):
+        """
+        Return the pipeline's id in AWS, or ``None`` if it has not been
+        created. Unlike :meth:`create`, suitable for read-only commands.
+        """
+        return self.index.existing_id(self.name, self.unique_id)
+
+    def fingerprint(self):
+        """
+        Return a hash of the definition, parameters and values in API form.
+        """
+        content = json.dumps([self.api_objects(), self.api_parameters(),
+                              self.api_values()], sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def shift_start(self, minutes):
+        """
+        Start this pipeline *minutes* after its configured
+        myStartDateTime (from pipewelder.json's values, if set there,
+        or else its values.json), adjusted to the future.
+        """
+        self.start_offset = minutes
+        self.values['myStartDateTime'] = adjusted_to_future(
+            self.start_date_time, self._get_value('mySchedulePeriod'),
+            timedelta(minutes=minutes))
+
+    def content_hash(self):
+        """
+        Return a hash of everything deployed for this pipeline:
+        the template, the values (with the start time as written rather
+        than as adjusted to the future) and the files in its directory.
+
+        The hash is computed once per :class:`Pipeline` object.
+        """
+        if self._content_hash is None:
+            values = dict(self.values, myStartDateTime=self.start_date_time)
+            content = json.dumps([self.definition, values,
+                                  self.start_offset, self.upload_mode,
+                                  self.versioned], sort_keys=True)
+            digest = hashlib.sha1(content.encode('utf-8'))
+            for path, file_digest in self.file_digests():
+                digest.update(path.encode('utf-8') + b'\0')
+                digest.update(file_digest.encode('ascii'))
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def file_digests(self):
+        """
+        Return ``(path, digest)`` pairs for the files in this pipeline's
+        directory, with paths relative to it and SHA-1 hex digests.
+        """
+        return [(path, digests[hashing.SHA1])
+                for path, digests in self.file_hashes()]
+
+    def file_hashes(self):
+        """
+        Return ``(path, digests)`` pairs for the files in this pipeline's
+        directory, as from :func:`pipewelder.hashing.hash_tree`, with
+        SHA-1 digests and S3 ETags, and SHA-256 digests in ``'blobs'``
+        upload mode.
+
+        Files are hashed once per :class:`Pipeline` object.
+        """
+        if self._file_hashes is None:
+            algorithms = [hashing.SHA1, hashing.ETAG]
+            if self.upload_mode == UPLOAD_BLOBS:
+                algorithms.append(hashing.SHA256)
+            self._file_hashes = hashing.hash_tree(self.dirpath, algorithms)
+        return self._file_hashes
+
+    def input_version(self):
+        """
+        Return the version of this pipeline's uploaded input: a hash of
+        its files and how they are uploaded. Versioned pipelines upload
+        each version to its own prefix beneath myS3InputDir.
+        """
+        store = self.blob_store.uri if self.blob_store else ''
+        digest = hashlib.sha1(
+            '{0} {1}\n'.format(self.upload_mode, store).encode('utf-8'))
+        for path, file_digest in self.file_digests():
+            digest.update('{0} {1}\n'.format(file_digest, path)
+                          .encode('utf-8'))
+        return digest.hexdigest()
+
+    def resolved_objects(self):
+        """
+        Return the template objects with this pipeline's values
+        substituted for ``#{my...}`` parameters.
+
+        Parameters with list values, such as myTags, are left in place.
+        """
+        def substituted(expression):
+            def replace(match):
+                value = self._get_value(match.group(1))
+                if isinstance(value, list):
+                    return match.group(0)
+                return value
+            previous = None
+            while previous != expression:
+                previous = expression
+                expression = re.sub(PIPELINE_PARAM_RE, replace, expression)
+            return expression
+
+        def resolve(value):
+            if isinstance(value, dict):
+                return dict((k, resolve(v)) for k, v in value.items())
+            if isinstance(value, list):
+                return [resolve(v) for v in value]
+            if isinstance(value, six.string_types):
+                return substituted(value)
+            return value
+        return [resolve(obj) for obj in deepcopy(self.definition['objects'])]
+
+    @tracing.traced
     def is_valid(self):
         """
         Returns ``True`` if the pipeline definition validates to AWS.
+
+        Results are remembered in the pipeline index, so an unchanged
+        definition is only sent to AWS once.
         """
-        response = self.conn.create_pipeline(**PIPEWELDER_STUB_PARAMS)
-        pipeline_id = response["pipelineId"]
-        response = self.conn.validate_pipeline_definition(
-            self.api_objects(), pipeline_id,
-            self.api_parameters(), self.api_values())
+        fingerprint = self.fingerprint()
+        if fingerprint in self.index.validations:
+            return self.index.validations[fingerprint]
+        pipeline_id = self.index.stub_id()
+        objects = self.api_objects()
+        parameters = self.api_parameters()
+        values = self.api_values()
+        response = api_request(self.conn, 'validate_pipeline_definition',
+                               objects, pipeline_id, parameters, values)
         self._log_validation_messages(response)
-        if response['errored']:
-            return False
-        else:
+        valid = not response['errored']
+        if valid:
             logging.info("Pipeline '{0}' is valid".format(self.name))
-            return True
+        self.index.validations[fingerprint] = valid
+        return valid
 
+    @tracing.traced
     def upload(self):
         """
         Uploads the contents of `dirpath` to S3.
 
         The destination path in S3 is determined by 'myS3InputDirectory'
         in the 'values.json' file for this pipeline.
-        Existing contents of the 'tasks' subdirectory are deleted.
+        Files unchanged since the last upload are skipped and files since
+        removed are deleted; see :func:`pipewelder.storage.sync`. If the
+        pipeline is versioned, files go to a new prefix instead (see
+        :meth:`input_version`).
+        In ``'bundle'`` upload mode, the directory is uploaded as one
+        archive instead; see :func:`pipewelder.bundle.upload`. In
+        ``'blobs'`` mode, files go to the blob store and a manifest of
+        them to the input directory; see :func:`pipewelder.blobs.upload`.
 
         Returns ``True`` if successful.
         """
         s3_dir = self._get_value('myS3InputDir')
         bucket_path, input_dir = bucket_and_path(s3_dir)
-        bucket = self.s3_conn.get_bucket(bucket_path)
-
-        remote_task_path = os.path.join(input_dir, 'tasks')
-        existing_task_keys = bucket.list(prefix=remote_task_path)
-        existing_tasks = [key.name for key in existing_task_keys]
-        bucket.delete_keys(existing_tasks)
-        logging.info("Deleted from bucket '{0}': {1}"
-                     .format(bucket_path, existing_tasks))
-
-        with util.cd(self.dirpath):
-            for root, dirs, files in os.walk('.'):
-                for f in files:
-                    filepath = os.path.join(root, f)
-                    k = S3Key(bucket)
-                    k.key = os.path.normpath(os.path.join(input_dir, filepath))
-                    k.set_contents_from_filename(filepath)
-                    logging.info('Copied {0} to {1}'
-                                 .format(os.path.abspath(filepath),
-                                         os.path.normpath(
-                                             os.path.join(s3_dir, filepath))))
-        return True
-
+        with profiling.phase('network'):
+            bucket = self.s3_conn.get_bucket(bucket_path)
+        if not self.versioned:
+            return self._upload_to(bucket, input_dir)
+        if storage.is_published(bucket, input_dir):
+            logging.info("Skipping upload to {0}; already published"
+                         .format(s3_dir))
+            return True
+        succeeded = self._upload_to(bucket, input_dir)
+        if succeeded:
+            storage.mark_published(bucket, input_dir)
+        return succeeded
+
+    def _upload_to(self, bucket, input_dir):
+        if self.upload_mode == UPLOAD_BLOBS:
+            return blobs.upload(bucket, input_dir, self.dirpath,
+                                self.blob_store, self.file_hashes())
+        if self.upload_mode == UPLOAD_BUNDLE:
+            return bundle.upload(bucket, input_dir, self.dirpath)
+        return storage.publish_files(bucket, input_dir, self.dirpath,
+                                     deletable='tasks/',
+                                     hashes=self.file_hashes())
+
+    @tracing.traced
     def delete(self):
         """
         Delete this pipeline definition from AWS.
@@ -262,9 +910,11 @@ class Pipeline(object):
         """
         pipeline_id = self.create()
         logging.info("Deleting pipeline with id {0}".format(pipeline_id))
-        self.conn.delete_pipeline(pipeline_id)
+        api_request(self.conn, 'delete_pipeline', pipeline_id)
+        self.index.forget(pipeline_id)
         return True
 
+    @tracing.traced
     def put_definition(self):
         """
         Put this pipeline definition to AWS.
@@ -273,34 +923,111 @@ class Pipeline(object):
         """
         pipeline_id = self.create()
         logging.info("Putting pipeline definition for {0}".format(pipeline_id))
-        self.conn.put_pipeline_definition(self.api_objects(),
-                                          pipeline_id,
-                                          self.api_parameters(),
-                                          self.api_values())
+        objects = self.api_objects()
+        parameters = self.api_parameters()
+        values = self.api_values()
+        response = api_request(self.conn, 'put_pipeline_definition',
+                               objects, pipeline_id, parameters, values)
+        if response.get('errored'):
+            self._log_validation_messages(response)
+            return False
         return True
 
+    @tracing.traced
     def activate(self):
         """
         Activate this pipeline definition in AWS.
 
-        Deletes the existing pipeline if it has previously been activated.
+        A pipeline that has previously been activated is given the new
+        definition and activated again, so it keeps its id and history;
+        if Data Pipeline rejects the change, it is deleted and created
+        anew instead.
+        A versioned pipeline is only activated once its version has been
+        uploaded; afterwards, versions other than this one and the one
+        previously active are deleted, in the background if the pipeline
+        has a :class:`pipewelder.util.Background`.
 
         Returns ``True`` if successful.
         """
         pipeline_id = self.create()
         existing_definition = definition_from_id(self.conn, pipeline_id)
-        state = state_from_id(self.conn, pipeline_id)
+        if self.versioned and not self._is_published():
+            logging.error("Not activating pipeline '{0}'; version {1} has "
+                          "not been uploaded".format(self.name,
+                                                     self.input_version()))
+            return False
+        activated = self._activate(pipeline_id, existing_definition)
+        if activated and self.versioned:
+            previous = existing_definition.get('values', {}).get(
+                'myS3InputDir')
+            keep = [self.input_version()]
+            if previous:
+                keep.append(previous.rstrip('/').split('/')[-1])
+            if self.background is None:
+                self.collect_versions(keep)
+            else:
+                self.background.submit(self.collect_versions, keep)
+        return activated
+
+    def _activate(self, pipeline_id, existing_definition):
+        state = self.index.state(pipeline_id)
         if existing_definition == self.definition:
             return True
-        elif state == 'PENDING':
-            self.put_definition()
-        else:
+        if not self.put_definition():
+            if state == 'PENDING':
+                return False
+            # some changes, such as to the schedule type, cannot be made
+            # to a pipeline that has been activated
+            logging.warning("Could not update pipeline '{0}' in place; "
+                            "deleting and recreating it".format(self.name))
             self.delete()
-            return self.activate()
+            pipeline_id = self.create()
+            if not self.put_definition():
+                return False
         logging.info("Activating pipeline with id {0}".format(pipeline_id))
-        self.conn.activate_pipeline(pipeline_id)
+        api_request(self.conn, 'activate_pipeline', pipeline_id)
+        self.index.forget_state(pipeline_id)
         return True
 
+    def collect_versions(self, keep):
+        """
+        Delete uploaded versions of this pipeline's input directory other
+        than those in *keep*.
+        """
+        bucket_path, input_dir = bucket_and_path(
+            self._unversioned_value('myS3InputDir'))
+        with profiling.phase('network'):
+            bucket = self.s3_conn.get_bucket(bucket_path)
+        storage.collect_versions(bucket, input_dir, keep)
+
+    def clean(self):
+        """
+        Delete everything beneath this pipeline's output and log
+        directories, myS3OutputDir and myS3LogDir.
+
+        Returns ``True`` if every object was deleted.
+        """
+        succeeded = True
+        for key in CLEANED_DIRS:
+            try:
+                s3_dir = self._get_value(key)
+            except ValueError:
+                continue
+            bucket_path, path = bucket_and_path(s3_dir)
+            with profiling.phase('network'):
+                bucket = self.s3_conn.get_bucket(bucket_path)
+            deleted, errors = storage.delete_prefix(
+                bucket, path.rstrip('/') + '/')
+            succeeded = succeeded and not errors
+        return succeeded
+
+    def _is_published(self):
+        bucket_path, input_dir = bucket_and_path(
+            self._get_value('myS3InputDir'))
+        with profiling.phase('network'):
+            bucket = self.s3_conn.get_bucket(bucket_path)
+        return storage.is_published(bucket, input_dir)
+
     def _log_validation_messages(self, response):
         for container in response['validationWarnings']:
             logging.warning("Warnings in validation response for %s",
@@ -314,6 +1041,12 @@ class Pipeline(object):
                 logging.error(message)
 
     def _get_value(self, key):
+        value = self._unversioned_value(key)
+        if key == 'myS3InputDir' and self.versioned:
+            value = storage.versioned_dir(value, self.input_version())
+        return value
+
+    def _unversioned_value(self, key):
         if key in self.values:
             return self._parsed_via_parameters(self.values[key])
         params = self.definition['parameters']
@@ -341,6 +1074,29 @@ class Pipeline(object):
         fetch_field_value(obj, 'directoryPath')
 
 
+def api_request(conn, action, *args, **kwargs):
+    """
+    Call method *action* of Data Pipeline connection *conn*.
+
+    All Data Pipeline API calls made by Pipewelder go through here
+    so that they are attributed to the 'network' profiling phase
+    and recorded as tracing spans. Requests Data Pipeline throttles
+    are retried up to :data:`API_MAX_RETRIES` times, with exponential
+    backoff and jitter.
+    """
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            with profiling.phase('network'):
+                with tracing.span(action):
+                    return getattr(conn, action)(*args, **kwargs)
+        except JSONResponseError as e:
+            if e.error_code not in THROTTLING_ERRORS or \
+                    attempt == API_MAX_RETRIES:
+                raise
+        delay = API_BACKOFF_SECONDS * 2 ** attempt
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+
 def bucket_and_path(s3_uri):
     """
     Return a bucket name and key path from *s3_uri*.
@@ -371,13 +1127,14 @@ def parse_period(period):
     return timedelta(**kwargs)
 
 
-def adjusted_to_future(timestamp, period):
+def adjusted_to_future(timestamp, period, offset=None):
     """
     Return *timestamp* string, adjusted to the future if necessary.
 
     If *timestamp* is in the future, it will be returned unchanged.
     If it's in the past, *period* will be repeatedly added until the
     result is in the future.
+    If given, timedelta *offset* is added to *timestamp* first.
 
     All times are assumed to be in UTC.
 
@@ -385,13 +1142,21 @@ def adjusted_to_future(timestamp, period):
     '2199-01-01T00:00:00'
     """
     dt = datetime.strptime(timestamp, PIPELINE_DATETIME_FORMAT)
+    if offset is not None:
+        dt += offset
     delta = parse_period(period)
     now = datetime.utcnow()
-    while dt < now:
-        dt += delta
+    if dt < now:
+        # smallest number of whole periods that reaches the present
+        periods = -(-_microseconds(now - dt) // _microseconds(delta))
+        dt += delta * periods
     return dt.strftime(PIPELINE_DATETIME_FORMAT)
 
 
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
 def fetch_field_value(aws_response, field_name):
     """
     Return a value nested within the 'fields' entry of dict *aws_response*.
@@ -435,7 +1200,7 @@ def state_from_id(conn, pipeline_id):
 
     *conn* is a DataPipelineConnection object.
     """
-    response = conn.describe_pipelines([pipeline_id])
+    response = api_request(conn, 'describe_pipelines', [pipeline_id])
     description = response['pipelineDescriptionList'][0]
     return fetch_field_value(description, '@pipelineState')
 
@@ -453,7 +1218,7 @@ def definition_from_id(conn, pipeline_id):
 
     *conn* is a DataPipelineConnection object.
     """
-    response = conn.get_pipeline_definition(pipeline_id)
+    response = api_request(conn, 'get_pipeline_definition', pipeline_id)
     return translator.api_to_definition(response)
 
 
@@ -461,8 +1226,8 @@ def parsed_objects(conn, pipeline_id, object_ids):
     """
     Return a list of object dicts as evaluated by Data Pipeline.
     """
-    response = conn.describe_objects(object_ids, pipeline_id,
-                                     evaluate_expressions=True)
+    response = api_request(conn, 'describe_objects', object_ids, pipeline_id,
+                           evaluate_expressions=True)
     return response['pipelineObjects']
 
 
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Hash local files, in parallel and without reading them into memory.
+
+Files are memory-mapped where possible, falling back to buffered reads,
+and fed to hashlib a block at a time. hashlib releases the GIL while
+hashing a block, so a thread pool spreads files across cores.
+
+Besides ordinary digests, :data:`ETAG` gives the ETag S3 reports for a
+file uploaded by :mod:`pipewelder.storage`: its MD5, or for files over
+:data:`MULTIPART_THRESHOLD`, the MD5 of its parts' MD5s followed by the
+number of parts, so local files compare exactly with listed objects.
+"""
+
+import os
+import mmap
+import hashlib
+import multiprocessing
+
+from pipewelder import util
+
+MD5 = 'md5'
+SHA1 = 'sha1'
+SHA256 = 'sha256'
+ETAG = 'etag'
+# files larger than this are uploaded in parts
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+# most parts S3 accepts in one upload
+MAX_PARTS = 10000
+BLOCK_SIZE = 1024 * 1024
+
+
+def is_multipart(size):
+    """
+    Return ``True`` if a *size*-byte file is uploaded in parts.
+    """
+    return size > MULTIPART_THRESHOLD
+
+
+def part_size(size):
+    """
+    Return the size of the parts in which a *size*-byte file is uploaded:
+    :data:`PART_SIZE`, doubled until the parts number at most
+    :data:`MAX_PARTS`.
+    """
+    part = PART_SIZE
+    while part * MAX_PARTS < size:
+        part *= 2
+    return part
+
+
+def hash_file(path, algorithms):
+    """
+    Return a dict mapping each of *algorithms*, hashlib names or
+    :data:`ETAG`, to the hex digest of the file at *path*.
+    """
+    size = os.path.getsize(path)
+    digests = dict((algorithm, hashlib.new(algorithm))
+                   for algorithm in algorithms if algorithm != ETAG)
+    part = None
+    if ETAG in algorithms:
+        if is_multipart(size):
+            part = part_size(size)
+        else:
+            digests.setdefault(MD5, hashlib.md5())
+    block = BLOCK_SIZE
+    if part is not None and part % BLOCK_SIZE:
+        block = part
+    parts = []
+    state = {'part': hashlib.md5(), 'filled': 0}
+
+    def consume(data):
+        for digest in digests.values():
+            digest.update(data)
+        if part is None:
+            return
+        state['part'].update(data)
+        state['filled'] += len(data)
+        if state['filled'] == part:
+            parts.append(state['part'].digest())
+            state['part'] = hashlib.md5()
+            state['filled'] = 0
+
+    _read(path, size, block, consume)
+    result = dict((algorithm, digest.hexdigest())
+                  for algorithm, digest in digests.items())
+    if part is not None:
+        if state['filled']:
+            parts.append(state['part'].digest())
+        result[ETAG] = '{0}-{1}'.format(
+            hashlib.md5(b''.join(parts)).hexdigest(), len(parts))
+    elif ETAG in algorithms:
+        result[ETAG] = result[MD5]
+    return dict((algorithm, result[algorithm]) for algorithm in algorithms)
+
+
+def hash_files(paths, algorithms, concurrency=None):
+    """
+    Return :func:`hash_file` of each of *paths*, hashing up to
+    *concurrency* files at once (by default, one per CPU).
+    """
+    concurrency = concurrency or multiprocessing.cpu_count()
+    return util.parallel_map(lambda path: hash_file(path, algorithms),
+                             paths, concurrency)
+
+
+def hash_tree(dirpath, algorithms, concurrency=None):
+    """
+    Return ``(path, digests)`` pairs, as from :func:`hash_file`, for the
+    files beneath *dirpath* in the order of :func:`util.walk_files`.
+    """
+    paths = util.walk_files(dirpath)
+    return list(zip(paths, hash_files(
+        [os.path.join(dirpath, path) for path in paths],
+        algorithms, concurrency)))
+
+
+def _read(path, size, block, consume):
+    """
+    Call *consume* with successive *block*-byte pieces of the file at
+    *path*, which is *size* bytes long.
+    """
+    with open(path, 'rb') as f:
+        mapped = _mapped(f, size)
+        if mapped is None:
+            for data in iter(lambda: f.read(block), b''):
+                consume(data)
+            return
+        view = _view(mapped)
+        try:
+            for offset in range(0, size, block):
+                consume(view[offset:offset + block])
+        finally:
+            # slices of the view must be gone before the map is closed
+            view = None
+            mapped.close()
+
+
+def _mapped(f, size):
+    if size == 0:
+        return None
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError, OverflowError):
+        # e.g. not a regular file, or too large for the address space
+        return None
+
+
+def _view(mapped):
+    try:
+        return memoryview(mapped)
+    except TypeError:
+        # Python 2 maps are sliced into copies of each block instead
+        return mapped
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Keep a local history of pipeline runs and analyze how long they take.
+
+Runs are fetched with :mod:`pipewelder.instances` and saved to a JSON
+file, keyed by configuration group and pipeline name so that history
+survives pipelines being recreated on activation. Each update only
+fetches runs scheduled since the last one, plus any that were still in
+progress then.
+
+Durations are compared with each pipeline's ``myTerminateAfter``, after
+which Data Pipeline kills a run, and its ``mySchedulePeriod``, beyond
+which runs overlap.
+"""
+
+import os
+import math
+import json
+import threading
+from datetime import datetime, timedelta
+
+from pipewelder import util, instances
+from pipewelder.core import parse_period
+from pipewelder.instances import Instance
+from pipewelder.schedule import duration_minutes
+
+DEFAULT_PATH = '.pipewelder-history.json'
+DEFAULT_WINDOW = '30 days'
+# runs scheduled longer ago than this are dropped from the history
+RETENTION = timedelta(days=90)
+# p95 durations above this fraction of myTerminateAfter are flagged
+HEADROOM_THRESHOLD = 0.8
+# p95 durations above this fraction of the period suggest a longer one
+PERIOD_THRESHOLD = 0.8
+NEAR_TIMEOUT = 'near-timeout'
+OVERLAPPING = 'overlapping'
+LONGER_PERIOD = 'longer-period'
+
+
+class History(object):
+    """
+    Runs of pipelines, saved to *path*.
+    """
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._pipelines = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._pipelines = util.load_json(path)['pipelines']
+
+    def update(self, key, pipeline, since, now=None):
+        """
+        Fetch runs of *pipeline*, recorded under *key*, scheduled since
+        datetime *since* that are not already known to have ended.
+
+        Returns the number of runs fetched, none if *pipeline* has not
+        been deployed.
+        """
+        now = now or datetime.utcnow()
+        pipeline_id = pipeline.deployed_id()
+        if pipeline_id is None:
+            return 0
+        with self._lock:
+            entry = self._pipelines.setdefault(
+                key, {'name': pipeline.name, 'ids': {}, 'runs': {}})
+            fetched = dict(entry['ids'].get(pipeline_id, {}))
+        ranges = []
+        covered_since = instances.parse_time(fetched.get('covered_since'))
+        complete_until = instances.parse_time(fetched.get('complete_until'))
+        if covered_since is None or since < covered_since:
+            ranges.append((since, covered_since or now))
+        if complete_until is not None:
+            ranges.append((complete_until, now))
+        runs = []
+        for start, end in ranges:
+            runs.extend(instances.runs(pipeline, start, end))
+        pending = [run.scheduled_start for run in runs
+                   if not run.done and run.scheduled_start is not None]
+        with self._lock:
+            for run in runs:
+                entry['runs']['{0}/{1}'.format(pipeline_id, run.id)] = \
+                    run.to_json()
+            entry['ids'][pipeline_id] = {
+                'covered_since': instances.format_time(
+                    min(since, covered_since or since)),
+                'complete_until': instances.format_time(min(pending or [now])),
+            }
+            cutoff = instances.format_time(now - RETENTION)
+            for run_key, run in list(entry['runs'].items()):
+                if (run['scheduled_start'] or '') < cutoff:
+                    del entry['runs'][run_key]
+        return len(runs)
+
+    def runs(self, key, since=None):
+        """
+        Return the runs recorded under *key* scheduled since datetime
+        *since*, oldest first.
+        """
+        with self._lock:
+            entry = self._pipelines.get(key, {'runs': {}})
+            found = [Instance.from_json(run) for run in entry['runs'].values()]
+        if since is not None:
+            found = [run for run in found
+                     if run.scheduled_start and run.scheduled_start >= since]
+        return sorted(found, key=lambda run: run.scheduled_start)
+
+    def save(self):
+        with self._lock:
+            content = json.dumps({'pipelines': self._pipelines},
+                                 sort_keys=True)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(content)
+        os.rename(temporary, self.path)
+
+
+def pipeline_report(history, key, pipeline, since):
+    """
+    Update *history* with the runs of *pipeline*, recorded under *key*,
+    and return :func:`analyze` of those scheduled since datetime
+    *since*.
+    """
+    history.update(key, pipeline, since)
+    try:
+        terminate_after = pipeline._get_value('myTerminateAfter')
+    except ValueError:
+        terminate_after = None
+    return analyze(pipeline.name, history.runs(key, since),
+                   terminate_after or None,
+                   pipeline._get_value('mySchedulePeriod'))
+
+
+def analyze(name, runs, terminate_after, period):
+    """
+    Return a dict of statistics on the durations, in minutes, of the
+    finished *runs* of pipeline *name*, and flags for its schedule.
+
+    *terminate_after* and *period* are the pipeline's
+    ``myTerminateAfter`` and ``mySchedulePeriod`` expressions;
+    *terminate_after* may be ``None``.
+    """
+    finished = [run for run in runs if run.finished and run.actual_end]
+    durations = [util.total_seconds(run.duration) / 60 for run in finished]
+    limit = terminate_after and duration_minutes(terminate_after)
+    period_minutes = util.total_seconds(parse_period(period)) / 60
+    report = {
+        'name': name,
+        'runs': len(runs),
+        'finished': len(finished),
+        'failed': sum(1 for run in runs if run.failed),
+        'terminate_after': terminate_after,
+        'period': period,
+        'p50': percentile(durations, 50),
+        'p95': percentile(durations, 95),
+        'max': max(durations) if durations else None,
+        'trend': trend([run.scheduled_start for run in finished], durations),
+        'headroom': None,
+        'flags': [],
+        'suggested_period': None,
+    }
+    if not durations:
+        return report
+    if limit:
+        report['headroom'] = 1 - report['p95'] / limit
+        if report['p95'] >= HEADROOM_THRESHOLD * limit:
+            report['flags'].append(NEAR_TIMEOUT)
+    if report['max'] > period_minutes:
+        report['flags'].append(OVERLAPPING)
+    if report['p95'] > PERIOD_THRESHOLD * period_minutes:
+        report['flags'].append(LONGER_PERIOD)
+        report['suggested_period'] = longer_period(period, report['p95'])
+    return report
+
+
+def percentile(values, q):
+    """
+    Return the *q*-th percentile of *values*, interpolating linearly
+    between the closest ranks, or ``None`` if there are none.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    low = int(math.floor(rank))
+    high = int(math.ceil(rank))
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def trend(times, durations):
+    """
+    Return the least-squares slope of *durations* (in minutes) against
+    *times*, in minutes per day, or ``None`` with fewer than two runs.
+    """
+    if len(durations) < 2:
+        return None
+    days = [util.total_seconds(t - times[0]) / 86400 for t in times]
+    mean_x = sum(days) / len(days)
+    mean_y = sum(durations) / len(durations)
+    variance = sum((x - mean_x) ** 2 for x in days)
+    if variance == 0:
+        return None
+    covariance = sum((x - mean_x) * (y - mean_y)
+                     for x, y in zip(days, durations))
+    return covariance / variance
+
+
+def longer_period(period, minutes):
+    """
+    Return *period* doubled until *minutes* is within
+    :data:`PERIOD_THRESHOLD` of it, in the same units.
+
+    >>> longer_period('15 minutes', 20)
+    '30 minutes'
+    """
+    number, unit = period.split()
+    number = int(number)
+    unit_minutes = util.total_seconds(parse_period('1 ' + unit)) / 60
+    while minutes > PERIOD_THRESHOLD * number * unit_minutes:
+        number *= 2
+    return '{0} {1}'.format(number, unit)
+
+
+def format_report(reports):
+    """
+    Return lines of a table of *reports* from :func:`analyze`.
+    """
+    lines = ["{0:<30} {1:>5} {2:>7} {3:>7} {4:>7} {5:>13} {6:>8}  {7}"
+             .format('PIPELINE', 'RUNS', 'P50', 'P95', 'MAX', 'TERMINATE',
+                     'TREND/D', 'FLAGS')]
+    for report in reports:
+        flags = list(report['flags'])
+        if report['suggested_period']:
+            flags[flags.index(LONGER_PERIOD)] = '{0} ({1})'.format(
+                LONGER_PERIOD, report['suggested_period'])
+        lines.append(
+            "{0:<30} {1:>5} {2:>7} {3:>7} {4:>7} {5:>13} {6:>8}  {7}".format(
+                report['name'], report['finished'],
+                _minutes(report['p50']), _minutes(report['p95']),
+                _minutes(report['max']), report['terminate_after'] or '-',
+                _minutes(report['trend'], signed=True),
+                ', '.join(flags)))
+    return lines
+
+
+def _minutes(value, signed=False):
+    if value is None:
+        return '-'
+    return (signed and '{0:+.1f}m' or '{0:.1f}m').format(value)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Look up the runs Data Pipeline has scheduled for a pipeline.
+
+Each scheduled run of an object is an *instance* object. Their ids are
+found with paginated QueryObjects calls, selecting on scheduled start
+time and on the activity they are runs of, and then described in
+batches of up to 25 (the most DescribeObjects accepts), several batches
+at once. Pipelines are only looked up, never created, so pipelines not
+yet deployed have no runs.
+"""
+
+from datetime import datetime
+
+from pipewelder import util
+from pipewelder.core import (api_request, parse_period,
+                             PIPELINE_DATETIME_FORMAT)
+
+INSTANCE_SPHERE = 'INSTANCE'
+# most ids QueryObjects returns per page
+QUERY_LIMIT = 100
+# most objects DescribeObjects accepts per request
+DESCRIBE_BATCH_SIZE = 25
+DESCRIBE_CONCURRENCY = 4
+FINISHED = 'FINISHED'
+FAILED_STATUSES = ['FAILED', 'TIMEDOUT', 'CASCADE_FAILED']
+# statuses of runs that will not change further
+DONE_STATUSES = [FINISHED, 'CANCELED', 'SKIPPED'] + FAILED_STATUSES
+
+
+class Instance(object):
+    """
+    One scheduled run of the pipeline object *component*.
+
+    Times are naive UTC datetimes, or ``None`` if the run has not reached
+    that point.
+    """
+    def __init__(self, id, component=None, status=None, scheduled_start=None,
+                 actual_start=None, actual_end=None, attempts=0, error=None):
+        self.id = id
+        self.component = component
+        self.status = status
+        self.scheduled_start = scheduled_start
+        self.actual_start = actual_start
+        self.actual_end = actual_end
+        self.attempts = attempts
+        self.error = error
+
+    @classmethod
+    def from_api(cls, obj):
+        """
+        Return an :class:`Instance` from a DescribeObjects result.
+        """
+        fields = {}
+        for field in obj['fields']:
+            fields[field['key']] = field.get('stringValue',
+                                             field.get('refValue'))
+        return cls(obj['id'],
+                   component=fields.get('@componentParent'),
+                   status=fields.get('@status'),
+                   scheduled_start=parse_time(
+                       fields.get('@scheduledStartTime')),
+                   actual_start=parse_time(fields.get('@actualStartTime')),
+                   actual_end=parse_time(fields.get('@actualEndTime')),
+                   attempts=int(fields.get('@attemptCount', 0)),
+                   error=(fields.get('@failureReason') or
+                          fields.get('errorMessage')))
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Return an :class:`Instance` from the result of :meth:`to_json`.
+        """
+        data = dict(data)
+        for key in ['scheduled_start', 'actual_start', 'actual_end']:
+            data[key] = parse_time(data[key])
+        return cls(**data)
+
+    def to_json(self):
+        """
+        Return a dict of this instance's attributes, with times as
+        strings, suitable for JSON.
+        """
+        return {
+            'id': self.id,
+            'component': self.component,
+            'status': self.status,
+            'scheduled_start': format_time(self.scheduled_start),
+            'actual_start': format_time(self.actual_start),
+            'actual_end': format_time(self.actual_end),
+            'attempts': self.attempts,
+            'error': self.error,
+        }
+
+    @property
+    def failed(self):
+        return self.status in FAILED_STATUSES
+
+    @property
+    def finished(self):
+        return self.status == FINISHED
+
+    @property
+    def done(self):
+        return self.status in DONE_STATUSES
+
+    @property
+    def duration(self):
+        """
+        The run's duration as a timedelta, or ``None`` if it has not
+        started. Runs still going are measured up to now.
+        """
+        if self.actual_start is None:
+            return None
+        end = self.actual_end or datetime.utcnow()
+        return end - self.actual_start
+
+
+def query_ids(conn, pipeline_id, selectors=()):
+    """
+    Yield the ids of *pipeline_id*'s instances matching QueryObjects
+    *selectors*, a page at a time.
+    """
+    query = {'selectors': list(selectors)}
+    marker = None
+    while True:
+        response = api_request(conn, 'query_objects', pipeline_id,
+                               INSTANCE_SPHERE, marker=marker, query=query,
+                               limit=QUERY_LIMIT)
+        for instance_id in response.get('ids', []):
+            yield instance_id
+        if not response.get('hasMoreResults'):
+            return
+        marker = response['marker']
+
+
+def describe(conn, pipeline_id, instance_ids,
+             concurrency=DESCRIBE_CONCURRENCY):
+    """
+    Return an :class:`Instance` for each of *instance_ids*.
+    """
+    instance_ids = list(instance_ids)
+    batches = [instance_ids[start:start + DESCRIBE_BATCH_SIZE]
+               for start in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE)]
+
+    def describe_batch(batch):
+        response = api_request(conn, 'describe_objects', batch, pipeline_id)
+        return [Instance.from_api(obj)
+                for obj in response['pipelineObjects']]
+    described = util.parallel_map(describe_batch, batches, concurrency)
+    return [instance for batch in described for instance in batch]
+
+
+def scheduled_between(since, until):
+    """
+    Return a QueryObjects selector for instances scheduled to start
+    between datetimes *since* and *until*.
+    """
+    return {'fieldName': '@scheduledStartTime',
+            'operator': {'type': 'BETWEEN',
+                         'values': [format_time(since),
+                                    format_time(until)]}}
+
+
+def with_status(statuses):
+    """
+    Return a QueryObjects selector for instances with any of *statuses*.
+    """
+    return {'fieldName': '@status',
+            'operator': {'type': 'EQ', 'values': list(statuses)}}
+
+
+def of_components(component_ids):
+    """
+    Return a QueryObjects selector for instances of any of the objects
+    *component_ids*.
+    """
+    return {'fieldName': '@componentParent',
+            'operator': {'type': 'REF_EQ', 'values': sorted(component_ids)}}
+
+
+def activity_ids(pipeline):
+    """
+    Return the ids of *pipeline*'s activities, whose instances are its
+    runs.
+    """
+    return set(obj['id'] for obj in pipeline.definition['objects']
+               if obj.get('type', '').endswith('Activity'))
+
+
+def runs(pipeline, since, until=None, selectors=(),
+         concurrency=DESCRIBE_CONCURRENCY):
+    """
+    Return the instances of *pipeline*'s activities scheduled to start
+    between datetimes *since* and *until* (by default, now) and matching
+    any further *selectors*, most recently scheduled first.
+
+    A pipeline that has not been deployed has no runs.
+    """
+    until = until or datetime.utcnow()
+    pipeline_id = pipeline.deployed_id()
+    if pipeline_id is None:
+        return []
+    activities = activity_ids(pipeline)
+    ids = query_ids(pipeline.conn, pipeline_id,
+                    [scheduled_between(since, until),
+                     of_components(activities)] + list(selectors))
+    found = [instance for instance in describe(pipeline.conn, pipeline_id,
+                                               ids, concurrency)
+             if instance.component in activities]
+    return sorted(found, key=lambda i: i.scheduled_start or datetime.min,
+                  reverse=True)
+
+
+def prefetch_ids(pipelines):
+    """
+    Look up the ids of those of *pipelines* that are deployed in as few
+    requests as possible, so later lookups are answered from the cache.
+    """
+    indexes = {}
+    for pipeline in pipelines:
+        index, keys = indexes.setdefault(id(pipeline.index),
+                                         (pipeline.index, []))
+        keys.append((pipeline.name, pipeline.unique_id))
+    for index, keys in indexes.values():
+        index.existing_ids(keys)
+
+
+def period_of(pipeline):
+    """
+    Return *pipeline*'s schedule period as a timedelta.
+    """
+    return parse_period(pipeline._get_value('mySchedulePeriod'))
+
+
+def parse_time(value):
+    """
+    Return a datetime from a Data Pipeline time string, or ``None``.
+    """
+    if value is None:
+        return None
+    return datetime.strptime(value, PIPELINE_DATETIME_FORMAT)
+
+
+def format_time(value):
+    """
+    Return a Data Pipeline time string from a datetime, or ``None``.
+    """
+    if value is None:
+        return None
+    return value.strftime(PIPELINE_DATETIME_FORMAT)
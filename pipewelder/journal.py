@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+An append-only record of completed per-pipeline steps.
+
+Each line of the journal is a JSON object naming a configuration group,
+a pipeline, a step (the :class:`~pipewelder.core.Pipeline` method that
+succeeded) and the :meth:`~pipewelder.core.Pipeline.content_hash` of
+what was deployed. A run that is restarted with ``resume`` enabled skips
+steps already recorded for identical content. Once every step for a
+group has succeeded, its entries are no longer needed and are removed
+with :meth:`Journal.reset`, so the file only grows while runs fail.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+DEFAULT_PATH = '.pipewelder-journal.jsonl'
+# serializes writes by every journal in this process, since journals for
+# several groups share a file
+_file_lock = threading.Lock()
+
+
+class Journal(object):
+    """
+    Steps completed for configuration *group*, journaled to *path*.
+
+    Steps are always recorded; they are only treated as done when
+    *resume* is set.
+    """
+    def __init__(self, path=DEFAULT_PATH, group=None, resume=False):
+        self.path = path
+        self.group = group
+        self.resume = resume
+        self._completed = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._load()
+
+    def done(self, pipeline, step):
+        """
+        Return ``True`` if resuming and *step* has already been completed
+        for the current content of *pipeline*.
+        """
+        if not self.resume:
+            return False
+        key = (pipeline.name, pipeline.content_hash())
+        with self._lock:
+            return step in self._completed.get(key, ())
+
+    def record(self, pipeline, step):
+        """
+        Append an entry noting that *step* succeeded for *pipeline*.
+        """
+        entry = {
+            'time': time.time(),
+            'group': self.group,
+            'pipeline': pipeline.name,
+            'step': step,
+            'hash': pipeline.content_hash(),
+        }
+        line = (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8')
+        with self._lock:
+            with _file_lock:
+                self._apply(entry)
+                # a single O_APPEND write keeps lines whole, even when
+                # several journals share the file
+                fd = os.open(self.path,
+                             os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def reset(self):
+        """
+        Remove this group's entries, such as once all its steps have
+        succeeded, deleting the file if no other group's remain.
+        """
+        with self._lock:
+            with _file_lock:
+                self._completed = {}
+                if not os.path.exists(self.path):
+                    return
+                with open(self.path) as f:
+                    kept = [line for line in f
+                            if _readable(line) and
+                            json.loads(line).get('group') != self.group]
+                if not kept:
+                    os.remove(self.path)
+                    return
+                temporary = self.path + '.tmp'
+                with open(temporary, 'w') as f:
+                    f.writelines(kept)
+                os.rename(temporary, self.path)
+
+    def _load(self):
+        with open(self.path) as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # most likely a line cut short by a crash
+                    logging.warning("Ignoring unreadable line %d of %s",
+                                    number, self.path)
+                    continue
+                if entry.get('group') == self.group:
+                    self._apply(entry)
+
+    def _apply(self, entry):
+        key = (entry['pipeline'], entry['hash'])
+        steps = self._completed.setdefault(key, set())
+        if entry['step'] == 'delete':
+            # deleting undoes everything done before
+            steps.clear()
+        else:
+            steps.discard('delete')
+        steps.add(entry['step'])
+
+
+def _readable(line):
+    try:
+        json.loads(line)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Run pipelines on this machine, emulating Data Pipeline's data staging.
+
+For each ``ShellCommandActivity`` with ``stage`` set, the pipeline
+directory (what ``upload`` copies to ``myS3InputDir``) is copied to a
+temporary ``INPUT1_STAGING_DIR``, an empty ``OUTPUT1_STAGING_DIR`` is
+provided, and the activity's command is run with ``sh``. Afterwards the
+staged outputs are collected under an output directory. Other inputs,
+such as data in S3, are not fetched; their staging directories are
+left empty.
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+from multiprocessing import Pool
+
+import six
+
+from pipewelder.core import Pipewelder
+
+DEFAULT_OUTPUT_DIR = 'pipewelder-output'
+ACTIVITY_TYPE = 'ShellCommandActivity'
+
+
+def run_all(jobs, processes=1):
+    """
+    Run each of *jobs*, ``(dirpath, template_path, values, output_dir)``
+    tuples, with up to *processes* at once in a process pool.
+
+    Returns a list of results from :func:`run_pipeline`.
+    """
+    jobs = list(jobs)
+    if processes <= 1 or len(jobs) <= 1:
+        return [_run_job(job) for job in jobs]
+    pool = Pool(min(processes, len(jobs)))
+    try:
+        return pool.map(_run_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_pipeline(pipeline, output_dir=DEFAULT_OUTPUT_DIR):
+    """
+    Run the staged activities of :class:`~pipewelder.core.Pipeline`
+    *pipeline* in order, stopping at the first failure.
+
+    Staged outputs go to ``<output_dir>/<name>/output1`` and so on (in a
+    subdirectory per activity if there are several), and the activities'
+    combined stdout and stderr to
+    ``<output_dir>/<name>/log.txt``. Returns a dict with the pipeline's
+    ``name``, whether it succeeded (``ok``), the ``returncode`` of the
+    last command, the ``seconds`` taken and the ``output`` directory.
+    """
+    objects = dict((obj['id'], obj) for obj in pipeline.resolved_objects())
+    activities = [obj for obj in objects.values()
+                  if obj.get('type') == ACTIVITY_TYPE and
+                  str(obj.get('stage')).lower() == 'true']
+    if not activities:
+        raise ValueError("Pipeline '{0}' has no staged {1}"
+                         .format(pipeline.name, ACTIVITY_TYPE))
+    destination = os.path.join(output_dir, pipeline.name)
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    os.makedirs(destination)
+    environment = dict(os.environ)
+    environment.update(_parameter_environment(pipeline))
+    returncode = 0
+    started = time.time()
+    with open(os.path.join(destination, 'log.txt'), 'wb') as log:
+        for activity in sorted(activities, key=lambda a: a['id']):
+            outputs = destination
+            if len(activities) > 1:
+                outputs = os.path.join(destination, activity['id'])
+            returncode = _run_activity(pipeline, objects, activity,
+                                       environment, outputs, log)
+            if returncode != 0:
+                break
+    return {'name': pipeline.name, 'ok': returncode == 0,
+            'returncode': returncode, 'seconds': time.time() - started,
+            'output': destination}
+
+
+def _run_job(job):
+    dirpath, template_path, values, output_dir = job
+    name = os.path.basename(os.path.normpath(dirpath))
+    started = time.time()
+    try:
+        pw = Pipewelder(None, template_path, values=values)
+        pipeline = pw.add_pipeline(dirpath)
+        name = pipeline.name
+        return run_pipeline(pipeline, output_dir)
+    except Exception as e:
+        logging.exception("Error running %s locally", dirpath)
+        return {'name': name, 'ok': False, 'returncode': None,
+                'seconds': time.time() - started, 'output': None,
+                'error': str(e)}
+
+
+def _run_activity(pipeline, objects, activity, environment, destination,
+                  log):
+    workdir = tempfile.mkdtemp(prefix='pipewelder-')
+    try:
+        environment = dict(environment)
+        input_dir = pipeline._get_value('myS3InputDir')
+        for number, node in enumerate(_refs(objects, activity, 'input'), 1):
+            staging = os.path.join(workdir, 'input{0}'.format(number))
+            if node.get('directoryPath') == input_dir:
+                shutil.copytree(pipeline.dirpath, staging)
+            else:
+                logging.warning("Input '%s' of '%s' is not available "
+                                "locally; staging it empty",
+                                node['id'], pipeline.name)
+                os.makedirs(staging)
+            environment['INPUT{0}_STAGING_DIR'.format(number)] = staging
+        outputs = []
+        for number, node in enumerate(_refs(objects, activity, 'output'), 1):
+            staging = os.path.join(workdir, 'output{0}'.format(number))
+            os.makedirs(staging)
+            environment['OUTPUT{0}_STAGING_DIR'.format(number)] = staging
+            outputs.append(staging)
+        log.flush()
+        returncode = subprocess.call(['sh', '-c', activity['command']],
+                                     cwd=workdir, env=environment,
+                                     stdout=log, stderr=subprocess.STDOUT)
+        for staging in outputs:
+            shutil.copytree(staging, os.path.join(
+                destination, os.path.basename(staging)))
+        return returncode
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _refs(objects, obj, field):
+    refs = obj.get(field, [])
+    if not isinstance(refs, list):
+        refs = [refs]
+    return [objects[ref['ref']] for ref in refs]
+
+
+def _parameter_environment(pipeline):
+    """
+    Return the resolved values of *pipeline*'s parameters, keyed by id.
+    """
+    values = dict((p['id'], p.get('default'))
+                  for p in pipeline.definition.get('parameters', []))
+    values.update(pipeline.values)
+    environment = {}
+    for key, value in values.items():
+        if isinstance(value, list):
+            # array parameters such as myTags are joined with commas
+            value = ','.join(value)
+        elif isinstance(value, six.string_types):
+            value = pipeline._get_value(key)
+        else:
+            continue
+        environment[str(key)] = str(value)
+    return environment
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Fetch the output logs of pipeline runs from S3.
+
+Each run stages its output to a directory named by its scheduled start
+time beneath ``myS3OutputDir``, as laid out by the template's output
+data node (``#{myS3OutputDir}/#{format(@scheduledStartTime, ...)}``).
+Runs are found by listing those directories with a delimiter and
+parsing their names with the same format; when the format sorts
+chronologically, listings start just before the runs wanted rather
+than at the first run ever made. Each run's ``stdout.txt`` is then
+fetched, many at once, with a ranged GET for just its tail. A run whose
+log has not landed is looked for again until it is older than the
+pipeline's ``myTerminateAfter`` plus a period, by when it must be over.
+"""
+
+import re
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from boto.exception import S3ResponseError
+
+from pipewelder import util, profiling, tracing, instances
+from pipewelder.core import bucket_and_path
+from pipewelder.schedule import duration_minutes
+
+LOG_NAME = 'stdout.txt'
+DEFAULT_TAIL_BYTES = 4096
+FETCH_CONCURRENCY = 8
+DEFAULT_FOLLOW_INTERVAL = 10.0
+OUTPUT_PATH_RE = re.compile(
+    r"^#\{(?P<parameter>my[a-zA-Z0-9]+)\}/"
+    r"#\{format\(@scheduledStartTime,\s*'(?P<format>[^']+)'\)\}$")
+# Joda-Time patterns, as used by Data Pipeline's format(), and their
+# strftime equivalents, most significant first
+FORMAT_FIELDS = [('YYYY', '%Y'), ('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'),
+                 ('HH', '%H'), ('mm', '%M'), ('ss', '%S')]
+CHRONOLOGICAL = ['%Y', '%m', '%d', '%H', '%M']
+
+
+class OutputLayout(object):
+    """
+    Where a pipeline's runs stage their output: directories beneath
+    ``s3://<bucket>/<base>/`` named by strftime *format*.
+    """
+    def __init__(self, bucket, base, format):
+        self.bucket = bucket
+        self.base = base.strip('/') + '/'
+        self.format = format
+
+    @classmethod
+    def of(cls, pipeline):
+        """
+        Return the layout of *pipeline*'s output, found from the data
+        node whose directory is named by the scheduled start time.
+        """
+        for obj in pipeline.definition['objects']:
+            match = OUTPUT_PATH_RE.match(obj.get('directoryPath', ''))
+            if match:
+                bucket, base = bucket_and_path(
+                    pipeline._get_value(match.group('parameter')))
+                return cls(bucket, base,
+                           strftime_format(match.group('format')))
+        raise ValueError("Pipeline {0} has no output directory named by "
+                         "@scheduledStartTime".format(pipeline.name))
+
+    @property
+    def chronological(self):
+        """
+        ``True`` if directory names sort in the order of their times.
+        """
+        positions = [self.format.find(field) for field in CHRONOLOGICAL]
+        return -1 not in positions and positions == sorted(positions)
+
+    def directory(self, scheduled):
+        return self.base + scheduled.strftime(self.format) + '/'
+
+    def parse(self, directory):
+        """
+        Return the scheduled start time of output *directory*, or
+        ``None`` if it is not named by one.
+        """
+        name = directory[len(self.base):].rstrip('/')
+        try:
+            return datetime.strptime(name, self.format)
+        except ValueError:
+            return None
+
+
+def strftime_format(pattern):
+    """
+    Return the strftime equivalent of Joda-Time *pattern*.
+
+    >>> strftime_format('YYYY-MM-dd_HHmmss')
+    '%Y-%m-%d_%H%M%S'
+    """
+    converted = pattern
+    for field, directive in FORMAT_FIELDS:
+        converted = converted.replace(field, directive)
+    return converted
+
+
+def output_runs(bucket, layout, since=None):
+    """
+    Return ``(scheduled, directory)`` pairs for the output directories
+    in *bucket* of runs scheduled after datetime *since*, oldest first.
+    """
+    marker = ''
+    if since is not None and layout.chronological:
+        marker = layout.directory(since)
+    with profiling.phase('network'):
+        with tracing.span('list_objects'):
+            listed = [entry.name for entry in bucket.list(
+                prefix=layout.base, delimiter='/', marker=marker)
+                if entry.name.endswith('/')]
+    found = []
+    for directory in listed:
+        scheduled = layout.parse(directory)
+        if scheduled is not None and (since is None or scheduled > since):
+            found.append((scheduled, directory))
+    return sorted(found)
+
+
+def fetch_tail(bucket, key_name, tail_bytes=DEFAULT_TAIL_BYTES):
+    """
+    Return the last *tail_bytes* (all, if 0) of object *key_name* as
+    text, or ``None`` if it does not exist yet.
+
+    A truncated tail starts at its first complete line.
+    """
+    headers = {}
+    if tail_bytes:
+        headers['Range'] = 'bytes=-{0}'.format(tail_bytes)
+    key = bucket.new_key(key_name)
+    try:
+        with profiling.phase('network'):
+            with tracing.span('get_object', key=key_name):
+                data = key.get_contents_as_string(headers=headers)
+    except S3ResponseError as e:
+        if e.status == 404:
+            return None
+        if e.status == 416:
+            # empty objects have no range to satisfy
+            return ''
+        raise
+    if tail_bytes and len(data) >= tail_bytes and b'\n' in data:
+        data = data[data.index(b'\n') + 1:]
+    return data.decode('utf-8', 'replace')
+
+
+class LogTailer(object):
+    """
+    Finds and fetches the logs of runs of *pipelines*, remembering
+    which it has already returned.
+    """
+    def __init__(self, pipelines, tail_bytes=DEFAULT_TAIL_BYTES,
+                 concurrency=FETCH_CONCURRENCY):
+        self.tail_bytes = tail_bytes
+        self.concurrency = concurrency
+        self._sources = []
+        # how long after its scheduled time each pipeline's runs may
+        # still produce a log
+        self._expiry = {}
+        for pipeline in pipelines:
+            layout = OutputLayout.of(pipeline)
+            with profiling.phase('network'):
+                bucket = pipeline.s3_conn.get_bucket(layout.bucket)
+            self._sources.append((pipeline, bucket, layout))
+            self._expiry[pipeline.name] = expiry_of(pipeline)
+        # per pipeline looked at, the newest run found (or None), and
+        # runs found before their logs landed
+        self._latest = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def latest(self, count):
+        """
+        Return up to *count* of the latest runs of each pipeline that
+        have logs; see :meth:`poll`.
+        """
+        def find(source):
+            pipeline, bucket, layout = source
+            since = None
+            if layout.chronological:
+                since = (datetime.utcnow() -
+                         instances.period_of(pipeline) * (count + 1))
+            runs = output_runs(bucket, layout, since)
+            if since is not None and len(runs) < count:
+                runs = output_runs(bucket, layout)
+            return [(pipeline, bucket, layout, scheduled, directory)
+                    for scheduled, directory in runs[-count:]]
+        return self._fetch(util.parallel_map(find, self._sources,
+                                             self.concurrency))
+
+    def poll(self):
+        """
+        Return ``(name, scheduled, text)`` for every run, across all
+        pipelines, whose log has landed since it was last looked for,
+        oldest first.
+        """
+        def find(source):
+            pipeline, bucket, layout = source
+            with self._lock:
+                if pipeline.name not in self._latest:
+                    return []
+                since = self._latest[pipeline.name]
+                pending = list(self._pending.get(pipeline.name, []))
+            runs = output_runs(bucket, layout, since)
+            return [(pipeline, bucket, layout, scheduled, directory)
+                    for scheduled, directory in pending + runs]
+        return self._fetch(util.parallel_map(find, self._sources,
+                                             self.concurrency))
+
+    def _fetch(self, found):
+        runs = [run for runs in found for run in runs]
+
+        def fetch(run):
+            pipeline, bucket, layout, scheduled, directory = run
+            return fetch_tail(bucket, directory + LOG_NAME, self.tail_bytes)
+        texts = util.parallel_map(fetch, runs, self.concurrency)
+        entries = []
+        now = datetime.utcnow()
+        with self._lock:
+            for source in self._sources:
+                self._latest.setdefault(source[0].name, None)
+            for run, text in zip(runs, texts):
+                pipeline, bucket, layout, scheduled, directory = run
+                name = pipeline.name
+                pending = self._pending.setdefault(name, [])
+                if (scheduled, directory) in pending:
+                    pending.remove((scheduled, directory))
+                latest = self._latest[name]
+                self._latest[name] = latest and max(latest, scheduled) or \
+                    scheduled
+                if text is None:
+                    if now - scheduled > self._expiry[name]:
+                        logging.debug("No log for %s at %s; giving up",
+                                      name, scheduled)
+                        continue
+                    pending.append((scheduled, directory))
+                    logging.debug("No log yet for %s at %s", name, scheduled)
+                    continue
+                entries.append((name, scheduled, text))
+        return sorted(entries, key=lambda entry: (entry[1], entry[0]))
+
+    def follow(self, count, interval, stop=None):
+        """
+        Yield the entries of :meth:`latest`, then those of :meth:`poll`
+        every *interval* seconds until threading.Event *stop* is set.
+        """
+        stop = stop or threading.Event()
+        for entry in self.latest(count):
+            yield entry
+        while not stop.is_set():
+            stop.wait(interval)
+            for entry in self.poll():
+                yield entry
+
+
+def expiry_of(pipeline):
+    """
+    Return how long after its scheduled time a run of *pipeline* may
+    still produce a log: its ``myTerminateAfter``, or without one a
+    further period, plus a period for runs that start late.
+    """
+    period = instances.period_of(pipeline)
+    try:
+        terminate_after = timedelta(minutes=duration_minutes(
+            pipeline._get_value('myTerminateAfter')))
+    except ValueError:
+        terminate_after = period
+    return terminate_after + period
+
+
+def format_entry(name, scheduled, text):
+    """
+    Return lines of log *text* from the run of pipeline *name* scheduled
+    at datetime *scheduled*, each prefixed with both.
+    """
+    prefix = '{0} {1}'.format(name, instances.format_time(scheduled))
+    lines = text.splitlines() or ['']
+    return ['{0} | {1}'.format(prefix, line) for line in lines]
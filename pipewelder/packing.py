@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Pack co-scheduled pipelines onto shared EC2 resources.
+
+Pipelines built from the same template with the same schedule and
+resource settings can share one instance per run. Packing turns each
+such group into a :class:`PackedPipeline`: a single Data Pipeline
+definition holding one ``Ec2Resource`` and every member's activities
+and data nodes, with values substituted in. Members' activities do not
+depend on each other, so one member's failure leaves the others to run;
+the instance may still run them one after another, so a pack's
+``terminateAfter`` is the sum of its members' and packs are split to
+keep it within a limit. A pipeline has a single ``pipelineLogUri``, so
+only members logging to the same place are packed together.
+
+Pipeline directories are unchanged; each member still uploads its own
+files to its own ``myS3InputDir``.
+"""
+
+import json
+import hashlib
+from datetime import datetime
+from collections import defaultdict
+
+from pipewelder.core import Pipeline, PIPELINE_DATETIME_FORMAT
+from pipewelder.schedule import duration_minutes
+
+DEFAULT_MAX_SIZE = 20
+PACK_PREFIX = 'pipewelder-pack-'
+RESOURCE_TYPE = 'Ec2Resource'
+SHARED_TYPES = ['Schedule', RESOURCE_TYPE]
+
+
+class PackedPipeline(Pipeline):
+    """
+    Several :class:`~pipewelder.core.Pipeline` *members*, deployed as
+    one pipeline called *name* whose runs may last *terminate_after*
+    minutes.
+    """
+    def __init__(self, members, name, terminate_after):
+        first = members[0]
+        self.conn = first.conn
+        self.s3_conn = first.s3_conn
+        self.index = first.index
+        self.members = list(members)
+        self.dirpath = None
+        self.pinned = True
+        self.values = {}
+        self.pack_name = name
+        self.terminate_after = terminate_after
+        self.start_offset = None
+        # members' input directories are versioned, if at all, on their own
+        self.versioned = False
+        self.background = None
+        self._content_hash = None
+        self.definition = packed_definition(self.members, terminate_after)
+
+    @property
+    def description(self):
+        return "Pipewelder pack of {0} pipelines: {1}".format(
+            len(self.members), ', '.join(m.name for m in self.members))
+
+    @property
+    def tags(self):
+        """
+        Tags shared by every member.
+        """
+        items = set(self.members[0].tags.items())
+        for member in self.members[1:]:
+            items &= set(member.tags.items())
+        return dict(items)
+
+    def upload(self):
+        """
+        Upload the files of every member; returns ``True`` if all succeed.
+        """
+        return all([member.upload() for member in self.members])
+
+    def shift_start(self, minutes):
+        raise ValueError("Packed pipelines cannot be staggered; "
+                         "stagger their members before packing")
+
+    def content_hash(self):
+        if self._content_hash is None:
+            content = json.dumps([self.definition] +
+                                 [m.content_hash() for m in self.members],
+                                 sort_keys=True)
+            self._content_hash = hashlib.sha1(
+                content.encode('utf-8')).hexdigest()
+        return self._content_hash
+
+    def _get_value(self, key):
+        if key == 'myName':
+            return self.pack_name
+        if key == 'myTerminateAfter':
+            return '{0} minutes'.format(self.terminate_after)
+        # members share their schedule
+        return self.members[0]._get_value(key)
+
+
+def pack(pipelines, max_size=DEFAULT_MAX_SIZE, max_terminate_after=None):
+    """
+    Return a list of :class:`PackedPipeline` objects for groups of
+    *pipelines* that can share resources, plus those that cannot.
+
+    Each pack holds at most *max_size* pipelines, and the sum of their
+    ``myTerminateAfter`` durations is at most *max_terminate_after*
+    (a period string, by default the schedule period, so that a run
+    finishes before the next starts). Pipelines without a bounded
+    duration, or whose template does not have exactly one Ec2Resource,
+    are left unpacked.
+    """
+    groups = defaultdict(list)
+    units = []
+    for pipeline in sorted(pipelines, key=lambda p: p.name):
+        key = packing_key(pipeline)
+        try:
+            duration = duration_minutes(
+                pipeline._get_value('myTerminateAfter'))
+        except ValueError:
+            key = None
+        if key is None:
+            units.append(pipeline)
+        else:
+            groups[key].append((pipeline, duration))
+    for key, members in sorted(groups.items()):
+        first = members[0][0]
+        if max_terminate_after is None:
+            limit = duration_minutes(first._get_value('mySchedulePeriod'))
+        else:
+            limit = duration_minutes(max_terminate_after)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]
+        bins = _first_fit(members, max_size, limit)
+        for number, contents in enumerate(bins):
+            if len(contents) == 1:
+                units.append(contents[0][0])
+                continue
+            name = '{0}{1}-{2}'.format(PACK_PREFIX, digest, number)
+            units.append(PackedPipeline(
+                [member for member, duration in contents], name,
+                sum(duration for member, duration in contents)))
+    return units
+
+
+def packing_key(pipeline):
+    """
+    Return a string identifying *pipeline*'s template, schedule and
+    resource settings, or ``None`` if it cannot be packed.
+    """
+    objects = pipeline.resolved_objects()
+    resources = [o for o in objects if o.get('type') == RESOURCE_TYPE]
+    if len(resources) != 1:
+        return None
+    shared = []
+    for obj in objects:
+        # the Default object, with the pipeline's log URI, must match whole
+        if obj['id'] == 'Default':
+            shared.append(obj)
+            continue
+        if obj.get('type') == RESOURCE_TYPE:
+            obj = dict((k, v) for k, v in obj.items()
+                       if k != 'terminateAfter')
+        elif obj.get('type') == 'Schedule':
+            # start times move forward as they are adjusted to the future;
+            # the phase within the period identifies the schedule
+            obj = dict(obj, startDateTime=_phase(obj))
+        elif obj.get('type') not in SHARED_TYPES:
+            # only the shape of member-specific objects must match
+            obj = sorted(obj)
+        shared.append(obj)
+    return json.dumps(shared, sort_keys=True)
+
+
+def members_of(description):
+    """
+    Return the names of the members of a packed pipeline, from its API
+    *description*.
+    """
+    text = description.get('description') or ''
+    heading, separator, names = text.partition(': ')
+    if not separator:
+        return []
+    return names.split(', ')
+
+
+def packed_definition(members, terminate_after):
+    """
+    Return a definition combining the objects of *members*.
+
+    The Default, Schedule and Ec2Resource objects are taken from the
+    first member. Every other object is copied once per member, with its
+    id prefixed by the member's name.
+    """
+    objects = []
+    for number, member in enumerate(members):
+        resolved = member.resolved_objects()
+        shared = set(o['id'] for o in resolved
+                     if o['id'] == 'Default' or
+                     o.get('type') in SHARED_TYPES)
+        renamed = dict((o['id'], '{0}_{1}'.format(member.name, o['id']))
+                       for o in resolved if o['id'] not in shared)
+        for obj in resolved:
+            if obj['id'] in shared:
+                if number == 0:
+                    if obj.get('type') == RESOURCE_TYPE:
+                        obj['terminateAfter'] = '{0} minutes'.format(
+                            terminate_after)
+                    objects.append(obj)
+                continue
+            objects.append(_renamed(obj, renamed))
+    return {'objects': objects}
+
+
+def _renamed(obj, renamed):
+    def rename(value):
+        if isinstance(value, dict) and list(value.keys()) == ['ref']:
+            return {'ref': renamed.get(value['ref'], value['ref'])}
+        if isinstance(value, list):
+            return [rename(v) for v in value]
+        return value
+    obj = dict((k, rename(v)) for k, v in obj.items())
+    obj['id'] = renamed[obj['id']]
+    return obj
+
+
+def _first_fit(members, max_size, limit):
+    bins = []
+    totals = []
+    for member, duration in members:
+        for number, contents in enumerate(bins):
+            if len(contents) < max_size and totals[number] + duration <= limit:
+                contents.append((member, duration))
+                totals[number] += duration
+                break
+        else:
+            bins.append([(member, duration)])
+            totals.append(duration)
+    return bins
+
+
+def _phase(schedule):
+    try:
+        start = datetime.strptime(schedule['startDateTime'],
+                                  PIPELINE_DATETIME_FORMAT)
+        period = duration_minutes(schedule['period'])
+    except (KeyError, ValueError):
+        return schedule.get('startDateTime')
+    delta = start - datetime(1970, 1, 1)
+    minutes = delta.days * 24 * 60 + delta.seconds // 60
+    return 'phase {0} of {1}'.format(minutes % period, period)
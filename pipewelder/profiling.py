@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling support for Pipewelder runs.
+
+Work done by Pipewelder is attributed to a small set of named phases
+(see :data:`PHASES`) so that a profile of a slow deploy shows whether
+time went to reading configuration, building pipelines, translating
+definitions, or waiting on AWS.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import pstats
+import time
+import cProfile
+import threading
+import contextlib
+from collections import defaultdict
+
+PHASES = (
+    'config discovery',
+    'template load',
+    'pipeline construction',
+    'translation',
+    'network',
+)
+UNATTRIBUTED_PHASE = 'other'
+
+_active = None
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Attribute the enclosed work to phase *name* of the active profiler.
+
+    When no :class:`Profiler` is running, this is a no-op.
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit()
+
+
+@contextlib.contextmanager
+def worker():
+    """
+    Profile the enclosed work of a worker thread with the active
+    profiler, so that work handed to threads shows up in its cProfile
+    results alongside the main thread's.
+
+    When no :class:`Profiler` is running, this is a no-op.
+    """
+    profiler = _active
+    profile = profiler and profiler.thread_profile()
+    if profile is None:
+        yield
+        return
+    try:
+        profile.enable()
+    except ValueError:
+        # the interpreter already profiles every thread with the
+        # main profile and allows only one profiler at a time
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+
+
+class Profiler(object):
+    """
+    Collects a cProfile profile, stack samples and per-phase timings.
+
+    cProfile only observes the thread which calls :meth:`start` and
+    worker threads running inside :func:`worker`, whose profiles are
+    merged into the main one when written; the stack sampler, when
+    available, observes every thread that is inside a :func:`phase`.
+    """
+    def __init__(self, sample_interval=0.005, sampling=None):
+        """
+        *sample_interval* is the number of seconds between stack samples.
+        *sampling* may be set to ``False`` to disable the stack sampler;
+        by default it is used whenever the interpreter supports it.
+        """
+        if sampling is None:
+            sampling = hasattr(sys, '_current_frames')
+        self.sample_interval = sample_interval
+        self.sampling = sampling
+        self.phase_seconds = defaultdict(float)
+        self.phase_calls = defaultdict(int)
+        self.samples = defaultdict(int)
+        self.wall_seconds = 0.0
+        self._profile = cProfile.Profile()
+        self._thread_profiles = {}
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._sampler = None
+        self._started = None
+        self._main_ident = None
+
+    def start(self):
+        """
+        Begin profiling and make this the active profiler.
+        """
+        global _active
+        _active = self
+        self._main_ident = threading.current_thread().ident
+        self._started = time.time()
+        if self.sampling:
+            self._sampler = threading.Thread(target=self._sample_loop,
+                                             name='pipewelder-sampler')
+            self._sampler.daemon = True
+            self._sampler.start()
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling.
+        """
+        global _active
+        self._profile.disable()
+        self.wall_seconds = time.time() - self._started
+        if self._sampler is not None:
+            self._stopping.set()
+            self._sampler.join()
+        if _active is self:
+            _active = None
+
+    def thread_profile(self):
+        """
+        Return the cProfile profile of the calling thread, or ``None``
+        if it is the thread the profiler was started in.
+        """
+        ident = threading.current_thread().ident
+        if ident == self._main_ident:
+            return None
+        with self._lock:
+            return self._thread_profiles.setdefault(ident,
+                                                    cProfile.Profile())
+
+    def stats(self):
+        """
+        Return :class:`pstats.Stats` merging the profiles of all threads.
+        """
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            profiles = list(self._thread_profiles.values())
+        for profile in profiles:
+            if profile.getstats():
+                stats.add(profile)
+        return stats
+
+    def enter(self, name):
+        ident = threading.current_thread().ident
+        with self._lock:
+            stack = self._stacks.setdefault(ident, [])
+            stack.append([name, time.time(), 0.0])
+
+    def exit(self):
+        ident = threading.current_thread().ident
+        now = time.time()
+        with self._lock:
+            stack = self._stacks[ident]
+            name, started, child_seconds = stack.pop()
+            elapsed = now - started
+            self.phase_seconds[name] += elapsed - child_seconds
+            self.phase_calls[name] += 1
+            if stack:
+                stack[-1][2] += elapsed
+
+    def current_phase(self, ident):
+        """
+        Return the innermost phase of thread *ident*, or ``None``.
+        """
+        with self._lock:
+            stack = self._stacks.get(ident)
+            if stack:
+                return stack[-1][0]
+        return None
+
+    def summary(self):
+        """
+        Return a list of ``(phase, seconds, calls)`` tuples in phase order.
+
+        Seconds are exclusive of nested phases.
+        """
+        names = list(PHASES) + sorted(set(self.phase_seconds) - set(PHASES))
+        return [(name, self.phase_seconds[name], self.phase_calls[name])
+                for name in names if name in self.phase_calls]
+
+    def write(self, prefix):
+        """
+        Write profile results to files starting with *prefix*.
+
+        Produces ``<prefix>.pstats`` for :mod:`pstats`,
+        ``<prefix>.collapsed`` with folded stacks for flamegraph tools,
+        and ``<prefix>.phases.json`` with phase timings.
+        Returns the list of paths written.
+        """
+        dirname = os.path.dirname(prefix)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        pstats_path = prefix + '.pstats'
+        self.stats().dump_stats(pstats_path)
+        collapsed_path = prefix + '.collapsed'
+        with open(collapsed_path, 'w') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write('{0} {1}\n'.format(stack, count))
+        phases_path = prefix + '.phases.json'
+        with open(phases_path, 'w') as f:
+            json.dump({
+                'wall_seconds': self.wall_seconds,
+                'sampled': self.sampling,
+                'phases': [{'phase': name, 'seconds': seconds, 'calls': calls}
+                           for name, seconds, calls in self.summary()],
+            }, f, indent=2)
+        return [pstats_path, collapsed_path, phases_path]
+
+    def _sample_loop(self):
+        while not self._stopping.wait(self.sample_interval):
+            self._take_sample()
+
+    def _take_sample(self):
+        for ident, frame in sys._current_frames().items():
+            name = self.current_phase(ident)
+            if name is None:
+                if ident != self._main_ident:
+                    continue
+                name = UNATTRIBUTED_PHASE
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            frames.append('phase:' + name)
+            self.samples[';'.join(reversed(frames))] += 1
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return '{0} ({1}:{2})'.format(code.co_name,
+                                  os.path.basename(code.co_filename),
+                                  code.co_firstlineno)
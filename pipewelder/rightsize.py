@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Recommend EC2 instance types and run time limits from run history.
+
+Each pipeline's run durations, from :mod:`pipewelder.history`, are
+scaled by the relative speed of every instance type in a catalog to
+estimate how long its runs would take there. The recommended type is
+the one with the lowest cost per run among those whose estimated 95th
+percentile leaves room within the schedule period; the recommended
+``myTerminateAfter`` allows a margin over the longest estimated run.
+
+The speed model is deliberately simple: durations are assumed to scale
+inversely with a type's speed. It suits CPU-bound runs and overstates
+the gain for runs that mostly wait on S3 or other services.
+"""
+
+from __future__ import division
+
+import os
+import json
+import math
+
+from pipewelder import util
+from pipewelder.core import PIPELINE_PARAM_RE
+from pipewelder.packing import RESOURCE_TYPE
+
+# estimated p95 durations must fit within this fraction of the period
+TARGET_FRACTION = 0.5
+# recommended myTerminateAfter is this multiple of the longest run...
+TERMINATE_MARGIN = 1.5
+# ...rounded up to a multiple of this many minutes
+TERMINATE_STEP = 5
+# EC2 resources are billed per started instance-hour
+BILLING_MINUTES = 60
+# relative speed (EC2 compute units) and on-demand dollars per hour
+DEFAULT_CATALOG = {
+    't1.micro': {'speed': 0.5, 'price': 0.02},
+    'm1.small': {'speed': 1, 'price': 0.044},
+    'm1.medium': {'speed': 2, 'price': 0.087},
+    'm1.large': {'speed': 4, 'price': 0.175},
+    'm1.xlarge': {'speed': 8, 'price': 0.35},
+    'm3.medium': {'speed': 3, 'price': 0.067},
+    'm3.large': {'speed': 6.5, 'price': 0.133},
+    'm3.xlarge': {'speed': 13, 'price': 0.266},
+    'c1.medium': {'speed': 5, 'price': 0.13},
+    'c1.xlarge': {'speed': 20, 'price': 0.52},
+}
+
+
+def load_catalog(path=None):
+    """
+    Return the instance type catalog in JSON file *path*, or
+    :data:`DEFAULT_CATALOG` if *path* is ``None``.
+
+    The file maps instance type names to objects with a relative
+    ``speed`` and an hourly ``price``.
+    """
+    if path is None:
+        return DEFAULT_CATALOG
+    catalog = util.load_json(path)
+    for name, entry in catalog.items():
+        if not entry.get('speed', 0) > 0 or 'price' not in entry:
+            raise ValueError("Catalog entry '{0}' in '{1}' needs a positive "
+                             "speed and a price".format(name, path))
+    return catalog
+
+
+def instance_type_of(pipeline):
+    """
+    Return *pipeline*'s instance type and the parameter setting it, or
+    ``None`` for the parameter if the template hard-codes the type.
+    """
+    resources = [obj for obj in pipeline.definition['objects']
+                 if obj.get('type') == RESOURCE_TYPE]
+    if len(resources) != 1 or 'instanceType' not in resources[0]:
+        raise ValueError("Pipeline {0} has no single instanceType"
+                         .format(pipeline.name))
+    expression = resources[0]['instanceType']
+    placeholders = PIPELINE_PARAM_RE.findall(expression)
+    if placeholders and expression == '#{' + placeholders[0] + '}':
+        return pipeline._get_value(placeholders[0]), placeholders[0]
+    return [obj for obj in pipeline.resolved_objects()
+            if obj['id'] == resources[0]['id']][0]['instanceType'], None
+
+
+def recommend(report, current, catalog, period_minutes):
+    """
+    Return a dict recommending an instance type and ``myTerminateAfter``
+    for a pipeline running on instance type *current*, given its
+    :func:`pipewelder.history.analyze` *report* and schedule period.
+
+    The ``instance_type`` and ``terminate_after`` recommendations are
+    ``None``, with a ``reason``, if there is too little to go on.
+    """
+    recommendation = unrecommended(report['name'], None, current,
+                                   report['terminate_after'])
+    if report['p95'] is None:
+        recommendation['reason'] = 'no finished runs'
+        return recommendation
+    if current not in catalog:
+        recommendation['reason'] = "'{0}' is not in the catalog".format(
+            current)
+        return recommendation
+    base = catalog[current]['speed']
+    target = TARGET_FRACTION * period_minutes
+    candidates = []
+    for name, entry in catalog.items():
+        scale = base / entry['speed']
+        p95 = report['p95'] * scale
+        candidates.append((cost_per_run(entry['price'], p95), name != current,
+                           p95, name, report['max'] * scale))
+    fitting = [c for c in candidates if c[2] <= target]
+    if fitting:
+        cost, _, p95, name, longest = min(fitting)
+        recommendation['reason'] = (name == current and 'already right' or
+                                    'cheapest that fits the period')
+    else:
+        cost, _, p95, name, longest = min(candidates,
+                                          key=lambda c: (c[2], c[0]))
+        recommendation['reason'] = 'none fits the period; fastest'
+    recommendation.update({
+        'instance_type': name,
+        'terminate_after': '{0} minutes'.format(terminate_minutes(longest)),
+        'estimated_p95': p95,
+        'cost_per_run': cost,
+        'current_cost_per_run': cost_per_run(catalog[current]['price'],
+                                             report['p95']),
+    })
+    return recommendation
+
+
+def unrecommended(name, reason, current=None, terminate_after=None):
+    """
+    Return a recommendation, in the form of :func:`recommend`, of nothing
+    for pipeline *name*, because of *reason*.
+    """
+    return {
+        'name': name,
+        'current_type': current,
+        'current_terminate_after': terminate_after,
+        'instance_type': None,
+        'terminate_after': None,
+        'estimated_p95': None,
+        'cost_per_run': None,
+        'current_cost_per_run': None,
+        'reason': reason,
+    }
+
+
+def cost_per_run(price, minutes):
+    """
+    Return the cost of a run lasting *minutes* on an instance billed
+    *price* per started hour.
+
+    >>> cost_per_run(0.5, 61)
+    1.0
+    """
+    hours = max(1, int(math.ceil(minutes / BILLING_MINUTES)))
+    return price * hours
+
+
+def terminate_minutes(longest):
+    """
+    Return a run time limit, in whole minutes, leaving a margin over a
+    longest run of *longest* minutes.
+
+    >>> terminate_minutes(12)
+    20
+    """
+    minutes = longest * TERMINATE_MARGIN
+    return max(TERMINATE_STEP,
+               int(math.ceil(minutes / TERMINATE_STEP)) * TERMINATE_STEP)
+
+
+def write_values(pipeline, recommendation, parameter):
+    """
+    Write *recommendation* into *pipeline*'s values.json, setting
+    *parameter* to the instance type and ``myTerminateAfter``.
+
+    Values given in pipewelder.json still take precedence.
+    """
+    path = os.path.join(pipeline.dirpath, 'values.json')
+    data = util.load_json(path)
+    values = data.setdefault('values', {})
+    values[parameter] = recommendation['instance_type']
+    values['myTerminateAfter'] = recommendation['terminate_after']
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+    os.rename(temporary, path)
+
+
+def format_recommendations(recommendations):
+    """
+    Return lines of a table of *recommendations* from :func:`recommend`.
+    """
+    lines = ["{0:<30} {1:<11} {2:<11} {3:>13} {4:>8} {5:>9}  {6}".format(
+        'PIPELINE', 'CURRENT', 'SUGGESTED', 'TERMINATE', 'EST P95',
+        '$/RUN', 'REASON')]
+    for r in recommendations:
+        estimated = (r['estimated_p95'] is not None and
+                     '{0:.1f}m'.format(r['estimated_p95']) or '-')
+        cost = '-'
+        if r['cost_per_run'] is not None:
+            cost = '{0:.3f}'.format(r['cost_per_run'])
+        lines.append(
+            "{0:<30} {1:<11} {2:<11} {3:>13} {4:>8} {5:>9}  {6}".format(
+                r['name'], r['current_type'] or '-', r['instance_type'] or '-',
+                r['terminate_after'] or '-', estimated, cost, r['reason']))
+    return lines
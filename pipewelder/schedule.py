@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Simulate when a fleet of pipelines launches its EC2 resources.
+
+Each pipeline runs every ``mySchedulePeriod`` from ``myStartDateTime``
+and each run holds an instance for at most ``myTerminateAfter``.
+Because schedules are periodic, the simulation builds one occupancy
+pattern per distinct period and tiles it across the horizon rather than
+expanding every run, so its cost grows with the number of pipelines plus
+the horizon length, not their product. Only pipelines whose
+``myStartDateTime`` is still to come have their runs expanded, since
+they are idle until then. numpy is used when installed;
+otherwise an equivalent pure-Python implementation runs.
+"""
+
+from __future__ import division
+
+import re
+import heapq
+import hashlib
+from datetime import datetime, timedelta
+from collections import defaultdict, deque
+
+from pipewelder.core import PIPELINE_DATETIME_FORMAT, parse_period
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+MINUTE_FORMAT = '%Y-%m-%dT%H:%M'
+EXPRESSION_RE = re.compile(r'^#\{(?P<body>.*)\}$')
+FORMAT_RE = re.compile(r'^format\((?P<body>.*)\)$')
+SHIFT_RE = re.compile(r'^(?P<sign>minus|plus)(?P<unit>Minutes|Hours|Days)'
+                      r'\((?P<base>.+),\s*(?P<amount>\d+)\)$')
+UNIT_MINUTES = {'Minutes': 1, 'Hours': 60, 'Days': 24 * 60}
+# longest cycle of repeating activity considered when optimizing offsets
+MAX_CYCLE = 7 * 24 * 60
+
+
+class Schedule(object):
+    """
+    The runs of pipeline *name*: one every *period* minutes, the first
+    *offset* minutes after the simulation start, each lasting at most
+    *duration* minutes. *bounded* is ``False`` when no run duration
+    limit could be found, in which case *duration* is the whole period.
+    *first* is the minute of the first run for a schedule starting at
+    least a period after the simulation start, or ``None`` if *offset*
+    alone places its runs.
+    """
+    def __init__(self, name, period, offset, duration, bounded=True,
+                 first=None):
+        self.name = name
+        self.period = period
+        self.offset = offset
+        self.duration = duration
+        self.bounded = bounded
+        self.first = first
+
+    @classmethod
+    def from_pipeline(cls, pipeline, start):
+        """
+        Return the schedule of :class:`~pipewelder.core.Pipeline`
+        *pipeline* relative to datetime *start*.
+        """
+        value = pipeline._get_value
+        period = _minutes(parse_period(value('mySchedulePeriod')))
+        first = datetime.strptime(value('myStartDateTime'),
+                                  PIPELINE_DATETIME_FORMAT)
+        offset = _minutes(first - start) % period
+        begins = None
+        if _minutes(first - start) >= period:
+            begins = _minutes(first - start)
+        try:
+            duration = duration_minutes(value('myTerminateAfter'))
+            bounded = True
+        except ValueError:
+            duration = period
+            bounded = False
+        return cls(pipeline.name, period, offset, duration, bounded, begins)
+
+    def starts_at(self, minute):
+        """
+        Return ``True`` if a run starts at *minute*.
+        """
+        if self.first is not None and minute < self.first:
+            return False
+        return (minute - self.offset) % self.period == 0
+
+
+def duration_minutes(expression):
+    """
+    Return the whole number of minutes described by *expression*,
+    a period or a Data Pipeline expression shifting one.
+
+    >>> duration_minutes('10 minutes')
+    10
+    >>> duration_minutes('#{format(minusMinutes(1 hours, 10))}')
+    50
+    """
+    expression = expression.strip()
+    for pattern in (EXPRESSION_RE, FORMAT_RE):
+        match = pattern.match(expression)
+        if match:
+            return duration_minutes(match.group('body'))
+    match = SHIFT_RE.match(expression)
+    if match:
+        amount = (int(match.group('amount')) *
+                  UNIT_MINUTES[match.group('unit')])
+        if match.group('sign') == 'minus':
+            amount = -amount
+        minutes = duration_minutes(match.group('base')) + amount
+        if minutes <= 0:
+            raise ValueError("'{0}' is not a positive duration"
+                             .format(expression))
+        return minutes
+    return _minutes(parse_period(expression.lower()), ceiling=True)
+
+
+class Simulation(object):
+    """
+    Per-minute activity of *schedules* over *horizon* minutes from
+    datetime *start*.
+
+    ``concurrency[t]`` counts runs in progress during minute *t* and
+    ``launches[t]`` counts runs starting then, assuming each run lasts
+    its full duration.
+    """
+    def __init__(self, schedules, horizon, start):
+        self.schedules = list(schedules)
+        self.horizon = horizon
+        self.start = start
+        self.concurrency = occupancy(
+            self.schedules, horizon, [s.duration for s in self.schedules])
+        self.launches = occupancy(
+            self.schedules, horizon, [1] * len(self.schedules))
+
+    @property
+    def instance_hours(self):
+        return int(sum(self.concurrency)) / 60
+
+    def peak(self, series=None):
+        """
+        Return ``(count, minute)`` for the busiest minute of *series*
+        (by default, :attr:`concurrency`).
+        """
+        if series is None:
+            series = self.concurrency
+        if not self.horizon:
+            return (0, None)
+        minute = _busiest(series, 1)[0]
+        return (int(series[minute]), minute)
+
+    def hotspots(self, count=10):
+        """
+        Return up to *count* ``(minute, names)`` pairs for the minutes
+        with the most launches, each listing the pipelines launching then.
+
+        The fleet's activity repeats every least common multiple of its
+        periods once every pipeline has started, so only minutes until
+        the end of the first such cycle are considered, and a collision
+        of the same pipelines is reported once.
+        """
+        cycle = 1
+        for period in set(s.period for s in self.schedules):
+            cycle = cycle * period // gcd(cycle, period)
+            if cycle >= self.horizon:
+                break
+        cycle = min(cycle + max([s.first or 0 for s in self.schedules] +
+                                [0]), self.horizon)
+        seen = set()
+        hotspots = []
+        for minute in _busiest(self.launches[:cycle], count * 20):
+            if self.launches[minute] < 2:
+                break
+            names = tuple(s.name for s in self.schedules
+                          if s.starts_at(minute))
+            if names in seen:
+                continue
+            seen.add(names)
+            hotspots.append((minute, names))
+            if len(hotspots) == count:
+                break
+        return hotspots
+
+    def time_of(self, minute):
+        """
+        Return the formatted time of *minute*.
+        """
+        moment = self.start + timedelta(minutes=minute)
+        return moment.strftime(MINUTE_FORMAT)
+
+
+def hash_offset(name, period):
+    """
+    Return a deterministic offset, in minutes within *period*, for the
+    pipeline called *name*.
+    """
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return int(digest, 16) % period
+
+
+def optimized_offsets(schedules, fixed=()):
+    """
+    Return a dict mapping the name of each of *schedules* to a new
+    offset chosen to keep peak concurrency low, given *fixed* schedules
+    whose offsets cannot change.
+
+    Schedules are placed greedily, longest runs first; each goes where
+    the busiest minute of its runs is least busy, preferring offsets
+    where fewer other runs start.
+    """
+    fixed = list(fixed)
+    schedules = sorted(schedules,
+                       key=lambda s: (-s.duration, s.period, s.name))
+    cycle = 1
+    for period in set(s.period for s in schedules + fixed):
+        cycle = min(cycle * period // gcd(cycle, period), MAX_CYCLE)
+    load = [0] * cycle
+    starts = [0] * cycle
+    for schedule in fixed:
+        _place(load, starts, schedule.period, schedule.offset,
+               schedule.duration)
+    offsets = {}
+    for schedule in schedules:
+        period = min(schedule.period, cycle)
+        busiest = [max(load[j::period]) for j in range(period)]
+        launches = [max(starts[j::period]) for j in range(period)]
+        window = min(schedule.duration, period)
+        peaks = _window_maxima(busiest, window)
+        offset = min(range(period),
+                     key=lambda o: (peaks[o], launches[o], o))
+        _place(load, starts, schedule.period, offset, schedule.duration)
+        offsets[schedule.name] = offset
+    return offsets
+
+
+def _place(load, starts, period, offset, duration):
+    cycle = len(load)
+    for start in range(offset % period, cycle, period):
+        starts[start] += 1
+        for minute in range(start, start + duration):
+            load[minute % cycle] += 1
+
+
+def _window_maxima(values, width):
+    """
+    Return the maximum of each circular window of *width* entries of
+    *values*, indexed by the window's first entry.
+    """
+    doubled = values + values
+    maxima = []
+    window = deque()
+    for i in range(len(doubled) - 1, -1, -1):
+        while window and doubled[window[-1]] <= doubled[i]:
+            window.pop()
+        window.append(i)
+        while window[0] >= i + width:
+            window.popleft()
+        if i < len(values):
+            maxima.append(doubled[window[0]])
+    maxima.reverse()
+    return maxima
+
+
+def occupancy(schedules, horizon, lengths):
+    """
+    Return, for each of *horizon* minutes, how many runs of *schedules*
+    are in progress when each run lasts the corresponding entry of
+    *lengths* minutes.
+    """
+    groups = defaultdict(list)
+    delayed = []
+    for schedule, length in zip(schedules, lengths):
+        if schedule.first is None:
+            groups[schedule.period].append((schedule.offset, length))
+        elif schedule.first < horizon:
+            delayed.append((schedule.first, schedule.period, length))
+    if numpy is not None:
+        total = _numpy_occupancy(groups, horizon)
+        if delayed:
+            total += _numpy_delayed(delayed, horizon)
+    else:
+        total = _python_occupancy(groups, horizon)
+        if delayed:
+            extra = _python_delayed(delayed, horizon)
+            total = [a + b for a, b in zip(total, extra)]
+    return total
+
+
+def _numpy_delayed(delayed, horizon):
+    """
+    Return the occupancy of runs of period *period* and length *length*
+    from minute *first* for each ``(first, period, length)`` of
+    *delayed*.
+
+    Each run starts and ends a period after the previous one, so a
+    schedule only needs marking at its first start and first end: a
+    cumulative sum over each column of the minutes laid out in rows of
+    one period repeats those marks every period.
+    """
+    total = numpy.zeros(horizon, dtype=numpy.int64)
+    groups = defaultdict(list)
+    for first, period, length in delayed:
+        groups[period].append((first, length))
+    for period, runs in groups.items():
+        firsts, lengths = numpy.array(runs, dtype=numpy.int64).T
+        rows = -(-horizon // period)
+        marks = numpy.zeros(rows * period, dtype=numpy.int64)
+        numpy.add.at(marks, firsts, 1)
+        ends = firsts + lengths
+        ends = ends[ends < horizon]
+        numpy.add.at(marks, ends, -1)
+        diff = marks.reshape(rows, period).cumsum(axis=0).ravel()
+        total += numpy.cumsum(diff[:horizon])
+    return total
+
+
+def _python_delayed(delayed, horizon):
+    groups = defaultdict(list)
+    for first, period, length in delayed:
+        groups[period].append((first, length))
+    total = [0] * horizon
+    for period, runs in groups.items():
+        diff = [0] * horizon
+        for first, length in runs:
+            diff[first] += 1
+            if first + length < horizon:
+                diff[first + length] -= 1
+        for minute in range(period, horizon):
+            diff[minute] += diff[minute - period]
+        running = 0
+        for minute, change in enumerate(diff):
+            running += change
+            total[minute] += running
+    return total
+
+
+def _numpy_occupancy(groups, horizon):
+    total = numpy.zeros(horizon, dtype=numpy.int64)
+    for period, runs in groups.items():
+        offsets, lengths = numpy.array(runs, dtype=numpy.int64).T
+        full, remainder = numpy.divmod(lengths, period)
+        partial = (remainder > 0).astype(numpy.int64)
+        ends = offsets + remainder
+        wrapped = ends > period
+        diff = numpy.zeros(period + 1, dtype=numpy.int64)
+        numpy.add.at(diff, offsets, partial)
+        numpy.add.at(diff, numpy.minimum(ends, period), -partial)
+        diff[0] += wrapped.sum()
+        numpy.add.at(diff, ends[wrapped] - period, -1)
+        pattern = numpy.cumsum(diff[:period]) + full.sum()
+        total += numpy.resize(pattern, horizon)
+    return total
+
+
+def _python_occupancy(groups, horizon):
+    total = [0] * horizon
+    for period, runs in groups.items():
+        diff = [0] * (period + 1)
+        base = 0
+        for offset, length in runs:
+            full, remainder = divmod(length, period)
+            base += full
+            if not remainder:
+                continue
+            end = offset + remainder
+            diff[offset] += 1
+            diff[min(end, period)] -= 1
+            if end > period:
+                diff[0] += 1
+                diff[end - period] -= 1
+        pattern = []
+        running = base
+        for change in diff[:period]:
+            running += change
+            pattern.append(running)
+        tiled = pattern * (horizon // period + 1)
+        total = [a + b for a, b in zip(total, tiled)]
+    return total
+
+
+def _busiest(series, count):
+    """
+    Return the indexes of the *count* largest entries of *series*,
+    largest (then earliest) first.
+    """
+    if numpy is not None:
+        order = numpy.argsort(-numpy.asarray(series), kind='mergesort')
+        return [int(i) for i in order[:count]]
+    top = heapq.nlargest(count, range(len(series)), key=series.__getitem__)
+    return sorted(top, key=lambda i: (-series[i], i))
+
+
+def _minutes(delta, ceiling=False):
+    seconds = delta.days * 24 * 60 * 60 + delta.seconds
+    if ceiling:
+        return -(-seconds // 60)
+    return seconds // 60
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Spread a group's pipelines across several AWS regions or accounts.
+
+Data Pipeline limits how many pipelines an account may have in a
+region, so a large fleet is split into shards, each a region and,
+optionally, a credential profile with a quota of pipelines. Pipelines
+are assigned to shards by consistent hashing: each shard owns many
+points on a hash ring and a pipeline goes to the first shard after its
+own hash that still has room. Adding or removing a shard therefore only
+moves the pipelines near that shard's points, plus any that overflow a
+full shard.
+"""
+
+import hashlib
+from bisect import bisect
+
+# points on the ring per shard; more points even out shard loads
+POINTS_PER_SHARD = 128
+
+
+class Shard(object):
+    """
+    A target for pipelines: a *region*, an optional credential *profile*
+    and an optional *quota* on the number of pipelines, identified by
+    *name* (by default, the region and profile).
+    """
+    def __init__(self, region, profile=None, quota=None, name=None):
+        self.region = region
+        self.profile = profile
+        self.quota = quota
+        if name is None:
+            name = region if profile is None else \
+                '{0}-{1}'.format(region, profile)
+        self.name = name
+
+    @classmethod
+    def from_config(cls, shard):
+        """
+        Return a shard described by dict *shard* from pipewelder.json.
+        """
+        unknown = set(shard) - set(['region', 'profile', 'quota', 'name'])
+        if unknown or 'region' not in shard:
+            raise ValueError("Invalid shard {0}; shards need a 'region' and "
+                             "may have a 'profile', 'quota' and 'name'"
+                             .format(shard))
+        return cls(**shard)
+
+
+def assign(keys, shards):
+    """
+    Return a dict mapping each of *keys* to the name of one of *shards*.
+
+    Raises ``ValueError`` if the shards' quotas cannot hold every key.
+    """
+    names = [shard.name for shard in shards]
+    if len(set(names)) != len(names):
+        raise ValueError("Shard names must be unique: {0}"
+                         .format(', '.join(names)))
+    if not shards:
+        raise ValueError("No shards to assign pipelines to")
+    keys = list(keys)
+    quotas = [shard.quota for shard in shards]
+    if None not in quotas and sum(quotas) < len(keys):
+        raise ValueError("{0} pipelines exceed the total shard quota of {1}"
+                         .format(len(keys), sum(quotas)))
+    ring = sorted((_hash('{0}#{1}'.format(shard.name, point)), number)
+                  for number, shard in enumerate(shards)
+                  for point in range(POINTS_PER_SHARD))
+    hashes = [point for point, number in ring]
+    counts = [0] * len(shards)
+    assignment = {}
+    # keys are placed in hash order so overflow does not depend on the
+    # order they were listed in
+    for digest, key in sorted((_hash(key), key) for key in keys):
+        start = bisect(hashes, digest)
+        for step in range(len(ring)):
+            number = ring[(start + step) % len(ring)][1]
+            if quotas[number] is None or counts[number] < quotas[number]:
+                break
+        counts[number] += 1
+        assignment[key] = shards[number].name
+    return assignment
+
+
+def describe_target(config):
+    """
+    Return a description of where configuration *config* deploys
+    pipelines, for messages.
+    """
+    if config.get('profile'):
+        return "region '{0}' (profile '{1}')".format(config['region'],
+                                                     config['profile'])
+    return "region '{0}'".format(config['region'])
+
+
+def _hash(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Summarize the recent runs of deployed pipelines.
+
+Runs are looked up with :mod:`pipewelder.instances`, for many pipelines
+at once, and kept for a short while in a local cache so that checking
+again straight away does not repeat the API calls.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from pipewelder import util, instances
+from pipewelder.instances import Instance
+
+DEFAULT_CACHE_PATH = '.pipewelder-status.json'
+DEFAULT_CACHE_TTL = 60
+DEFAULT_RUNS = 5
+
+
+class StatusCache(object):
+    """
+    Runs looked up in the last *ttl* seconds, saved to *path*.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        if ttl > 0 and os.path.exists(path):
+            try:
+                self._entries = util.load_json(path)
+            except ValueError:
+                logging.warning("Ignoring unreadable status cache {0}"
+                                .format(path))
+
+    def get(self, key):
+        """
+        Return the pipeline id and runs cached under *key*, or ``None``
+        if there are none younger than the time to live.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.time() - entry['time'] >= self.ttl:
+            return None
+        return (entry.get('pipeline_id'),
+                [Instance.from_json(run) for run in entry['runs']])
+
+    def put(self, key, pipeline_id, runs):
+        with self._lock:
+            self._entries[key] = {'time': time.time(),
+                                  'pipeline_id': pipeline_id,
+                                  'runs': [run.to_json() for run in runs]}
+
+    def save(self):
+        """
+        Write entries still within their time to live to the cache file.
+        """
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            entries = dict((key, entry)
+                           for key, entry in self._entries.items()
+                           if now - entry['time'] < self.ttl)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(entries, f, sort_keys=True)
+        os.rename(temporary, self.path)
+
+
+def pipeline_status(pipeline, count=DEFAULT_RUNS, window=None, cache=None,
+                    group=None):
+    """
+    Return a dict summarizing the last *count* runs of *pipeline*, from
+    configuration *group*, that were scheduled within timedelta *window*
+    (by default, enough periods of its schedule to hold them).
+
+    A pipeline that has not been deployed has no ``pipeline_id`` or runs.
+    """
+    period = instances.period_of(pipeline)
+    window = window or period * (count + 1)
+    key = '{0} {1} {2} {3} {4}'.format(group, pipeline.name,
+                                       pipeline.unique_id,
+                                       int(util.total_seconds(window)), count)
+    cached = cache.get(key) if cache is not None else None
+    if cached is None:
+        pipeline_id = pipeline.deployed_id()
+        runs = []
+        if pipeline_id is not None:
+            since = datetime.utcnow() - window
+            runs = instances.runs(pipeline, since)[:count]
+        if cache is not None:
+            cache.put(key, pipeline_id, runs)
+    else:
+        pipeline_id, runs = cached
+    return {
+        'name': pipeline.name,
+        'pipeline_id': pipeline_id,
+        'period': pipeline._get_value('mySchedulePeriod'),
+        'failures': sum(1 for run in runs if run.failed),
+        'runs': [run.to_json() for run in runs],
+    }
+
+
+def fleet_status(pipelines, count=DEFAULT_RUNS, window=None, cache=None,
+                 concurrency=1, group=None):
+    """
+    Return :func:`pipeline_status` for each of *pipelines*, looking up
+    up to *concurrency* pipelines at once.
+    """
+    pipelines = list(pipelines)
+    instances.prefetch_ids(pipelines)
+    return util.parallel_map(
+        lambda pipeline: pipeline_status(pipeline, count, window, cache,
+                                         group),
+        pipelines, concurrency)
+
+
+def format_table(statuses):
+    """
+    Return lines of a table of the runs in *statuses*, one row per run.
+    """
+    lines = ["{0:<30} {1:<16} {2:<19} {3:<19} {4:>9}  {5}".format(
+        'PIPELINE', 'STATUS', 'SCHEDULED', 'STARTED', 'DURATION', 'ERROR')]
+    for status in statuses:
+        if status['pipeline_id'] is None:
+            lines.append("{0:<30} {1}".format(status['name'],
+                                              '(not deployed)'))
+        elif not status['runs']:
+            lines.append("{0:<30} {1}".format(status['name'],
+                                              '(no recent runs)'))
+        for run in status['runs']:
+            duration = Instance.from_json(run).duration
+            lines.append("{0:<30} {1:<16} {2:<19} {3:<19} {4:>9}  {5}".format(
+                status['name'], run['status'] or '-',
+                run['scheduled_start'] or '-', run['actual_start'] or '-',
+                format_duration(duration), run['error'] or ''))
+    return lines
+
+
+def format_duration(duration):
+    """
+    Return timedelta *duration* as ``H:MM:SS``, or ``'-'`` if ``None``.
+    """
+    if duration is None:
+        return '-'
+    seconds = int(util.total_seconds(duration))
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600,
+                                        seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for managing pipeline inputs in S3.
+"""
+
+import os
+import json
+import logging
+import hashlib
+import threading
+
+from boto.exception import S3ResponseError
+from six.moves import queue
+
+from pipewelder import hashing, profiling, tracing
+
+VERSIONS_DIR = 'versions'
+VERSION_MARKER = '.pipewelder-version'
+MANIFEST_NAME = '.pipewelder-manifest.json'
+MANIFEST_FORMAT = 1
+# most keys S3 deletes in one request
+DELETE_BATCH_SIZE = 1000
+# delete requests in flight at once
+DELETE_CONCURRENCY = 4
+
+
+def publish(bucket, input_dir, objects):
+    """
+    Make *objects*, a list of ``(filename, bytes)`` pairs, the contents
+    of *input_dir* in *bucket*; see :func:`sync`.
+    """
+    return sync(bucket, input_dir, [
+        (filename, hashlib.md5(content).hexdigest(), len(content),
+         _string_writer(content))
+        for filename, content in objects])
+
+
+def publish_files(bucket, input_dir, dirpath, deletable='', hashes=None):
+    """
+    Make the files beneath *dirpath* the contents of *input_dir* in
+    *bucket*; see :func:`sync`.
+
+    *hashes*, from :func:`pipewelder.hashing.hash_tree` with at least
+    :data:`~pipewelder.hashing.ETAG`, saves hashing the files again.
+    Files over :data:`~pipewelder.hashing.MULTIPART_THRESHOLD` are
+    uploaded in parts, so their ETags are those computed locally.
+    """
+    if hashes is None:
+        hashes = hashing.hash_tree(dirpath, [hashing.ETAG])
+    sources = []
+    for path, digests in hashes:
+        local_path = os.path.join(dirpath, path)
+        sources.append((path.replace(os.sep, '/'), digests[hashing.ETAG],
+                        os.path.getsize(local_path),
+                        _file_writer(local_path)))
+    return sync(bucket, input_dir, sources, deletable)
+
+
+def sync(bucket, input_dir, sources, deletable=''):
+    """
+    Make *sources* the contents of *input_dir* in *bucket*.
+
+    Each source is a ``(filename, etag, size, put)`` tuple, where *put*
+    writes the content to a given key. Sources are put in order,
+    skipping those whose ETag and size match what was last uploaded, and
+    then objects no longer present are deleted. What was uploaded is
+    read from the manifest in *input_dir*, rewritten after each
+    successful sync that changes anything. Without a readable manifest,
+    the objects are listed instead, and only those under *deletable* are
+    deleted.
+
+    Returns ``True`` if successful.
+    """
+    recorded = read_manifest(bucket, input_dir)
+    trusted = recorded is not None
+    if not trusted:
+        recorded = dict(_listed(bucket, input_dir))
+    current = {}
+    for filename, etag, size, put in sources:
+        key_name = _key_name(input_dir, filename)
+        current[filename] = {'etag': etag, 'size': size}
+        if recorded.get(filename) == current[filename]:
+            logging.info("Skipping upload of {0}; unchanged".format(key_name))
+            continue
+        k = bucket.new_key(key_name)
+        with profiling.phase('network'):
+            with tracing.span('put_object', key=key_name):
+                put(k)
+        logging.info("Uploaded {0}".format(key_name))
+    stale = sorted(_key_name(input_dir, filename)
+                   for filename in set(recorded) - set(current)
+                   if trusted or filename.startswith(deletable))
+    if stale:
+        deleted, errors = delete_keys(bucket, stale)
+        if errors:
+            return False
+        logging.info("Deleted from bucket '{0}': {1}"
+                     .format(bucket.name, stale))
+    if not trusted or recorded != current:
+        write_manifest(bucket, input_dir, current)
+    return True
+
+
+def read_manifest(bucket, input_dir):
+    """
+    Return the manifest of *input_dir* in *bucket*, a dict mapping
+    filenames to dicts of their ``'etag'`` and ``'size'``, or ``None``
+    if it is missing or unreadable.
+    """
+    key_name = _key_name(input_dir, MANIFEST_NAME)
+    try:
+        with profiling.phase('network'):
+            with tracing.span('get_object', key=key_name):
+                data = bucket.new_key(key_name).get_contents_as_string()
+    except S3ResponseError as e:
+        if e.status != 404:
+            raise
+        return None
+    try:
+        manifest = json.loads(data.decode('utf-8'))
+        if manifest['format'] != MANIFEST_FORMAT:
+            raise ValueError("unknown format {0}".format(manifest['format']))
+        return dict((filename, {'etag': str(entry['etag']),
+                                'size': int(entry['size'])})
+                    for filename, entry in manifest['objects'].items())
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning("Ignoring unreadable manifest {0}: {1}"
+                        .format(key_name, e))
+        return None
+
+
+def write_manifest(bucket, input_dir, objects):
+    """
+    Record *objects*, in the form returned by :func:`read_manifest`, as
+    the contents of *input_dir* in *bucket*.
+    """
+    content = json.dumps({'format': MANIFEST_FORMAT, 'objects': objects},
+                         sort_keys=True)
+    k = bucket.new_key(_key_name(input_dir, MANIFEST_NAME))
+    with profiling.phase('network'):
+        with tracing.span('put_object', key=k.key):
+            k.set_contents_from_string(content.encode('utf-8'))
+
+
+def _listed(bucket, input_dir):
+    """
+    Yield ``(filename, entry)`` pairs, as in a manifest, for the objects
+    in *input_dir*, excluding Pipewelder's own and those of versions.
+    """
+    prefix = input_dir.rstrip('/') + '/'
+    versions = prefix + VERSIONS_DIR + '/'
+    for page in _pages(bucket, prefix):
+        for key in page:
+            filename = key.name[len(prefix):]
+            if (key.name.startswith(versions) or
+                    filename in (MANIFEST_NAME, VERSION_MARKER)):
+                continue
+            yield filename, {'etag': key.etag.strip('"'),
+                             'size': int(key.size)}
+
+
+def _key_name(input_dir, filename):
+    return os.path.normpath(os.path.join(input_dir, filename))
+
+
+def _string_writer(content):
+    return lambda key: key.set_contents_from_string(content)
+
+
+def _file_writer(path):
+    def put(key):
+        size = os.path.getsize(path)
+        if hashing.is_multipart(size):
+            _put_parts(key, path, size)
+        else:
+            key.set_contents_from_filename(path)
+    return put
+
+
+def _put_parts(key, path, size):
+    """
+    Upload the file at *path* to *key* in parts of
+    :func:`pipewelder.hashing.part_size`.
+    """
+    part = hashing.part_size(size)
+    upload = key.bucket.initiate_multipart_upload(key.name)
+    try:
+        with open(path, 'rb') as f:
+            for number, offset in enumerate(range(0, size, part), 1):
+                f.seek(offset)
+                upload.upload_part_from_file(
+                    f, number, size=min(part, size - offset))
+        upload.complete_upload()
+    except Exception:
+        upload.cancel_upload()
+        raise
+
+
+def versioned_dir(input_dir, version):
+    """
+    Return the immutable prefix, beneath *input_dir*, for *version*.
+    """
+    return '{0}/{1}/{2}'.format(input_dir.rstrip('/'), VERSIONS_DIR, version)
+
+
+def is_published(bucket, version_dir):
+    """
+    Return ``True`` if an upload to *version_dir* has completed.
+    """
+    with profiling.phase('network'):
+        with tracing.span('head_object'):
+            marker = bucket.get_key(version_dir + '/' + VERSION_MARKER)
+    return marker is not None
+
+
+def mark_published(bucket, version_dir):
+    """
+    Record that the upload to *version_dir* is complete.
+    """
+    k = bucket.new_key(version_dir + '/' + VERSION_MARKER)
+    with profiling.phase('network'):
+        with tracing.span('put_object', key=k.key):
+            k.set_contents_from_string(os.path.basename(version_dir))
+
+
+def collect_versions(bucket, input_dir, keep):
+    """
+    Delete every version beneath *input_dir* except those in *keep*.
+
+    Returns the number of objects deleted.
+    """
+    prefix = '{0}/{1}/'.format(input_dir.rstrip('/'), VERSIONS_DIR)
+    deleted, errors = delete_keys(
+        bucket, (name for name in list_keys(bucket, prefix)
+                 if name[len(prefix):].split('/')[0] not in keep))
+    if deleted:
+        logging.info("Deleted {0} objects of old versions beneath {1}"
+                     .format(deleted, prefix))
+    return deleted
+
+
+def delete_prefix(bucket, prefix, concurrency=DELETE_CONCURRENCY):
+    """
+    Delete every object in *bucket* whose key starts with *prefix*;
+    see :func:`delete_keys`.
+    """
+    deleted, errors = delete_keys(bucket, list_keys(bucket, prefix),
+                                  concurrency)
+    logging.info("Deleted {0} objects beneath {1}/{2}"
+                 .format(deleted, bucket.name, prefix))
+    return deleted, errors
+
+
+def list_keys(bucket, prefix):
+    """
+    Yield the names of the keys in *bucket* starting with *prefix*,
+    a page at a time.
+    """
+    for page in _pages(bucket, prefix):
+        for key in page:
+            yield key.name
+
+
+def _pages(bucket, prefix):
+    """
+    Yield the pages of a listing of the keys in *bucket* starting with
+    *prefix*.
+
+    Only the listing requests are attributed to the ``'network'`` phase
+    and a ``list_objects`` span, not the caller's work between pages.
+    """
+    marker = ''
+    while True:
+        with profiling.phase('network'):
+            with tracing.span('list_objects'):
+                page = bucket.get_all_keys(prefix=prefix, marker=marker)
+        yield page
+        if not page.is_truncated or not len(page):
+            return
+        marker = page.next_marker or page[-1].name
+
+
+def delete_keys(bucket, key_names, concurrency=DELETE_CONCURRENCY):
+    """
+    Delete *key_names* from *bucket*.
+
+    *key_names* may be any iterable, such as a listing in progress; it is
+    consumed as deletion proceeds, with up to *concurrency* requests of
+    :data:`DELETE_BATCH_SIZE` keys in flight and at most as many batches
+    waiting, so memory use does not grow with the number of keys.
+
+    Returns ``(deleted, errors)``: the number of keys deleted and a list
+    of ``(key_name, message)`` pairs for those that could not be, each
+    of which is also logged.
+    """
+    batches = queue.Queue(concurrency)
+    counts = {'deleted': 0}
+    errors = []
+    lock = threading.Lock()
+    parent = tracing.current_span()
+
+    def work():
+        with tracing.attached(parent):
+            with profiling.worker():
+                while True:
+                    batch = batches.get()
+                    if batch is None:
+                        return
+                    failed = _delete_batch(bucket, batch)
+                    for key_name, message in failed:
+                        logging.error("Could not delete {0} from bucket "
+                                      "'{1}': {2}".format(key_name,
+                                                          bucket.name,
+                                                          message))
+                    with lock:
+                        counts['deleted'] += len(batch) - len(failed)
+                        errors.extend(failed)
+
+    workers = [threading.Thread(target=work) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    try:
+        batch = []
+        for key_name in key_names:
+            batch.append(key_name)
+            if len(batch) == DELETE_BATCH_SIZE:
+                batches.put(batch)
+                batch = []
+        if batch:
+            batches.put(batch)
+    finally:
+        for worker in workers:
+            batches.put(None)
+        for worker in workers:
+            worker.join()
+    return counts['deleted'], errors
+
+
+def _delete_batch(bucket, batch):
+    """
+    Delete *batch* in one request, returning ``(key_name, message)``
+    pairs for the keys that could not be deleted.
+    """
+    try:
+        with profiling.phase('network'):
+            with tracing.span('delete_keys', keys=len(batch)):
+                result = bucket.delete_keys(batch, quiet=True)
+    except Exception as e:
+        logging.exception("Error deleting {0} keys from bucket '{1}'"
+                          .format(len(batch), bucket.name))
+        return [(key_name, str(e)) for key_name in batch]
+    return [(error.key, error.message or error.code)
+            for error in result.errors]
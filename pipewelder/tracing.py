@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Hierarchical timing spans for Pipewelder runs.
+
+Spans are only recorded while at least one exporter is registered
+via :func:`add_exporter`; otherwise :func:`span` is a no-op.
+"""
+
+from __future__ import print_function
+
+import json
+import time
+import uuid
+import functools
+import threading
+import contextlib
+
+_exporters = []
+_local = threading.local()
+
+
+class Span(object):
+    """
+    A named, timed unit of work, optionally nested within a *parent* span.
+    """
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.span_id = uuid.uuid4().hex[:16]
+        if parent is None:
+            self.trace_id = uuid.uuid4().hex
+        else:
+            self.trace_id = parent.trace_id
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def as_dict(self):
+        """
+        Return a JSON-serializable dict describing this span.
+        """
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent and self.parent.span_id,
+            'thread': self.thread,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'attributes': self.attributes,
+        }
+
+
+def add_exporter(exporter):
+    """
+    Register *exporter* to receive spans.
+
+    Exporters provide ``on_start(span)`` and ``on_end(span)`` methods.
+    """
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    """
+    Stop sending spans to *exporter*.
+    """
+    _exporters.remove(exporter)
+
+
+def current_span():
+    """
+    Return the innermost open span in this thread, or ``None``.
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Record the enclosed work as span *name* with the given *attributes*.
+
+    The new span is a child of :func:`current_span`.
+    Yields the :class:`Span`, or ``None`` when tracing is disabled.
+    """
+    if not _exporters:
+        yield None
+        return
+    current = Span(name, current_span(), attributes)
+    for exporter in _exporters:
+        exporter.on_start(current)
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(current)
+    try:
+        yield current
+    except Exception as e:
+        current.attributes['error'] = repr(e)
+        raise
+    finally:
+        current.end = time.time()
+        _local.stack.pop()
+        for exporter in _exporters:
+            exporter.on_end(current)
+
+
+@contextlib.contextmanager
+def attached(parent):
+    """
+    Make *parent* the current span for the enclosed work.
+
+    Use this to keep spans created in worker threads attached to the span
+    that handed them their work.
+    """
+    if parent is None:
+        yield
+        return
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(parent)
+    try:
+        yield
+    finally:
+        _local.stack.pop()
+
+
+def traced(method):
+    """
+    Decorate *method* so each call is recorded as a span.
+
+    The span is named ``<class>.<method>``; if the instance has a
+    ``span_attributes`` dict, it is attached to the span.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not _exporters:
+            return method(self, *args, **kwargs)
+        name = '{0}.{1}'.format(type(self).__name__, method.__name__)
+        attributes = getattr(self, 'span_attributes', {})
+        with span(name, **attributes):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class FileExporter(object):
+    """
+    Write finished spans to *path* as JSON lines; no collector required.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        line = json.dumps(span.as_dict(), sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetryExporter(object):
+    """
+    Forward spans to an OpenTelemetry tracer.
+
+    Requires the ``opentelemetry-api`` package; spans go to whichever
+    tracer provider has been configured globally, unless *tracer* is given.
+    """
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("OpenTelemetry tracing requires the "
+                              "opentelemetry-api package")
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer('pipewelder')
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span):
+        context = None
+        with self._lock:
+            if span.parent is not None:
+                parent = self._spans.get(span.parent.span_id)
+                if parent is not None:
+                    context = self._trace.set_span_in_context(parent)
+        otel_span = self.tracer.start_span(
+            span.name, context=context,
+            start_time=_nanoseconds(span.start))
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span):
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id)
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value)
+        otel_span.end(end_time=_nanoseconds(span.end))
+
+    def close(self):
+        pass
+
+
+def _nanoseconds(seconds):
+    return int(seconds * 1e9)
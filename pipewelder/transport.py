@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay AWS API traffic.
+
+Transports hook into the point where boto connections send HTTP
+requests, so they see every Data Pipeline and S3 call Pipewelder makes.
+A :class:`RecordingTransport` passes requests through and saves each
+interaction, with its timing, to a cassette file; a
+:class:`ReplayTransport` answers requests from a cassette without any
+network access, optionally reproducing the recorded latency.
+"""
+
+from __future__ import print_function
+
+import json
+import time
+import base64
+import hashlib
+import threading
+from io import BytesIO
+from collections import defaultdict
+
+CASSETTE_VERSION = 1
+REPLAY_CREDENTIALS = {
+    'aws_access_key_id': 'PIPEWELDERREPLAY',
+    'aws_secret_access_key': 'pipewelder-replay',
+}
+
+
+class ReplayError(Exception):
+    """
+    Raised when a request has no matching interaction in the cassette.
+    """
+
+
+class Cassette(object):
+    """
+    An ordered collection of recorded request/response interactions.
+    """
+    def __init__(self, interactions=None):
+        self.interactions = list(interactions or [])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != CASSETTE_VERSION:
+            raise ValueError("Unsupported cassette version in '{0}'"
+                             .format(path))
+        return cls(data['interactions'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'version': CASSETTE_VERSION,
+                       'interactions': self.interactions},
+                      f, indent=1, sort_keys=True)
+
+    def summary(self):
+        """
+        Return a dict with per-operation call counts and total latency.
+        """
+        return _summarize(self.interactions)
+
+
+class RecordedResponse(object):
+    """
+    An in-memory stand-in for :class:`httplib.HTTPResponse`.
+    """
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.msg = _Headers(headers)
+        self._body = BytesIO(body)
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._body.read()
+        return self._body.read(amt)
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name, default)
+
+    def getheaders(self):
+        return list(self.msg.items())
+
+    def close(self):
+        pass
+
+
+class RecordingTransport(object):
+    """
+    Pass requests through to AWS, recording each one into a cassette.
+    """
+    def __init__(self):
+        self.cassette = Cassette()
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def install(self, conn):
+        """
+        Route requests made by boto connection *conn* through this transport.
+        """
+        send = conn._mexe
+
+        def _mexe(request, sender=None, override_num_retries=None,
+                  retry_handler=None):
+            started = time.time()
+            response = send(request, sender, override_num_retries,
+                            retry_handler)
+            body = response.read()
+            duration = time.time() - started
+            headers = response.getheaders()
+            interaction = {
+                'request': _request_fields(request),
+                'response': {
+                    'status': response.status,
+                    'reason': response.reason,
+                    'headers': headers,
+                    'body': base64.b64encode(body).decode('ascii'),
+                },
+                'offset': started - self._started,
+                'duration': duration,
+            }
+            with self._lock:
+                self.cassette.interactions.append(interaction)
+            return RecordedResponse(response.status, response.reason,
+                                    headers, body)
+        conn._mexe = _mexe
+        return conn
+
+    def credentials(self):
+        return {}
+
+    def save(self, path):
+        with self._lock:
+            self.cassette.save(path)
+
+    def summary(self):
+        with self._lock:
+            return self.cassette.summary()
+
+
+class ReplayTransport(object):
+    """
+    Answer requests from *cassette* instead of contacting AWS.
+
+    Each response is delayed by its recorded duration divided by *speed*;
+    a *speed* of ``0`` replays without any delay.
+    Requests are matched on host, method, path, API target and body,
+    falling back to the next unused response for the same operation when
+    the body differs (as it does for time-dependent definitions).
+    """
+    def __init__(self, cassette, speed=1.0):
+        self.speed = speed
+        self.replayed = []
+        self._exact = defaultdict(list)
+        self._loose = defaultdict(list)
+        self._lock = threading.Lock()
+        for interaction in cassette.interactions:
+            fields = interaction['request']
+            self._exact[_exact_key(fields)].append(interaction)
+            self._loose[_loose_key(fields)].append(interaction)
+
+    def install(self, conn):
+        """
+        Route requests made by boto connection *conn* through this transport.
+        """
+        def _mexe(request, sender=None, override_num_retries=None,
+                  retry_handler=None):
+            interaction = self._next(_request_fields(request))
+            if self.speed:
+                time.sleep(interaction['duration'] / self.speed)
+            response = interaction['response']
+            return RecordedResponse(response['status'], response['reason'],
+                                    response['headers'],
+                                    base64.b64decode(response['body']))
+        conn._mexe = _mexe
+        return conn
+
+    def credentials(self):
+        """
+        Return dummy credentials, so connections can be made offline.
+        """
+        return dict(REPLAY_CREDENTIALS)
+
+    def summary(self):
+        with self._lock:
+            return _summarize(self.replayed)
+
+    def _next(self, fields):
+        with self._lock:
+            candidates = self._exact.get(_exact_key(fields))
+            if not candidates:
+                candidates = self._loose.get(_loose_key(fields))
+            if not candidates:
+                raise ReplayError("No recorded response for {0} {1}{2} {3}"
+                                  .format(fields['method'], fields['host'],
+                                          fields['path'],
+                                          fields['target'] or ''))
+            interaction = candidates[0]
+            for index in (self._exact[_exact_key(interaction['request'])],
+                          self._loose[_loose_key(interaction['request'])]):
+                index[:] = [i for i in index if i is not interaction]
+            self.replayed.append(interaction)
+            return interaction
+
+
+class _Headers(object):
+    """
+    Case-insensitive, order-preserving view of response headers.
+    """
+    def __init__(self, pairs):
+        self._pairs = [(name, value) for name, value in pairs]
+
+    def items(self):
+        return list(self._pairs)
+
+    def keys(self):
+        return [name for name, value in self._pairs]
+
+    def get(self, name, default=None):
+        for key, value in self._pairs:
+            if key.lower() == name.lower():
+                return value
+        return default
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+
+def _request_fields(request):
+    body = request.body or b''
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return {
+        'host': request.host,
+        'method': request.method,
+        'path': request.path,
+        'target': request.headers.get('X-Amz-Target'),
+        'body_sha1': hashlib.sha1(body).hexdigest(),
+    }
+
+
+def _loose_key(fields):
+    return (fields['host'], fields['method'], fields['path'],
+            fields['target'])
+
+
+def _exact_key(fields):
+    return _loose_key(fields) + (fields['body_sha1'],)
+
+
+def _operation(fields):
+    if fields['target']:
+        return fields['target'].split('.')[-1]
+    return 'S3 ' + fields['method']
+
+
+def _summarize(interactions):
+    calls = defaultdict(int)
+    seconds = defaultdict(float)
+    for interaction in interactions:
+        operation = _operation(interaction['request'])
+        calls[operation] += 1
+        seconds[operation] += interaction['duration']
+    return {
+        'calls': dict(calls),
+        'seconds': dict(seconds),
+        'total_calls': sum(calls.values()),
+        'total_seconds': sum(seconds.values()),
+    }
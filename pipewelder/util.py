@@ -1,6 +1,12 @@
 import os
+import time
 import contextlib
 import json
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pipewelder import profiling, tracing
 
 
 @contextlib.contextmanager
@@ -22,3 +28,112 @@ def load_json(filename):
             raise ValueError("Unable to parse '{0}' as json; {1}"
                              .format(filename, e))
     return data
+
+
+def total_seconds(delta):
+    """
+    Return the number of seconds in timedelta *delta*, like
+    ``timedelta.total_seconds``, which Python 2.6 lacks.
+    """
+    return (delta.days * 24 * 60 * 60 + delta.seconds +
+            delta.microseconds / 1e6)
+
+
+def walk_files(dirpath):
+    """
+    Return sorted paths, relative to *dirpath*, of all files beneath it.
+    """
+    paths = []
+    for root, dirs, files in os.walk(dirpath):
+        for f in files:
+            paths.append(os.path.relpath(os.path.join(root, f), dirpath))
+    return sorted(paths)
+
+
+def parallel_map(func, items, concurrency=1):
+    """
+    Return ``[func(item) for item in items]``, running up to
+    *concurrency* calls at once in a thread pool.
+
+    Worker threads inherit the caller's tracing span and are profiled
+    by the active profiler.
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    parent = tracing.current_span()
+
+    def call(item):
+        with tracing.attached(parent):
+            with profiling.worker():
+                return func(item)
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(call, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Background(object):
+    """
+    Work run in threads alongside the caller, such as cleanup that
+    nothing else waits on. Call :meth:`join` before exiting to let it
+    finish.
+
+    Threads inherit the caller's tracing span and are profiled by the
+    active profiler; exceptions are logged.
+    """
+    def __init__(self):
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        parent = tracing.current_span()
+
+        def run():
+            with tracing.attached(parent):
+                with profiling.worker():
+                    try:
+                        func(*args)
+                    except Exception:
+                        logging.exception("Error in background task")
+        thread = threading.Thread(target=run)
+        with self._lock:
+            self._threads.append(thread)
+        thread.start()
+
+    def join(self):
+        """
+        Wait for all submitted work to finish.
+        """
+        while True:
+            with self._lock:
+                if not self._threads:
+                    return
+                thread = self._threads.pop()
+            thread.join()
+
+
+class RateLimiter(object):
+    """
+    Spaces calls from any number of threads to at most *rate* per
+    second, allowing bursts of up to *burst* calls.
+    """
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the caller may make its next call.
+        """
+        with self._lock:
+            now = time.time()
+            slot = max(now - (self.burst - 1) * self.interval,
+                       self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Redeploy pipelines as the files defining them change.
+
+An observer reports changed paths beneath a directory, using inotify
+where the platform provides it and polling modification times otherwise.
+A :class:`Watcher` maps bursts of changes onto the pipelines they
+affect and re-validates, re-uploads and re-activates only those,
+keeping its :class:`~pipewelder.core.Pipewelder` objects (and their
+connections and pipeline indexes) alive between bursts.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+
+from pipewelder import sharding, util, tracing
+from pipewelder.changes import affected
+
+IGNORED_PREFIXES = ('.', '#')
+IGNORED_SUFFIXES = ('~', '.swp', '.swx', '.tmp')
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                 IN_MOVED_TO | IN_CREATE | IN_DELETE)
+_EVENT = struct.Struct('iIII')
+
+
+def observer(root, interval=1.0, polling=False):
+    """
+    Return an observer of changes beneath *root*.
+
+    Uses inotify unless *polling* is set or inotify is unavailable,
+    in which case the tree is scanned every *interval* seconds.
+    """
+    if not polling:
+        try:
+            return InotifyObserver(root)
+        except (OSError, AttributeError) as e:
+            logging.info("inotify unavailable (%s); polling for changes", e)
+    return PollingObserver(root, interval)
+
+
+class PollingObserver(object):
+    """
+    Detect changes beneath *root* by comparing file modification times
+    and sizes between scans.
+    """
+    def __init__(self, root, interval=1.0):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def poll(self, timeout=None):
+        """
+        Wait up to *timeout* seconds, then return the set of absolute
+        paths that were created, modified or deleted since the last poll.
+        """
+        if timeout is None:
+            timeout = self.interval
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        paths = set(snapshot) | set(self._snapshot)
+        changed = set(path for path in paths
+                      if snapshot.get(path) != self._snapshot.get(path))
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        snapshot = {}
+        for dirpath, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not _ignored(d)]
+            for f in files:
+                path = os.path.join(dirpath, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+
+class InotifyObserver(object):
+    """
+    Detect changes beneath *root* with Linux inotify.
+
+    Raises :class:`OSError` or :class:`AttributeError` where inotify
+    is not available.
+    """
+    def __init__(self, root):
+        import ctypes
+        import ctypes.util
+        self.root = os.path.abspath(root)
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self._dirs = {}
+        for dirpath in _walk_dirs(self.root):
+            self._add_watch(dirpath)
+
+    def poll(self, timeout=None):
+        """
+        Wait up to *timeout* seconds for events, then return the set of
+        absolute paths that were created, modified or deleted.
+        """
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not readable:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("Missed inotify events; "
+                                "treating everything as changed")
+                changed.add(self.root)
+                continue
+            dirpath = self._dirs.get(wd)
+            if dirpath is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._dirs[wd]
+                continue
+            path = os.path.join(dirpath,
+                                name.decode(sys.getfilesystemencoding()))
+            changed.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # watch the new directory and report what it already holds
+                for subdir in _walk_dirs(path):
+                    self._add_watch(subdir)
+                    changed.update(os.path.join(subdir, f)
+                                   for f in _list_files(subdir))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _add_watch(self, dirpath):
+        encoded = dirpath.encode(sys.getfilesystemencoding())
+        wd = self._libc.inotify_add_watch(self._fd, encoded, IN_WATCH_MASK)
+        if wd < 0:
+            logging.warning("Unable to watch %s: %s", dirpath,
+                            os.strerror(self._ctypes.get_errno()))
+            return
+        self._dirs[wd] = dirpath
+
+
+class Watcher(object):
+    """
+    Keep pipelines deployed as their files change.
+
+    *load_configs* returns a dict of configurations as produced by
+    :func:`pipewelder.cli.pipewelder_configs`, and *build* turns one
+    configuration into a :class:`~pipewelder.core.Pipewelder`
+    (or ``None`` if it cannot be loaded).
+    Changes reported by *observer* are acted on once it has been quiet
+    for *debounce* seconds.
+    """
+    def __init__(self, load_configs, build, observer, debounce=0.5,
+                 config_path='pipewelder.json'):
+        self.load_configs = load_configs
+        self.build = build
+        self.observer = observer
+        self.debounce = debounce
+        self.config_path = os.path.abspath(config_path)
+        self.configs = {}
+        self.welders = {}
+
+    def start(self):
+        """
+        Load every configuration without deploying anything.
+        """
+        for name, config in sorted(self.load_configs().items()):
+            self.configs[name] = config
+            self.welders[name] = self.build(config)
+
+    def run(self, stop=None):
+        """
+        Act on changes until *stop* (a :class:`threading.Event`) is set.
+        """
+        if not self.welders:
+            self.start()
+        pending = set()
+        while stop is None or not stop.is_set():
+            changed = self.observer.poll(self.debounce)
+            if changed:
+                pending.update(changed)
+            elif pending:
+                self.handle(pending)
+                pending = set()
+
+    def handle(self, paths):
+        """
+        Redeploy the pipelines affected by changes to *paths*.
+
+        Returns a list of ``(group, pipeline name, succeeded)`` tuples.
+        """
+        paths = set(path for path in paths if not _ignored_path(path))
+        if not paths:
+            return []
+        with tracing.span('pipewelder.watch', paths=len(paths)):
+            results = []
+            done = set()
+            if self._needs_sync(paths):
+                results.extend(self.sync(done))
+            for name, pw in sorted(self.welders.items()):
+                if pw is None:
+                    continue
+                if affected(paths, [os.path.abspath(pw.template_path)]):
+                    logging.info("Template %s changed; redeploying all "
+                                 "pipelines in '%s'", pw.template_path, name)
+                    pw.load_template()
+                    dirpaths = [p.dirpath for p in pw.pipelines.values()]
+                else:
+                    dirs = dict((os.path.abspath(p.dirpath), p.dirpath)
+                                for p in pw.pipelines.values())
+                    dirpaths = [dirs[d] for d in affected(paths, dirs)]
+                dirpaths = [d for d in dirpaths if (name, d) not in done]
+                done.update((name, d) for d in dirpaths)
+                results.extend(self._redeploy(name, pw, dirpaths))
+            return results
+
+    def sync(self, done=None):
+        """
+        Reconcile loaded pipelines with the current configuration.
+
+        Groups whose settings changed are rebuilt and redeployed in full;
+        pipeline directories that appeared are deployed and those that
+        disappeared are forgotten (but not deleted from AWS). A warning
+        names the previous target of pipelines that moved to another
+        region or credential profile, such as between shards, since their
+        old copies keep running there.
+        """
+        done = set() if done is None else done
+        results = []
+        configs = self.load_configs()
+        # configurations each pipeline directory was dropped from or
+        # added to, to spot pipelines moving between targets
+        dropped = {}
+        gained = {}
+        for name in sorted(set(self.configs) - set(configs)):
+            logging.info("Group '%s' was removed; no longer watching it", name)
+            for dirpath in self.configs[name]['dirs']:
+                dropped[os.path.normpath(dirpath)] = self.configs[name]
+            del self.configs[name]
+            del self.welders[name]
+        for name, config in sorted(configs.items()):
+            old = self.configs.get(name)
+            pw = self.welders.get(name)
+            if pw is None or old is None or \
+                    _settings(old) != _settings(config):
+                if old is not None:
+                    for dirpath in old['dirs']:
+                        dropped[os.path.normpath(dirpath)] = old
+                for dirpath in config['dirs']:
+                    gained[os.path.normpath(dirpath)] = config
+                pw = self.build(config)
+                self.configs[name] = config
+                self.welders[name] = pw
+                if pw is not None:
+                    dirpaths = [p.dirpath for p in pw.pipelines.values()]
+                    done.update((name, d) for d in dirpaths)
+                    results.extend(self._redeploy(name, pw, dirpaths,
+                                                  reload=False))
+            else:
+                added = set(config['dirs']) - set(old['dirs'])
+                for dirpath in set(old['dirs']) - set(config['dirs']):
+                    logging.info("Pipeline directory %s was removed; "
+                                 "it is left as is in AWS", dirpath)
+                    dropped[os.path.normpath(dirpath)] = old
+                    pw.remove_pipeline(dirpath)
+                self.configs[name] = config
+                dirpaths = [os.path.normpath(d) for d in added]
+                gained.update((d, config) for d in dirpaths)
+                done.update((name, d) for d in dirpaths)
+                results.extend(self._redeploy(name, pw, dirpaths))
+        for dirpath, old in sorted(dropped.items()):
+            new = gained.get(dirpath)
+            if new is None or _target(new) == _target(old):
+                continue
+            logging.warning("Pipeline directory %s moved from '%s' to '%s'; "
+                            "its old copy is still deployed in %s and should "
+                            "be deleted there", dirpath, old['name'],
+                            new['name'], sharding.describe_target(old))
+        return results
+
+    def _needs_sync(self, paths):
+        if self.config_path in paths:
+            return True
+        known = set(os.path.abspath(d) for config in self.configs.values()
+                    for d in config['dirs'])
+        for path in paths:
+            if os.path.basename(path) != 'values.json':
+                continue
+            dirpath = os.path.dirname(path)
+            if (dirpath in known) != os.path.exists(path):
+                return True
+        return False
+
+    def _redeploy(self, name, pw, dirpaths, reload=True):
+        if pw is None or not dirpaths:
+            return []
+
+        def redeploy(dirpath):
+            try:
+                if reload:
+                    pipeline = pw.add_pipeline(dirpath)
+                else:
+                    pipeline = [p for p in pw.pipelines.values()
+                                if p.dirpath == dirpath][0]
+                ok = deploy(pw.unit_of(pipeline))
+                pipeline_name = pipeline.name
+            except Exception:
+                logging.exception("Error redeploying %s", dirpath)
+                ok = False
+                pipeline_name = os.path.basename(dirpath)
+            print("{0} '{1}' in group '{2}'".format(
+                ok and "Redeployed" or "FAILED to redeploy",
+                pipeline_name, name))
+            return (name, pipeline_name, ok)
+        return util.parallel_map(redeploy, sorted(dirpaths), pw.concurrency)
+
+
+def deploy(pipeline):
+    """
+    Validate, upload and activate *pipeline*, stopping at the first failure.
+    """
+    return pipeline.is_valid() and pipeline.upload() and pipeline.activate()
+
+
+def _target(config):
+    return (config['region'], config['profile'])
+
+
+def _settings(config):
+    return (config['region'], config['profile'], config['template'],
+            config['values'], config['stagger'], config['packing'],
+            config['upload'], config['blob_store'], config['versioned'])
+
+
+def _ignored(name):
+    return name.startswith(IGNORED_PREFIXES) or name.endswith(IGNORED_SUFFIXES)
+
+
+def _ignored_path(path):
+    return _ignored(os.path.basename(path))
+
+
+def _walk_dirs(root):
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not _ignored(d)]
+        yield dirpath
+
+
+def _list_files(dirpath):
+    try:
+        return [f for f in os.listdir(dirpath)
+                if os.path.isfile(os.path.join(dirpath, f))]
+    except OSError:
+        return []
@@ -38,6 +38,7 @@ sys.path.append('.')
 CODE_DIRECTORY = 'pipewelder'
 DOCS_DIRECTORY = 'docs'
 TESTS_DIRECTORY = 'tests'
+BENCHMARKS_DIRECTORY = 'benchmarks'
 PYTEST_FLAGS = ['--doctest-modules']
 
 # Import metadata. Normally this would just be:
@@ -253,7 +254,8 @@ setup_dict = dict(
         'Programming Language :: Python :: 3.4',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
-    packages=find_packages(exclude=(TESTS_DIRECTORY,)),
+    packages=find_packages(
+        exclude=(TESTS_DIRECTORY, BENCHMARKS_DIRECTORY)),
     install_requires=[
         'boto',
         'six'
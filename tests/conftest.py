@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests of commands that look at deployed pipelines.
+"""
+import os
+import json
+from collections import namedtuple
+
+import py
+import pytest
+
+from pipewelder import Pipewelder, cli
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+FakeAWS = namedtuple('FakeAWS', ['backend', 'conn', 's3_conn'])
+
+
+@pytest.fixture
+def fake_aws(monkeypatch):
+    """
+    Fake Data Pipeline and S3 connections, which the CLI uses for every
+    configuration.
+    """
+    backend = FakeBackend()
+    aws = FakeAWS(backend, FakeDataPipelineConnection(backend),
+                  FakeS3Connection(backend))
+    monkeypatch.setattr(cli, 'connect', lambda config, api_transport=None:
+                        (aws.conn, aws.s3_conn))
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    return aws
+
+
+@pytest.fixture
+def make_pipeline(fake_aws):
+    """
+    A function returning the example pipeline, or the one in *dirpath*,
+    loaded with the fake connections and any further *values*.
+    """
+    def make(dirpath=None, **values):
+        pw = Pipewelder(fake_aws.conn,
+                        os.path.join(DATA_DIR, 'pipeline_definition.json'),
+                        fake_aws.s3_conn, values={'myEnv': 'dev'})
+        pipeline = pw.add_pipeline(dirpath or os.path.join(DATA_DIR,
+                                                           'echoer'))
+        pipeline.values.update(values)
+        return pipeline
+    return make
+
+
+@pytest.fixture
+def project(tmpdir):
+    """
+    A directory holding the example pipeline and a pipewelder.json
+    configuring it as group ``dev``.
+    """
+    tmpdir.join('pipewelder.json').write(json.dumps(
+        {'dev': {'dirs': ['echoer'], 'values': {'myEnv': 'dev'}}}))
+    for name in ['pipeline_definition.json', 'echoer']:
+        py.path.local(os.path.join(DATA_DIR, name)).copy(tmpdir.join(name))
+    return tmpdir
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import pytest
+from boto.exception import JSONResponseError
+
+from pipewelder import core, util
+from benchmarks.fake_aws import FakeBackend, FakeDataPipelineConnection
+from benchmarks.suite import run_suite, CYCLE_ACTIONS
+
+
+def test_run_suite(tmpdir):
+    report = run_suite([6], cycle_max_size=6, workdir=str(tmpdir))
+    results = dict((r['benchmark'], r) for r in report['results'])
+    assert results['pipeline_construction']['size'] == 6
+    for action in CYCLE_ACTIONS:
+        assert results[action]['ok']
+    assert results['activate']['calls']['activate_pipeline'] == 6
+    assert not tmpdir.listdir()
+
+
+def test_fake_throttling(monkeypatch):
+    monkeypatch.setattr(core, 'API_BACKOFF_SECONDS', 0.01)
+    backend = FakeBackend(rate_limit=100)
+    conn = FakeDataPipelineConnection(backend)
+    with pytest.raises(JSONResponseError) as e:
+        conn.list_pipelines()
+        conn.list_pipelines()
+    assert e.value.error_code == 'ThrottlingException'
+    assert backend.throttled == 1
+
+    # requests through the API are retried with backoff
+    results = util.parallel_map(
+        lambda i: core.api_request(conn, 'list_pipelines'), range(20), 4)
+    assert len(results) == 20
+    assert backend.calls['list_pipelines'] > 22
+    assert backend.throttled == backend.calls['list_pipelines'] - 21
+
+    monkeypatch.setattr(core, 'API_MAX_RETRIES', 0)
+    with pytest.raises(JSONResponseError):
+        for i in range(5):
+            core.api_request(conn, 'list_pipelines')
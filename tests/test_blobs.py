@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import subprocess
+
+import py
+from pytest import raises
+
+from pipewelder import Pipewelder, blobs
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+STORE = 's3://pipewelder-blobs/store'
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def make_pipewelder(tmpdir, s3_conn, names):
+    backend = s3_conn.backend
+    pw = Pipewelder(FakeDataPipelineConnection(backend),
+                    data_path('pipeline_definition.json'),
+                    s3_conn, values={'myEnv': 'dev'},
+                    upload_mode='blobs', blob_store=STORE)
+    for name in names:
+        copy = tmpdir.join(name)
+        py.path.local(data_path('echoer')).copy(copy, mode=True)
+        values = json.loads(copy.join('values.json').read())
+        values['values']['myName'] = name
+        values['values']['myS3InputDir'] = 's3://pipewelder-example/' + name
+        copy.join('values.json').write(json.dumps(values))
+        pw.add_pipeline(str(copy))
+    return pw
+
+
+def test_shared_files_upload_once(tmpdir):
+    backend = FakeBackend()
+    s3_conn = FakeS3Connection(backend)
+    pw = make_pipewelder(tmpdir, s3_conn, ['a', 'b', 'c'])
+    pw.concurrency = 3
+    assert pw.upload()
+    store = pw.s3_conn.get_bucket('pipewelder-blobs').contents
+    # run and both tasks are shared; each values.json is distinct
+    assert len(store) == 3 + 3
+    inputs = pw.s3_conn.get_bucket('pipewelder-example').contents
+    assert sorted(inputs) == [
+        name + '/' + filename for name in 'abc'
+        for filename in ['.pipewelder-manifest.json',
+                         'pipewelder-blobs.txt', 'run']]
+    puts = backend.calls['s3.put_object']
+    assert make_pipewelder(tmpdir, s3_conn, ['a', 'd']).upload()
+    assert backend.calls['s3.put_object'] == puts + 4
+
+    # the wrapper fetches blobs with the AWS CLI and runs the pipeline
+    staging = tmpdir.join('staging').ensure(dir=True)
+    output = tmpdir.join('output').ensure(dir=True)
+    blob_dir = tmpdir.join('blobs').ensure(dir=True)
+    for name, data in store.items():
+        blob_dir.join(os.path.basename(name)).write_binary(data)
+    for name in ['a/pipewelder-blobs.txt', 'a/run']:
+        staging.join(os.path.basename(name)).write_binary(inputs[name])
+    aws = tmpdir.join('bin', 'aws')
+    aws.write('#!/bin/sh\ncp "{0}/$(basename "$4")" "$5"\n'.format(blob_dir),
+              ensure=True)
+    aws.chmod(0o755)
+    env = dict(os.environ, OUTPUT1_STAGING_DIR=str(output),
+               PATH=str(aws.dirpath()) + os.pathsep + os.environ['PATH'])
+    subprocess.check_call(['sh', str(staging.join('run'))], env=env)
+    assert sorted(f.basename for f in output.listdir()) == \
+        ['first.txt', 'second.txt']
+
+
+def test_blob_store_required():
+    with raises(ValueError):
+        Pipewelder(None, data_path('pipeline_definition.json'),
+                   upload_mode='blobs')
+    with raises(ValueError):
+        Pipewelder(None, data_path('pipeline_definition.json'),
+                   blob_store=STORE)
+
+
+def test_file_digest():
+    assert blobs.file_digest(data_path('echoer/tasks/second.txt')) == \
+        hashlib.sha256(
+            py.path.local(data_path('echoer/tasks/second.txt'))
+            .read_binary()).hexdigest()
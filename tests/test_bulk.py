@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from boto.exception import JSONResponseError
+
+from pipewelder import cli, bulk, core, instances, util
+from benchmarks.fake_aws import FakeBackend, FakeDataPipelineConnection
+
+
+def add_runs(conn, pipeline, statuses):
+    """
+    Add a run of *pipeline* with each of *statuses*, an hour apart and
+    the last an hour ago.
+    """
+    for i, status in enumerate(statuses):
+        scheduled = datetime.utcnow() - timedelta(hours=i + 1)
+        conn.add_run(pipeline.create(), 'run{0:04d}'.format(i), scheduled,
+                     status)
+
+
+def statuses(pipeline):
+    runs = instances.runs(pipeline, datetime.utcnow() - timedelta(days=30))
+    return [run.status for run in runs]
+
+
+def test_rerun_failed(fake_aws, make_pipeline, monkeypatch):
+    monkeypatch.setattr(bulk, 'BATCH_SIZE', 3)
+    backend, conn = fake_aws.backend, fake_aws.conn
+    pipeline = make_pipeline()
+    add_runs(conn, pipeline, ['FAILED', 'FINISHED'] * 4 + ['TIMEDOUT'] * 4)
+    since = datetime.utcnow() - timedelta(hours=9, minutes=30)
+
+    preview = bulk.apply(pipeline, bulk.RERUN, since, failed=True,
+                         dry_run=True)
+    assert len(preview['runs']) == 5
+    assert backend.calls['set_status'] == 0
+
+    result = bulk.apply(pipeline, bulk.RERUN, since, failed=True,
+                        concurrency=2)
+    assert result['errors'] == []
+    assert backend.calls['set_status'] == 2
+    assert statuses(pipeline) == ['WAITING_ON_DEPENDENCIES', 'FINISHED'] * 4 \
+        + ['WAITING_ON_DEPENDENCIES', 'TIMEDOUT', 'TIMEDOUT', 'TIMEDOUT']
+
+
+def test_cancel(fake_aws, make_pipeline):
+    conn = fake_aws.conn
+    pipeline = make_pipeline()
+    add_runs(conn, pipeline, ['RUNNING', 'WAITING_FOR_RUNNER', 'FINISHED'])
+    result = bulk.apply(pipeline, bulk.CANCEL,
+                        datetime.utcnow() - timedelta(days=1))
+    assert [run['id'] for run in result['runs']] == ['run0000', 'run0001']
+    assert statuses(pipeline) == ['CANCELED', 'CANCELED', 'FINISHED']
+
+
+def test_set_status_retries(monkeypatch):
+    monkeypatch.setattr(core, 'API_BACKOFF_SECONDS', 0.01)
+    # the service allows 20 calls a second, one at a time
+    backend = FakeBackend(rate_limit=20)
+    conn = FakeDataPipelineConnection(backend)
+    pipeline_id = conn.create_pipeline('echoer', 'echoer')['pipelineId']
+    ids = ['run{0:04d}'.format(i) for i in range(100)]
+    for run_id in ids:
+        conn.add_run(pipeline_id, run_id, datetime.utcnow(), 'FAILED')
+    # four batches sent at once are throttled, then retried with backoff
+    assert bulk.set_status(conn, pipeline_id, ids, bulk.RERUN,
+                           concurrency=4) == []
+    assert backend.throttled > 0
+    assert backend.calls['set_status'] == 4 + backend.throttled
+
+    def denied(object_ids, status, pipeline_id):
+        raise JSONResponseError(400, 'Bad Request',
+                                {'__type': 'InvalidRequestException'})
+    monkeypatch.setattr(conn, 'set_status', denied)
+    assert bulk.set_status(conn, pipeline_id, ['run0000'], bulk.RERUN) == \
+        ['run0000']
+
+
+def test_rate_limiter():
+    limiter = util.RateLimiter(50, burst=2)
+    start = time.time()
+    for i in range(6):
+        limiter.wait()
+    # the first two calls go at once, the rest 20ms apart
+    assert 0.07 < time.time() - start < 0.5
+
+
+def test_rerun_command(fake_aws, make_pipeline, project, capsys):
+    with project.as_cwd():
+        # pipelines that are not deployed are left alone
+        assert cli.main(['progname', 'cancel']) == 0
+        out, err = capsys.readouterr()
+        assert 'Set TRY_CANCEL on 0 runs of echoer' in out
+        assert fake_aws.conn.pipelines == {}
+
+        pipeline = make_pipeline()
+        add_runs(fake_aws.conn, pipeline, ['FAILED', 'FINISHED', 'FAILED'])
+        assert cli.main(['progname', 'rerun', '--failed', '--since',
+                         '150 minutes', '--dry-run']) == 0
+        out, err = capsys.readouterr()
+        assert 'Would set RERUN on 1 runs of echoer' in out
+        assert statuses(pipeline) == ['FAILED', 'FINISHED', 'FAILED']
+
+        assert cli.main(['progname', 'rerun', '--failed', '--format',
+                         'json']) == 0
+        out, err = capsys.readouterr()
+        results = json.loads(out[out.index('['):])
+        assert [(r['group'], r['name'], len(r['runs'])) for r in results] \
+            == [('dev', 'echoer', 2)]
+        assert statuses(pipeline) == \
+            ['WAITING_ON_DEPENDENCIES', 'FINISHED', 'WAITING_ON_DEPENDENCIES']
+
+        assert cli.main(['progname', 'cancel', '--since',
+                         '2015-01-01T00:00:00']) == 0
+        out, err = capsys.readouterr()
+        assert 'Set TRY_CANCEL on 2 runs of echoer' in out
+        assert statuses(pipeline) == ['CANCELED', 'FINISHED', 'CANCELED']
+
+
+@pytest.mark.parametrize('argv', [
+    ['rerun'],
+    ['rerun', '--failed', '--all'],
+    ['cancel', '--failed'],
+])
+def test_run_selection_required(argv, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        cli.main(['progname'] + argv)
+    assert exc_info.value.code == 2
+    out, err = capsys.readouterr()
+    assert '--failed' in err
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import io
+import tarfile
+import subprocess
+
+import py
+
+from pipewelder import Pipewelder, bundle, hashing
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+INPUT_DIR = 'dev/echoer/inputs'
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def test_build_is_deterministic(tmpdir):
+    copy = tmpdir.join('echoer')
+    py.path.local(data_path('echoer')).copy(copy, mode=True)
+    copy.join('tasks', 'first.txt').setmtime(0)
+    original = tmpdir.join('original.tar.gz')
+    built = tmpdir.join('copy.tar.gz')
+    bundle.build(data_path('echoer'), str(original))
+    bundle.build(str(copy), str(built))
+    assert built.read_binary() == original.read_binary()
+    with tarfile.open(str(built)) as tar:
+        assert tar.getnames() == ['run', 'tasks/first.txt',
+                                  'tasks/second.txt', 'values.json']
+        assert tar.getmember('run').mode == 0o755
+    copy.join('tasks', 'first.txt').write('changed')
+    bundle.build(str(copy), str(built))
+    assert built.read_binary() != original.read_binary()
+
+
+def test_upload_bundle(tmpdir):
+    backend = FakeBackend()
+    pw = Pipewelder(FakeDataPipelineConnection(backend),
+                    data_path('pipeline_definition.json'),
+                    FakeS3Connection(backend), values={'myEnv': 'dev'},
+                    upload_mode='bundle')
+    pw.add_pipeline(data_path('echoer'))
+    bucket = pw.s3_conn.get_bucket('pipewelder-example')
+    bucket.new_key(INPUT_DIR + '/tasks/old.txt').set_contents_from_string('')
+    assert pw.upload()
+    assert backend.calls['s3.put_object'] == 4
+    names = sorted(bucket.contents)
+    assert len(names) == 3
+    assert names[0] == INPUT_DIR + '/.pipewelder-manifest.json'
+    assert names[1].startswith(INPUT_DIR + '/pipewelder-bundle-')
+    assert names[2] == INPUT_DIR + '/run'
+
+    # unchanged bundles are not uploaded again
+    assert pw.upload()
+    assert backend.calls['s3.put_object'] == 4
+
+    # the wrapper unpacks the bundle and runs the pipeline
+    staging = tmpdir.join('staging').ensure(dir=True)
+    output = tmpdir.join('output').ensure(dir=True)
+    for name in names:
+        staging.join(os.path.basename(name)).write_binary(
+            bucket.contents[name])
+    env = dict(os.environ, OUTPUT1_STAGING_DIR=str(output))
+    subprocess.check_call(['sh', str(staging.join('run'))], env=env)
+    assert sorted(f.basename for f in output.listdir()) == \
+        ['first.txt', 'second.txt']
+
+
+def test_upload_large_bundle(monkeypatch):
+    monkeypatch.setattr(hashing, 'MULTIPART_THRESHOLD', 256)
+    monkeypatch.setattr(hashing, 'PART_SIZE', 256)
+    backend = FakeBackend()
+    bucket = FakeS3Connection(backend).get_bucket('pipewelder-example')
+    assert bundle.upload(bucket, INPUT_DIR, data_path('echoer'))
+    assert backend.calls['s3.upload_part'] >= 2
+    names = sorted(bucket.contents)
+    assert names[1].startswith(INPUT_DIR + '/pipewelder-bundle-')
+    with tarfile.open(fileobj=io.BytesIO(bucket.contents[names[1]])) as tar:
+        assert 'values.json' in tar.getnames()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+
+import pytest
+from pytest import raises
+
+from pipewelder.changes import changed_paths, affected_dirs, affected
+
+
+def git(root, *args):
+    subprocess.check_call(['git', '-c', 'user.name=test',
+                           '-c', 'user.email=test@example.com'] +
+                          list(args), cwd=root, stdout=subprocess.PIPE)
+
+
+@pytest.fixture
+def repo(tmpdir):
+    root = str(tmpdir)
+    for path in ['pipewelder.json', 'pipeline_definition.json',
+                 'first/values.json', 'first/tasks/a.sql',
+                 'second/values.json', '.gitignore']:
+        tmpdir.join(path).write('{}', ensure=True)
+    tmpdir.join('.gitignore').write('*.log\n')
+    git(root, 'init', '-q')
+    git(root, 'add', '.')
+    git(root, 'commit', '-q', '-m', 'initial')
+    with tmpdir.as_cwd():
+        yield root
+
+
+CONFIG = {"dirs": ["first", "second"],
+          "template": "pipeline_definition.json"}
+
+
+def test_unchanged(repo):
+    assert changed_paths('HEAD') == set()
+    assert affected_dirs(CONFIG, changed_paths('HEAD'),
+                         'pipewelder.json') == []
+
+
+def test_changed_pipeline(repo):
+    with open(os.path.join('first', 'tasks', 'a.sql'), 'w') as f:
+        f.write('select 1;')
+    with open(os.path.join('first', 'ignored.log'), 'w') as f:
+        f.write('ignored')
+    with open(os.path.join('second', 'new.sql'), 'w') as f:
+        f.write('untracked')
+    paths = changed_paths('HEAD')
+    assert paths == set([os.path.join(repo, 'first', 'tasks', 'a.sql'),
+                         os.path.join(repo, 'second', 'new.sql')])
+    os.remove(os.path.join('second', 'new.sql'))
+    assert affected_dirs(CONFIG, changed_paths('HEAD')) == ['first']
+
+
+@pytest.mark.parametrize('shared', ['pipeline_definition.json',
+                                    'pipewelder.json'])
+def test_shared_file_fans_out(repo, shared):
+    git(repo, 'rm', '-q', shared)
+    git(repo, 'commit', '-q', '-m', 'remove')
+    paths = changed_paths('HEAD~1')
+    assert affected_dirs(CONFIG, paths, 'pipewelder.json') == \
+        ['first', 'second']
+
+
+def test_unknown_ref(repo):
+    with raises(ValueError) as exc_info:
+        changed_paths('no-such-ref')
+    assert 'no-such-ref' in str(exc_info.value)
+
+
+def test_affected():
+    targets = ['/fleet/a', '/fleet/ab', '/fleet/b']
+    assert affected(['/fleet/a/tasks/x.sql'], targets) == ['/fleet/a']
+    assert affected(['/fleet'], targets) == targets
+    assert affected(['/fleet/c'], targets) == []
@@ -9,8 +9,15 @@ import pytest
 parametrize = pytest.mark.parametrize  # NOPEP8
 
 import os
+import json
+import pstats
 
+import py
+
+from pipewelder import cli
 from pipewelder.cli import pipewelder_configs, main, metadata
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -27,12 +34,19 @@ def test_pipewelder_configs():
     configs = pipewelder_configs(data_path('pipewelder.json'))
     assert configs["dev"] == {
         "name": "dev",
+        "group": "dev",
         "dirs": ["echoer"],
         "region": "us-west-2",
+        "profile": None,
         "template": "pipeline_definition.json",
         "values": {
             "myEnv": "dev"
-        }
+        },
+        "stagger": None,
+        "packing": None,
+        "upload": "files",
+        "blob_store": None,
+        "versioned": False,
     }
 
 
@@ -61,3 +75,96 @@ class TestMain(object):
         assert (out == expected or err == expected)
         # Should exit with zero return code.
         assert exc_info.value.code == 0
+
+    def test_unknown_action(self, capsys):
+        with raises(SystemExit) as exc_info:
+            main(['progname', 'validate', 'bogus'])
+        out, err = capsys.readouterr()
+        assert "Unknown action 'bogus'" in err
+        assert exc_info.value.code == 2
+
+    @parametrize('argv', [
+        ['schedule', '--horizon', 'next week'],
+        ['status', '--window', 'a while'],
+        ['durations', '--window', 'a while'],
+        ['rightsize', '--window', 'a while'],
+    ])
+    def test_invalid_period(self, argv, capsys):
+        with raises(SystemExit) as exc_info:
+            main(['progname'] + argv)
+        out, err = capsys.readouterr()
+        assert "cannot be parsed as a period" in err
+        assert exc_info.value.code == 2
+
+
+def write_config(tmpdir, config):
+    tmpdir.join('pipewelder.json').write(json.dumps(config))
+    for name in ['pipeline_definition.json', 'echoer']:
+        source = py.path.local(data_path(name))
+        source.copy(tmpdir.join(name))
+
+
+@parametrize('keep_going', [True, False])
+def test_group_failure(tmpdir, fake_aws, capsys, keep_going):
+    write_config(tmpdir, {
+        "good": {"dirs": ["echoer"], "region": "us-west-2"},
+        "bad": {"dirs": ["echoer"], "region": "us-east-1",
+                "template": "missing.json"},
+    })
+    argv = ['progname', 'validate', 'upload']
+    if keep_going:
+        argv.append('--keep-going')
+    with tmpdir.as_cwd():
+        assert main(argv) == 1
+    out, err = capsys.readouterr()
+    assert "bad                  us-east-1        0 pipelines" in out
+    assert "FAILED at 'load'" in out
+    if keep_going:
+        assert "completed: validate upload" in out
+
+
+def test_profile_concurrent_run(project, fake_aws, capsys):
+    project.join('echoer').copy(project.join('other'))
+    values = project.join('other', 'values.json')
+    values.write(values.read().replace('"echoer"', '"other"'))
+    project.join('pipewelder.json').write(json.dumps(
+        {'dev': {'dirs': ['echoer', 'other'], 'values': {'myEnv': 'dev'}}}))
+    prefix = str(project.join('profile'))
+    with project.as_cwd():
+        assert main(['progname', 'validate', '--profile',
+                     '--profile-output', prefix, '--concurrency', '4']) == 0
+    stats = pstats.Stats(prefix + '.pstats').stats
+    calls = [stat[1] for (_, _, name), stat in stats.items()
+             if name == 'is_valid']
+    assert calls == [2]
+
+
+def test_activate_warns_of_stale_shards(project, monkeypatch, caplog):
+    backend = FakeBackend()
+    regions = {}
+
+    def connect(config, api_transport=None):
+        if config['region'] not in regions:
+            regions[config['region']] = (FakeDataPipelineConnection(backend),
+                                         FakeS3Connection(backend))
+        return regions[config['region']]
+    monkeypatch.setattr(cli, 'connect', connect)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+
+    def activate(shards):
+        project.join('pipewelder.json').write(json.dumps(
+            {'dev': {'dirs': ['echoer'], 'values': {'myEnv': 'dev'},
+                     'shards': shards}}))
+        caplog.clear()
+        with project.as_cwd():
+            assert main(['progname', 'activate']) == 0
+        return [r.getMessage() for r in caplog.records
+                if r.levelname == 'WARNING']
+    assert activate([{'region': 'us-west-2'}]) == []
+    warnings = activate([{'region': 'us-west-2', 'quota': 0},
+                         {'region': 'us-east-1'}])
+    assert len(warnings) == 1
+    assert warnings[0].startswith("Pipeline 'echoer' of group 'dev' is "
+                                  "assigned to another shard but is still "
+                                  "deployed in region 'us-west-2'")
@@ -2,6 +2,7 @@
 
 import pytest
 import os
+import json
 
 from pipewelder import core
 from datetime import datetime
@@ -49,3 +50,103 @@ def pipeline_description():
 def test_pipeline_state(pipeline_description):
     state = core.fetch_field_value(pipeline_description, '@pipelineState')
     assert state == 'PENDING'
+
+
+def test_actions_share_pipeline_index():
+    from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                     FakeS3Connection)
+    backend = FakeBackend()
+    pw = core.Pipewelder(FakeDataPipelineConnection(backend),
+                         data_path('pipeline_definition.json'),
+                         FakeS3Connection(backend))
+    pw.add_pipeline(data_path('echoer'))
+    assert pw.validate()
+    assert pw.activate()
+    assert backend.calls['validate_pipeline_definition'] == 1
+    assert backend.calls['describe_pipelines'] == 1
+    # the stub pipeline and the echoer pipeline
+    assert backend.calls['create_pipeline'] == 2
+
+
+def write_pipelines(tmpdir, names, pinned=()):
+    source = data_path(os.path.join('echoer', 'values.json'))
+    with open(source) as f:
+        values = json.load(f)
+    for name in names:
+        values['values']['myName'] = name
+        values['values']['mySchedulePeriod'] = '1 hours'
+        if name in pinned:
+            values['stagger'] = False
+        else:
+            values.pop('stagger', None)
+        tmpdir.join(name, 'values.json').write(json.dumps(values),
+                                               ensure=True)
+    return [str(tmpdir.join(name)) for name in names]
+
+
+@pytest.mark.parametrize('mode', ['hash', 'optimize'])
+def test_stagger(tmpdir, mode):
+    names = ['a', 'b', 'c', 'd', 'pinned']
+    pw = core.Pipewelder(None, data_path('pipeline_definition.json'),
+                         stagger=mode)
+    for dirpath in write_pipelines(tmpdir, names, pinned=['pinned']):
+        pw.add_pipeline(dirpath)
+    pw.stagger_pipelines()
+    offsets = dict((name, pw.pipelines[name].start_offset) for name in names)
+    assert offsets['pinned'] == 0
+    assert all(0 <= offset < 60 for offset in offsets.values())
+    minutes = set(pw.pipelines[name].values['myStartDateTime'][14:16]
+                  for name in names)
+    assert len(minutes) > 1
+    if mode == 'optimize':
+        # 10-minute runs fit side by side in the hour
+        assert len(minutes) == len(names)
+    # re-adding a pipeline keeps it staggered
+    before = pw.pipelines['a'].values['myStartDateTime']
+    pw.add_pipeline(str(tmpdir.join('a')))
+    assert pw.pipelines['a'].values['myStartDateTime'] == before
+
+
+def test_stagger_config_start(tmpdir):
+    pw = core.Pipewelder(None, data_path('pipeline_definition.json'),
+                         values={'myStartDateTime': '2015-01-01T00:07:00'},
+                         stagger='hash')
+    pipeline = pw.add_pipeline(write_pipelines(tmpdir, ['a'])[0])
+    # offsets apply to the start time from the configuration
+    minute = (7 + pipeline.start_offset) % 60
+    assert pipeline.values['myStartDateTime'][14:16] == \
+        '{0:02d}'.format(minute)
+    assert pipeline.start_date_time == '2015-01-01T00:07:00'
+
+
+def test_unknown_stagger_mode():
+    with pytest.raises(ValueError):
+        core.Pipewelder(None, data_path('pipeline_definition.json'),
+                        stagger='random')
+
+
+def test_activate_updates_in_place(make_pipeline, fake_aws, monkeypatch):
+    calls = fake_aws.backend.calls
+    pipeline = make_pipeline()
+    assert pipeline.activate()
+    pipeline_id = pipeline.create()
+    # an active pipeline keeps its id, and so its run history
+    assert pipeline.activate()
+    assert pipeline.create() == pipeline_id
+    assert calls['activate_pipeline'] == 2
+    assert calls['delete_pipeline'] == 0
+
+    put = fake_aws.conn.put_pipeline_definition
+
+    def reject_active(objects, pipeline_id, *args):
+        response = put(objects, pipeline_id, *args)
+        if fake_aws.conn.pipelines[pipeline_id]['state'] != 'PENDING':
+            response['errored'] = True
+        return response
+    monkeypatch.setattr(fake_aws.conn, 'put_pipeline_definition',
+                        reject_active)
+    creates = calls['create_pipeline']
+    assert pipeline.activate()
+    assert calls['delete_pipeline'] == 1
+    assert calls['create_pipeline'] == creates + 1
+    assert calls['activate_pipeline'] == 3
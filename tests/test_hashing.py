@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+
+from pipewelder import hashing
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+
+def multipart_etag(data, part):
+    digests = [hashlib.md5(data[start:start + part]).digest()
+               for start in range(0, len(data), part)]
+    return '{0}-{1}'.format(hashlib.md5(b''.join(digests)).hexdigest(),
+                            len(digests))
+
+
+def test_hash_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(hashing, 'BLOCK_SIZE', 1000)
+    data = os.urandom(2500)
+    path = tmpdir.join('data')
+    path.write_binary(data)
+    assert hashing.hash_file(str(path), [hashing.MD5, hashing.SHA256,
+                                         hashing.ETAG]) == {
+        'md5': hashlib.md5(data).hexdigest(),
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'etag': hashlib.md5(data).hexdigest()}
+
+    # empty files can't be memory-mapped
+    tmpdir.join('empty').write('')
+    assert hashing.hash_file(str(tmpdir.join('empty')), [hashing.SHA1]) == \
+        {'sha1': hashlib.sha1(b'').hexdigest()}
+
+
+def test_multipart_etag(tmpdir, monkeypatch):
+    path = tmpdir.join('data')
+    data = os.urandom(5000)
+    path.write_binary(data)
+    monkeypatch.setattr(hashing, 'MULTIPART_THRESHOLD', 1000)
+    for part, block in [(2000, 1000), (2000, 1500), (500, 1000)]:
+        monkeypatch.setattr(hashing, 'PART_SIZE', part)
+        monkeypatch.setattr(hashing, 'BLOCK_SIZE', block)
+        assert hashing.hash_file(str(path), [hashing.ETAG, hashing.MD5]) == {
+            'etag': multipart_etag(data, part),
+            'md5': hashlib.md5(data).hexdigest()}
+
+    # parts grow to keep within the limit on their number
+    monkeypatch.setattr(hashing, 'MAX_PARTS', 3)
+    assert hashing.part_size(5000) == 2000
+    assert hashing.part_size(6001) == 4000
+
+
+def test_hash_tree():
+    hashes = hashing.hash_tree(os.path.join(DATA_DIR, 'echoer'),
+                               [hashing.SHA1], concurrency=4)
+    assert [path for path, digests in hashes] == \
+        ['run', os.path.join('tasks', 'first.txt'),
+         os.path.join('tasks', 'second.txt'), 'values.json']
+    for path, digests in hashes:
+        with open(os.path.join(DATA_DIR, 'echoer', path), 'rb') as f:
+            assert digests == {'sha1': hashlib.sha1(f.read()).hexdigest()}
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime, timedelta
+
+from pipewelder import cli, history
+from pipewelder.instances import Instance
+
+
+def add_run(conn, pipeline, name, scheduled, minutes, status='FINISHED'):
+    ended = minutes is not None and scheduled + timedelta(minutes=minutes) \
+        or None
+    conn.add_run(pipeline.create(), name, scheduled, status, scheduled,
+                 ended)
+
+
+def run(minutes, days_ago=0, status='FINISHED'):
+    start = datetime(2015, 1, 31) - timedelta(days=days_ago)
+    return Instance('run', status=status, scheduled_start=start,
+                    actual_start=start,
+                    actual_end=start + timedelta(minutes=minutes))
+
+
+def test_update_incremental(fake_aws, make_pipeline, tmpdir):
+    backend, conn = fake_aws.backend, fake_aws.conn
+    pipeline = make_pipeline()
+    path = str(tmpdir.join('history.json'))
+    hist = history.History(path)
+    now = datetime.utcnow()
+    since = now - timedelta(hours=2)
+    # pipelines not yet deployed have no runs, and are not created
+    assert hist.update('dev/echoer', pipeline, since) == 0
+    assert conn.pipelines == {}
+
+    for i in range(1, 5):
+        add_run(conn, pipeline, 'run{0}'.format(i),
+                now - timedelta(minutes=15 * i), 5)
+    add_run(conn, pipeline, 'running', now - timedelta(minutes=2), None,
+            status='RUNNING')
+    assert hist.update('dev/echoer', pipeline, since) == 5
+    hist.save()
+
+    # later runs and the one still going are looked up again; the rest
+    # come from the saved history
+    hist = history.History(path)
+    add_run(conn, pipeline, 'running', now - timedelta(minutes=2), 4)
+    add_run(conn, pipeline, 'run0', now, 3)
+    calls = backend.calls['describe_objects']
+    assert hist.update('dev/echoer', pipeline, since) == 2
+    assert backend.calls['describe_objects'] == calls + 1
+    runs = hist.runs('dev/echoer', since)
+    assert [r.id for r in runs] == \
+        ['run4', 'run3', 'run2', 'run1', 'running', 'run0']
+    assert all(r.finished for r in runs)
+
+    # looking further back fetches only the older range
+    assert hist.update('dev/echoer', pipeline, since - timedelta(hours=1),
+                       now + timedelta(minutes=1)) == 1
+
+
+def test_analyze():
+    runs = [run(minutes) for minutes in [4, 5, 6, 7, 40]]
+    runs.append(run(3, status='FAILED'))
+    report = history.analyze('echoer', runs, '30 minutes', '15 minutes')
+    assert (report['runs'], report['finished'], report['failed']) == \
+        (6, 5, 1)
+    assert report['p50'] == 6
+    assert report['max'] == 40
+    assert report['flags'] == [history.NEAR_TIMEOUT, history.OVERLAPPING,
+                               history.LONGER_PERIOD]
+    assert report['suggested_period'] == '60 minutes'
+
+    report = history.analyze('echoer', [run(5)], None, '1 hours')
+    assert report['flags'] == [] and report['headroom'] is None
+
+    report = history.analyze('echoer', [], '10 minutes', '1 hours')
+    assert report['p95'] is None and report['flags'] == []
+
+
+def test_trend():
+    runs = [run(10 + 2 * days_ago, days_ago) for days_ago in range(5)]
+    report = history.analyze('echoer', runs, None, '1 days')
+    assert abs(report['trend'] + 2) < 1e-9
+    assert history.trend([datetime(2015, 1, 1)], [1]) is None
+
+
+def test_durations_command(fake_aws, make_pipeline, project, capsys):
+    with project.as_cwd():
+        pipeline = make_pipeline()
+        for i in range(4):
+            add_run(fake_aws.conn, pipeline, 'run{0}'.format(i),
+                    datetime.utcnow() - timedelta(hours=i + 1), 9)
+        assert cli.main(['progname', 'durations', '--format', 'json']) == 0
+        out, err = capsys.readouterr()
+        reports = json.loads(out[out.index('['):])
+        assert [(r['group'], r['name'], r['finished'], r['flags'])
+                for r in reports] == \
+            [('dev', 'echoer', 4, [history.NEAR_TIMEOUT])]
+        assert project.join(history.DEFAULT_PATH).exists()
+
+        assert cli.main(['progname', 'durations']) == 0
+        out, err = capsys.readouterr()
+        assert history.NEAR_TIMEOUT in out
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+
+import py
+import pytest
+from pytest import raises
+
+from pipewelder import Pipewelder
+from pipewelder.journal import Journal
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def make_pipewelder(backend, **kwargs):
+    pw = Pipewelder(FakeDataPipelineConnection(backend),
+                    data_path('pipeline_definition.json'),
+                    FakeS3Connection(backend), **kwargs)
+    pw.add_pipeline(data_path('echoer'))
+    return pw
+
+
+def test_resume_skips_completed_steps(tmpdir):
+    path = str(tmpdir.join('journal.jsonl'))
+    backend = FakeBackend()
+    pw = make_pipewelder(backend, journal=Journal(path, 'dev'))
+    assert pw.upload()
+    puts = backend.calls['s3.put_object']
+    assert puts > 0
+
+    # a different group, or not resuming, redoes the step
+    for journal in [Journal(path, 'prod', resume=True), Journal(path, 'dev')]:
+        assert make_pipewelder(backend, journal=journal).upload()
+    assert backend.calls['s3.put_object'] == 3 * puts
+
+    pw = make_pipewelder(backend, journal=Journal(path, 'dev', resume=True))
+    assert pw.upload()
+    assert backend.calls['s3.put_object'] == 3 * puts
+
+    # changed content is not considered done
+    pw.pipelines['echoer'].values['myEnv'] = 'changed'
+    pw.pipelines['echoer']._content_hash = None
+    assert pw.upload()
+    assert backend.calls['s3.put_object'] == 4 * puts
+
+
+def test_delete_undoes_steps(tmpdir):
+    path = str(tmpdir.join('journal.jsonl'))
+    pw = make_pipewelder(FakeBackend(), journal=Journal(path))
+    pipeline = pw.pipelines['echoer']
+    pw.journal.record(pipeline, 'activate')
+    pw.journal.record(pipeline, 'delete')
+    with open(path, 'a') as f:
+        f.write('{"truncated')
+    journal = Journal(path, resume=True)
+    assert journal.done(pipeline, 'delete')
+    assert not journal.done(pipeline, 'activate')
+
+
+@pytest.mark.parametrize('on_error', ['fail-fast', 'continue'])
+def test_error_policy(on_error, monkeypatch, tmpdir):
+    pw = make_pipewelder(FakeBackend(), on_error=on_error)
+    other = tmpdir.join('other')
+    py.path.local(data_path('echoer')).copy(other)
+    values = other.join('values.json')
+    values.write(values.read().replace('"echoer"', '"other"'))
+    pw.add_pipeline(str(other))
+    calls = []
+
+    def upload(pipeline):
+        calls.append(pipeline.name)
+        raise IOError("upload failed")
+    monkeypatch.setattr(type(pw.pipelines['echoer']), 'upload', upload)
+    if on_error == 'fail-fast':
+        with raises(IOError):
+            pw.upload()
+        assert len(calls) == 1
+    else:
+        assert not pw.upload()
+        assert len(calls) == 2
+
+
+def test_unknown_policy():
+    with raises(ValueError):
+        make_pipewelder(FakeBackend(), on_error='retry')
+
+
+def test_reset(tmpdir):
+    path = str(tmpdir.join('journal.jsonl'))
+    pw = make_pipewelder(FakeBackend())
+    pipeline = pw.pipelines['echoer']
+    dev, prod = Journal(path, 'dev'), Journal(path, 'prod')
+    dev.record(pipeline, 'upload')
+    prod.record(pipeline, 'upload')
+    dev.reset()
+    assert not Journal(path, 'dev', resume=True).done(pipeline, 'upload')
+    assert Journal(path, 'prod', resume=True).done(pipeline, 'upload')
+    prod.reset()
+    assert not os.path.exists(path)
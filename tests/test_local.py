@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+
+import py
+
+from pipewelder import Pipewelder
+from pipewelder.cli import main
+from pipewelder.local import run_pipeline
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def test_run_pipeline(tmpdir):
+    pw = Pipewelder(None, data_path('pipeline_definition.json'),
+                    values={'myEnv': 'dev'})
+    pipeline = pw.add_pipeline(data_path('echoer'))
+    result = run_pipeline(pipeline, str(tmpdir))
+    assert result['ok']
+    output = tmpdir.join('echoer', 'output1')
+    assert sorted(f.basename for f in output.listdir()) == \
+        ['first.txt', 'second.txt', 'stdout.txt']
+    assert output.join('first.txt').read() == \
+        py.path.local(data_path('echoer/tasks/first.txt')).read()
+
+
+def test_run_local_command(tmpdir, capsys):
+    py.path.local(data_path('pipeline_definition.json')).copy(
+        tmpdir.join('pipeline_definition.json'))
+    for name in ['echoer', 'failer']:
+        py.path.local(data_path('echoer')).copy(tmpdir.join(name))
+    values = tmpdir.join('failer', 'values.json')
+    values.write(values.read().replace('"echoer"', '"failer"'))
+    tmpdir.join('failer', 'run').write('#!/bin/sh\nexit 3\n')
+    tmpdir.join('pipewelder.json').write(json.dumps({
+        "dev": {"values": {"myEnv": "dev"}}}))
+    with tmpdir.as_cwd():
+        assert main(['progname', 'run-local', 'echoer']) == 0
+        assert tmpdir.join('pipewelder-output', 'dev', 'echoer', 'output1',
+                           'first.txt').check()
+        assert main(['progname', 'run-local', '--processes', '2',
+                     '--output-dir', 'out']) == 1
+        assert main(['progname', 'run-local', 'missing']) == 1
+    out, err = capsys.readouterr()
+    assert "Ran 1 pipelines" in out
+    assert "FAILED (exit 3)" in out
+    assert tmpdir.join('out', 'dev', 'echoer', 'log.txt').check()
+    assert "No pipeline configured in" in out
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from datetime import datetime, timedelta
+
+from pipewelder import cli, logs
+
+OUTPUTS = 'dev/echoer/outputs/'
+
+
+def add_output(s3_conn, scheduled, text, name=logs.LOG_NAME):
+    bucket = s3_conn.get_bucket('pipewelder-example')
+    key = '{0}{1}/{2}'.format(OUTPUTS,
+                              scheduled.strftime('%Y-%m-%d_%H%M%S'), name)
+    bucket.new_key(key).set_contents_from_string(text)
+
+
+def test_layout(make_pipeline):
+    pipeline = make_pipeline()
+    layout = logs.OutputLayout.of(pipeline)
+    assert (layout.bucket, layout.base, layout.format) == \
+        ('pipewelder-example', OUTPUTS, '%Y-%m-%d_%H%M%S')
+    assert layout.chronological
+    assert layout.parse(OUTPUTS + '2015-01-31_120000/') == \
+        datetime(2015, 1, 31, 12)
+    assert layout.parse(OUTPUTS + 'elsewhere/') is None
+    assert not logs.OutputLayout('b', 'p', '%H%M_%Y-%m-%d').chronological
+
+
+def test_latest(fake_aws, make_pipeline, monkeypatch):
+    backend, s3_conn = fake_aws.backend, fake_aws.s3_conn
+    pipeline = make_pipeline()
+    now = datetime.utcnow().replace(microsecond=0)
+    for i in range(100):
+        add_output(s3_conn, now - timedelta(minutes=15 * i),
+                   'run {0}\n'.format(i))
+    add_output(s3_conn, now - timedelta(minutes=30), 'other', 'stderr.txt')
+    tailer = logs.LogTailer([pipeline])
+    entries = tailer.latest(3)
+    assert [text for name, scheduled, text in entries] == \
+        ['run 2\n', 'run 1\n', 'run 0\n']
+    assert entries[-1][:2] == ('echoer', now)
+    assert backend.calls['s3.list'] == 1
+    assert backend.calls['s3.get_object'] == 3
+
+    # tails are fetched with a ranged GET, from the first whole line
+    add_output(s3_conn, now + timedelta(minutes=15),
+               'x' * 10 + '\nlast line\nend\n')
+    monkeypatch.setattr(tailer, 'tail_bytes', 12)
+    assert tailer.poll() == [('echoer', now + timedelta(minutes=15), 'end\n')]
+    assert tailer.poll() == []
+
+
+def test_follow_fans_in(fake_aws, make_pipeline):
+    s3_conn = fake_aws.s3_conn
+    first = make_pipeline()
+    second = make_pipeline(myName='second',
+                           myS3OutputDir='s3://pipewelder-example/second')
+    bucket = s3_conn.get_bucket('pipewelder-example')
+    start = datetime(2015, 1, 31, 12)
+    add_output(s3_conn, start, 'first 1\n')
+    bucket.new_key('second/2015-01-31_121500/stdout.txt') \
+        .set_contents_from_string('second 1\n')
+
+    stop = threading.Event()
+    tailer = logs.LogTailer([first, second], concurrency=2)
+    entries = tailer.follow(1, 0, stop)
+    assert [next(entries)[2], next(entries)[2]] == ['first 1\n', 'second 1\n']
+    add_output(s3_conn, start + timedelta(minutes=30), 'first 2\n')
+    assert next(entries) == ('echoer', start + timedelta(minutes=30),
+                             'first 2\n')
+    stop.set()
+    assert list(entries) == []
+
+
+def test_logs_command(fake_aws, project, capsys):
+    s3_conn = fake_aws.s3_conn
+    add_output(s3_conn, datetime(2015, 1, 31, 12), 'hello\nworld\n')
+    with project.as_cwd():
+        assert cli.main(['progname', 'logs', 'echoer', '--runs', '1']) == 0
+        out, err = capsys.readouterr()
+        assert 'echoer 2015-01-31T12:00:00 | hello' in out
+        assert 'echoer 2015-01-31T12:00:00 | world' in out
+
+        assert cli.main(['progname', 'logs', 'missing']) == 1
+
+
+def test_pending_expires(fake_aws, make_pipeline):
+    backend, s3_conn = fake_aws.backend, fake_aws.s3_conn
+    now = datetime.utcnow().replace(microsecond=0)
+    add_output(s3_conn, now - timedelta(minutes=1), '', 'stderr.txt')
+    # the example pipeline's runs are over 25 minutes after they are due
+    add_output(s3_conn, now - timedelta(minutes=30), '', 'stderr.txt')
+    tailer = logs.LogTailer([make_pipeline()])
+    assert tailer.latest(2) == []
+    fetched = backend.calls['s3.get_object']
+    assert tailer.poll() == []
+    assert backend.calls['s3.get_object'] == fetched + 1
+    add_output(s3_conn, now - timedelta(minutes=1), 'late\n')
+    assert [entry[2] for entry in tailer.poll()] == ['late\n']
+    assert tailer.poll() == []
+    assert backend.calls['s3.get_object'] == fetched + 2
+
+
+def test_logs_command_skips_unknown_layouts(fake_aws, project, capsys):
+    template = json.loads(project.join('pipeline_definition.json').read())
+    for obj in template['objects']:
+        if 'myS3OutputDir' in obj.get('directoryPath', ''):
+            obj['directoryPath'] = '#{myS3OutputDir}'
+    project.join('flat_definition.json').write(json.dumps(template))
+    project.join('pipewelder.json').write(json.dumps({
+        'dev': {'dirs': ['echoer'], 'values': {'myEnv': 'dev'}},
+        'flat': {'dirs': ['echoer'], 'values': {'myEnv': 'flat'},
+                 'template': 'flat_definition.json'}}))
+    add_output(fake_aws.s3_conn, datetime(2015, 1, 31, 12), 'hello\n')
+    with project.as_cwd():
+        assert cli.main(['progname', 'logs', '--runs', '1']) == 0
+        out, err = capsys.readouterr()
+        assert 'echoer 2015-01-31T12:00:00 | hello' in out
+
+        assert cli.main(['progname', 'logs', '--group', 'flat']) == 1
+        out, err = capsys.readouterr()
+        assert 'No pipelines with output to show' in out
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+
+from pytest import raises
+
+from pipewelder import Pipewelder
+from pipewelder.packing import PackedPipeline, pack
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def write_pipelines(tmpdir, names, **overrides):
+    with open(data_path(os.path.join('echoer', 'values.json'))) as f:
+        values = json.load(f)
+    values['values'].update(overrides)
+    for name in names:
+        values['values']['myName'] = name
+        values['values']['myS3InputDir'] = (
+            's3://pipewelder-example/#{myEnv}/' + name + '/inputs')
+        tmpdir.join(name, 'values.json').write(json.dumps(values),
+                                               ensure=True)
+        tmpdir.join(name, 'run').write('echo ' + name)
+    return [str(tmpdir.join(name)) for name in names]
+
+
+def make_pipewelder(tmpdir, names, packing, backend=None, conn=None,
+                    **overrides):
+    backend = backend or FakeBackend()
+    pw = Pipewelder(conn or FakeDataPipelineConnection(backend),
+                    data_path('pipeline_definition.json'),
+                    FakeS3Connection(backend), values={'myEnv': 'dev'},
+                    packing=packing)
+    for dirpath in write_pipelines(tmpdir, names, **overrides):
+        pw.add_pipeline(dirpath)
+    return pw
+
+
+def test_pack_limits(tmpdir):
+    names = ['p{0}'.format(i) for i in range(7)]
+    pw = make_pipewelder(tmpdir, names, {'max_size': 3},
+                         mySchedulePeriod='1 hours')
+    units = sorted(pw.units(), key=lambda u: u.name)
+    assert [len(getattr(u, 'members', [u])) for u in units] == [1, 3, 3]
+    assert units[0].name == 'p6'
+
+    packed = units[1]
+    assert [m.name for m in packed.members] == ['p0', 'p1', 'p2']
+    objects = dict((o['id'], o) for o in packed.definition['objects'])
+    assert objects['PipewelderEC2Resource']['terminateAfter'] == '30 minutes'
+    # a member's failure must not cascade to the others
+    assert 'dependsOn' not in objects['p1_PipewelderShellCommandActivity']
+    assert objects['p2_PipewelderShellCommandActivity']['input'] == \
+        {'ref': 'p2_PipewelderS3InputLocation'}
+    assert objects['p2_PipewelderS3InputLocation']['directoryPath'] == \
+        's3://pipewelder-example/dev/p2/inputs'
+    assert packed.tags == {'pipewelder-environment': 'dev'}
+    assert pw.unit_of(pw.pipelines['p1']) is packed
+
+    # a run of each pack must finish within the schedule period
+    pw = make_pipewelder(tmpdir, names, {'max_terminate_after': '25 minutes'},
+                         mySchedulePeriod='1 hours')
+    sizes = [len(getattr(u, 'members', [u])) for u in pw.units()]
+    assert sorted(sizes) == [1, 2, 2, 2]
+
+
+def test_unpackable(tmpdir):
+    # two 10 minute runs do not fit in a 15 minute period
+    pw = make_pipewelder(tmpdir, ['a', 'b'], {})
+    assert len(pw.units()) == 2
+    pw = make_pipewelder(tmpdir, ['a', 'b'], {}, mySchedulePeriod='1 hours')
+    pw.add_pipeline(write_pipelines(tmpdir, ['daily'],
+                                    mySchedulePeriod='1 days')[0])
+    units = pw.units()
+    assert len(units) == 2
+    assert [u.name for u in units if not isinstance(u, PackedPipeline)] == \
+        ['daily']
+    assert pack([pw.pipelines['a']]) == [pw.pipelines['a']]
+
+    # a pack has a single log location
+    pw = make_pipewelder(tmpdir, ['a', 'b'], {}, mySchedulePeriod='1 hours')
+    pw.pipelines['b'].values['myS3LogDir'] = 's3://pipewelder-example/b/logs'
+    assert len(pw.units()) == 2
+
+
+def test_deploy_packed(tmpdir):
+    backend = FakeBackend()
+    pw = make_pipewelder(tmpdir, ['a', 'b', 'c'], {}, backend,
+                         mySchedulePeriod='1 hours')
+    assert pw.validate()
+    assert pw.upload()
+    assert pw.activate()
+    assert backend.calls['create_pipeline'] == 2
+    assert backend.calls['activate_pipeline'] == 1
+    buckets = pw.s3_conn.buckets
+    assert sorted(k for k in buckets['pipewelder-example'].contents
+                  if k.endswith('run')) == \
+        ['dev/a/inputs/run', 'dev/b/inputs/run', 'dev/c/inputs/run']
+
+    with raises(ValueError):
+        pw.units()[0].shift_start(5)
+
+
+def test_retire_stale_packs(tmpdir):
+    backend = FakeBackend()
+    conn = FakeDataPipelineConnection(backend)
+
+    def packs():
+        return sorted(p['tags'][0]['value'] + ' ' + p['description']
+                      for p in conn.pipelines.values()
+                      if p['name'].startswith('pipewelder-pack-'))
+    prod = make_pipewelder(tmpdir.join('prod'), ['a', 'b'], {}, backend,
+                           conn, mySchedulePeriod='1 hours',
+                           myTags=['pipewelder-environment:prod'])
+    assert prod.activate()
+    dev = make_pipewelder(tmpdir.join('dev'), ['a', 'b', 'c'], {}, backend,
+                          conn, mySchedulePeriod='1 hours')
+    assert dev.activate()
+    assert packs() == ['dev Pipewelder pack of 3 pipelines: a, b, c',
+                       'prod Pipewelder pack of 2 pipelines: a, b']
+
+    # unpacked, dev's pipelines would run twice alongside the old pack
+    dev = make_pipewelder(tmpdir.join('dev'), ['a', 'b', 'c'],
+                          {'max_size': 1}, backend, conn,
+                          mySchedulePeriod='1 hours')
+    assert dev.activate()
+    assert packs() == ['prod Pipewelder pack of 2 pipelines: a, b']
+
+    prod = make_pipewelder(tmpdir.join('prod'), ['a'], {}, backend, conn,
+                           mySchedulePeriod='1 hours',
+                           myTags=['pipewelder-environment:prod'])
+    assert prod.delete()
+    assert packs() == []
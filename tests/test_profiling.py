@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+from pipewelder import profiling
+
+
+def test_phase_is_noop_without_profiler():
+    with profiling.phase('network'):
+        pass
+    assert profiling._active is None
+
+
+def test_phase_times_are_exclusive():
+    profiler = profiling.Profiler(sampling=False)
+    profiler.start()
+    try:
+        with profiling.phase('network'):
+            time.sleep(0.02)
+            with profiling.phase('translation'):
+                time.sleep(0.05)
+    finally:
+        profiler.stop()
+    summary = dict((name, seconds)
+                   for name, seconds, calls in profiler.summary())
+    assert list(summary) == ['translation', 'network']
+    assert summary['translation'] >= 0.05
+    assert summary['network'] < summary['translation']
+
+
+def test_write(tmpdir):
+    profiler = profiling.Profiler(sample_interval=0.001)
+    profiler.start()
+    try:
+        with profiling.phase('config discovery'):
+            time.sleep(0.02)
+    finally:
+        profiler.stop()
+    prefix = str(tmpdir.join('out', 'profile'))
+    paths = profiler.write(prefix)
+    assert all(os.path.exists(path) for path in paths)
+    with open(prefix + '.collapsed') as f:
+        lines = f.read().splitlines()
+    assert any(line.startswith('phase:config discovery;') for line in lines)
+    with open(prefix + '.phases.json') as f:
+        phases = json.load(f)['phases']
+    assert phases[0]['phase'] == 'config discovery'
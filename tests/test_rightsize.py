@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from pipewelder import cli, rightsize
+
+
+def report(p95, longest=None):
+    return {'name': 'echoer', 'terminate_after': '10 minutes', 'p95': p95,
+            'max': longest or p95}
+
+
+def add_runs(conn, pipeline, minutes, count=4):
+    for i in range(count):
+        scheduled = datetime.utcnow() - timedelta(hours=i + 1)
+        conn.add_run(pipeline.create(), 'run{0}'.format(i), scheduled,
+                     started=scheduled,
+                     ended=scheduled + timedelta(minutes=minutes))
+
+
+def test_recommend():
+    catalog = rightsize.DEFAULT_CATALOG
+    # too slow for a 15 minute period on the smallest type
+    slow = rightsize.recommend(report(9), 't1.micro', catalog, 15)
+    assert slow['instance_type'] == 'm1.small'
+    assert slow['estimated_p95'] == 4.5
+    assert slow['terminate_after'] == '10 minutes'
+
+    # oversized: a cheaper type still fits
+    idle = rightsize.recommend(report(1), 'm1.xlarge', catalog, 15)
+    assert idle['instance_type'] == 'm3.medium'
+    assert idle['cost_per_run'] < idle['current_cost_per_run']
+
+    fine = rightsize.recommend(report(2, 5), 't1.micro', catalog, 60)
+    assert (fine['instance_type'], fine['reason']) == \
+        ('t1.micro', 'already right')
+    assert fine['terminate_after'] == '10 minutes'
+
+    hopeless = rightsize.recommend(report(600), 't1.micro', catalog, 15)
+    assert hopeless['instance_type'] == 'c1.xlarge'
+
+    assert rightsize.recommend(report(None), 't1.micro', catalog, 15)[
+        'instance_type'] is None
+    assert rightsize.recommend(report(5), 'x9.huge', catalog, 15)[
+        'instance_type'] is None
+
+
+def test_load_catalog(tmpdir):
+    path = tmpdir.join('catalog.json')
+    path.write(json.dumps({'small': {'speed': 1, 'price': 0.1}}))
+    assert rightsize.load_catalog(str(path)) == \
+        {'small': {'speed': 1, 'price': 0.1}}
+    path.write(json.dumps({'small': {'price': 0.1}}))
+    with pytest.raises(ValueError):
+        rightsize.load_catalog(str(path))
+
+
+def test_instance_type_of(make_pipeline):
+    pipeline = make_pipeline()
+    assert rightsize.instance_type_of(pipeline) == \
+        ('t1.micro', 'myInstanceType')
+    pipeline.values['myInstanceType'] = 'm1.large'
+    assert rightsize.instance_type_of(pipeline) == \
+        ('m1.large', 'myInstanceType')
+    [resource] = [obj for obj in pipeline.definition['objects']
+                  if obj['id'] == 'PipewelderEC2Resource']
+    pipeline.definition['objects'] = [
+        dict(obj, instanceType='m1.small') if obj is resource else obj
+        for obj in pipeline.definition['objects']]
+    assert rightsize.instance_type_of(pipeline) == ('m1.small', None)
+
+
+def test_rightsize_command(fake_aws, make_pipeline, project, capsys):
+    with project.as_cwd():
+        add_runs(fake_aws.conn, make_pipeline(), 9)
+        assert cli.main(['progname', 'rightsize', '--format', 'json']) == 0
+        out, err = capsys.readouterr()
+        recommendations = json.loads(out[out.index('['):])
+        assert [(r['group'], r['name'], r['current_type'],
+                 r['instance_type']) for r in recommendations] == \
+            [('dev', 'echoer', 't1.micro', 'm1.small')]
+        values = project.join('echoer', 'values.json')
+        assert 'myInstanceType' not in values.read()
+
+        assert cli.main(['progname', 'rightsize', '--write']) == 0
+        out, err = capsys.readouterr()
+        assert 'm1.small' in out
+        written = json.loads(values.read())['values']
+        assert written['myInstanceType'] == 'm1.small'
+        assert written['myTerminateAfter'] == '10 minutes'
+        assert written['myName'] == 'echoer'
+
+
+def test_rightsize_errors(fake_aws, make_pipeline, project, capsys):
+    values = json.loads(project.join('echoer', 'values.json').read())
+    values['values'].update(myName='broken',
+                            myInstanceType='#{myUnsetType}')
+    project.join('broken', 'values.json').write(json.dumps(values),
+                                                ensure=True)
+    project.join('pipewelder.json').write(json.dumps(
+        {'dev': {'dirs': ['echoer', 'broken'], 'values': {'myEnv': 'dev'}}}))
+    with project.as_cwd():
+        add_runs(fake_aws.conn, make_pipeline(), 9)
+        # one pipeline's error is reported without losing the others
+        assert cli.main(['progname', 'rightsize', '--format', 'json']) == 1
+        out, err = capsys.readouterr()
+        recommendations = json.loads(out[out.index('['):])
+        assert [(r['name'], r['instance_type']) for r in recommendations] \
+            == [('broken', None), ('echoer', 'm1.small')]
+        assert 'myUnsetType' in recommendations[0]['reason']
+        assert project.join('.pipewelder-history.json').exists()
+
+        project.join('catalog.json').write('{"small": {"price": 1}}')
+        assert cli.main(['progname', 'rightsize', '--catalog',
+                         'catalog.json']) == 1
+        out, err = capsys.readouterr()
+        assert 'Could not load instance type catalog' in out
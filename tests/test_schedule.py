@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+from datetime import datetime
+
+import pytest
+from pytest import raises
+
+from pipewelder import Pipewelder
+from pipewelder.schedule import (Schedule, Simulation, duration_minutes,
+                                 occupancy)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+parametrize = pytest.mark.parametrize
+
+
+@parametrize('expression,minutes', [
+    ('10 minutes', 10),
+    ('2 hours', 120),
+    ('1 Days', 1440),
+    ('#{format(minusMinutes(15 minutes, 10))}', 5),
+    ('#{plusHours(1 hours, 1)}', 120),
+])
+def test_duration_minutes(expression, minutes):
+    assert duration_minutes(expression) == minutes
+
+
+def test_duration_minutes_invalid():
+    with raises(ValueError):
+        duration_minutes('#{minusMinutes(10 minutes, 10)}')
+
+
+def test_occupancy_matches_expanded_runs():
+    rng = random.Random(0)
+    horizon = 500
+    schedules = []
+    for i in range(50):
+        period = rng.choice([15, 30, 60, 90])
+        schedules.append(Schedule(str(i), period, rng.randrange(period),
+                                  rng.randint(1, 2 * period)))
+    expected = [0] * horizon
+    for s in schedules:
+        # include runs that started before the horizon
+        for start in range(s.offset - 3 * s.period, horizon, s.period):
+            for minute in range(max(start, 0),
+                                min(start + s.duration, horizon)):
+                expected[minute] += 1
+    lengths = [s.duration for s in schedules]
+    assert list(occupancy(schedules, horizon, lengths)) == expected
+
+
+def test_simulation():
+    schedules = [Schedule('a', 60, 0, 10), Schedule('b', 60, 0, 30),
+                 Schedule('c', 30, 15, 5), Schedule('d', 1440, 15, 60,
+                                                    bounded=False)]
+    simulation = Simulation(schedules, 24 * 60, datetime(2015, 1, 1))
+    assert simulation.peak() == (3, 15)
+    assert simulation.peak(simulation.launches) == (2, 0)
+    assert simulation.instance_hours == (24 * 40 + 48 * 5 + 60) / 60.0
+    assert simulation.hotspots() == [(0, ('a', 'b')), (15, ('c', 'd'))]
+    assert simulation.time_of(75) == '2015-01-01T01:15'
+
+
+def test_schedule_from_pipeline():
+    pw = Pipewelder(None, os.path.join(DATA_DIR, 'pipeline_definition.json'))
+    pipeline = pw.add_pipeline(os.path.join(DATA_DIR, 'echoer'))
+    pipeline.values['myStartDateTime'] = '2015-01-01T00:20:00'
+    schedule = Schedule.from_pipeline(pipeline, datetime(2015, 1, 1))
+    assert (schedule.period, schedule.offset, schedule.duration) == \
+        (15, 5, 10)
+    assert schedule.bounded
+    assert schedule.first == 20
+    assert [minute for minute in range(60) if schedule.starts_at(minute)] \
+        == [20, 35, 50]
+    pipeline.values['myStartDateTime'] = '2015-01-01T00:05:00'
+    schedule = Schedule.from_pipeline(pipeline, datetime(2015, 1, 1))
+    assert (schedule.offset, schedule.first) == (5, None)
+
+
+def test_future_start():
+    schedules = [Schedule('a', 60, 0, 30), Schedule('b', 60, 30, 45,
+                                                    first=90)]
+    simulation = Simulation(schedules, 240, datetime(2015, 1, 1))
+    assert list(simulation.concurrency[:90]) == [1] * 30 + [0] * 30 + \
+        [1] * 30
+    assert list(simulation.concurrency[90:150]) == [1] * 30 + [2] * 15 + \
+        [1] * 15
+    assert simulation.peak(simulation.launches) == (1, 0)
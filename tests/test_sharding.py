@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import json
+
+from pytest import raises
+
+from pipewelder.cli import pipewelder_configs, selected_configs
+from pipewelder.sharding import Shard, assign
+
+KEYS = ['pipeline{0}'.format(i) for i in range(1000)]
+
+
+def test_assign_moves_few_keys():
+    shards = [Shard('us-east-1'), Shard('us-west-2')]
+    before = assign(KEYS, shards)
+    counts = [list(before.values()).count(s.name) for s in shards]
+    assert min(counts) > 400
+    after = assign(KEYS, shards + [Shard('us-west-2', 'second')])
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == 'us-west-2-second' for key in moved)
+    assert 250 < len(moved) < 420
+
+
+def test_assign_respects_quotas():
+    shards = [Shard('us-east-1', quota=100), Shard('us-west-2')]
+    assignment = assign(KEYS, shards)
+    assert list(assignment.values()).count('us-east-1') == 100
+    with raises(ValueError):
+        assign(KEYS, [Shard('us-east-1', quota=600),
+                      Shard('us-west-2', quota=300)])
+    with raises(ValueError):
+        assign(KEYS, [Shard('us-east-1'), Shard('us-east-1')])
+
+
+def test_sharded_configs(tmpdir):
+    for i in range(20):
+        tmpdir.join('p{0}'.format(i), 'values.json').write('{}', ensure=True)
+    tmpdir.join('pipewelder.json').write(json.dumps({
+        "defaults": {"region": "us-east-1"},
+        "prod": {"shards": [{"region": "us-east-1", "quota": 5},
+                            {"region": "eu-west-1", "profile": "eu",
+                             "name": "eu"}]},
+        "dev": {"dirs": ["p0"]},
+    }))
+    configs = pipewelder_configs(str(tmpdir.join('pipewelder.json')))
+    assert sorted(configs) == ['dev', 'prod/eu', 'prod/us-east-1']
+    east, eu = configs['prod/us-east-1'], configs['prod/eu']
+    assert len(east['dirs']) == 5
+    assert sorted(east['dirs'] + eu['dirs']) == \
+        sorted('p{0}'.format(i) for i in range(20))
+    assert (eu['region'], eu['profile'], eu['group']) == \
+        ('eu-west-1', 'eu', 'prod')
+    assert [c['name'] for c in selected_configs(configs, 'prod')] == \
+        ['prod/eu', 'prod/us-east-1']
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime, timedelta
+
+from pipewelder import cli, instances, status
+
+
+def add_runs(conn, pipeline, count, failed=(), start=None, prefix=''):
+    """
+    Add *count* runs of *pipeline*, 15 minutes apart and each taking
+    5 minutes, the last scheduled at *start* (by default, 20 minutes
+    ago).
+    """
+    pipeline_id = pipeline.create()
+    start = start or datetime.utcnow() - timedelta(minutes=20)
+    for i in range(count):
+        scheduled = start - timedelta(minutes=15 * i)
+        conn.add_run(pipeline_id, '{0}run{1:04d}'.format(prefix, i),
+                     scheduled, i in failed and 'FAILED' or 'FINISHED',
+                     scheduled + timedelta(minutes=1),
+                     scheduled + timedelta(minutes=6),
+                     error=i in failed and 'exit 1' or None)
+        # resources have instances too, but aren't runs
+        conn.add_run(pipeline_id, '{0}resource{1:04d}'.format(prefix, i),
+                     scheduled, component='PipewelderEC2Resource')
+
+
+def test_runs(fake_aws, make_pipeline, monkeypatch):
+    monkeypatch.setattr(instances, 'QUERY_LIMIT', 15)
+    pipeline = make_pipeline()
+    add_runs(fake_aws.conn, pipeline, 100, failed=[3])
+    since = datetime.utcnow() - timedelta(hours=6)
+    runs = instances.runs(pipeline, since)
+    # 6 hours of 15-minute runs; their resources are not queried
+    assert len(runs) == 23
+    assert fake_aws.backend.calls['query_objects'] == 2
+    assert fake_aws.backend.calls['describe_objects'] == 1
+    assert [run.id for run in runs[:4]] == \
+        ['run0000', 'run0001', 'run0002', 'run0003']
+    assert runs[3].failed and runs[3].error == 'exit 1'
+    assert runs[0].finished
+    assert runs[0].duration == timedelta(minutes=5)
+    assert instances.Instance.from_json(runs[0].to_json()).__dict__ == \
+        runs[0].__dict__
+
+
+def test_not_deployed(fake_aws, make_pipeline):
+    pipeline = make_pipeline()
+    result = status.pipeline_status(pipeline)
+    assert (result['pipeline_id'], result['runs']) == (None, [])
+    assert '(not deployed)' in status.format_table([result])[1]
+    assert fake_aws.backend.calls['create_pipeline'] == 0
+    assert fake_aws.conn.pipelines == {}
+
+    # pipelines are found by unique id, not just by name
+    other = make_pipeline(myTags=['pipewelder-environment:prod'])
+    other.create()
+    assert pipeline.deployed_id() is None
+    pipeline_id = pipeline.create()
+    assert make_pipeline().deployed_id() == pipeline_id
+
+
+def test_pipeline_status_cached(fake_aws, make_pipeline, tmpdir):
+    pipeline = make_pipeline()
+    add_runs(fake_aws.conn, pipeline, 10, failed=[1])
+    path = str(tmpdir.join('cache.json'))
+    cache = status.StatusCache(path)
+    result = status.pipeline_status(pipeline, 3, cache=cache, group='dev')
+    assert result['failures'] == 1
+    assert [run['status'] for run in result['runs']] == \
+        ['FINISHED', 'FAILED', 'FINISHED']
+    calls = fake_aws.backend.calls['query_objects']
+    assert status.pipeline_status(pipeline, 3, cache=cache,
+                                  group='dev') == result
+    assert fake_aws.backend.calls['query_objects'] == calls
+
+    # the cache is shared with later invocations, which need not look
+    # up the pipeline again
+    cache.save()
+    cache = status.StatusCache(path)
+    pipeline = make_pipeline()
+    describes = fake_aws.backend.calls['describe_pipelines']
+    assert status.pipeline_status(pipeline, 3, cache=cache,
+                                  group='dev') == result
+    assert fake_aws.backend.calls['query_objects'] == calls
+    assert fake_aws.backend.calls['describe_pipelines'] == describes
+
+    # but not with other groups
+    status.pipeline_status(pipeline, 3, cache=cache, group='prod')
+    assert fake_aws.backend.calls['query_objects'] == calls + 1
+
+    # expired entries are looked up again
+    status.pipeline_status(pipeline, 3, cache=status.StatusCache(path, 0),
+                           group='dev')
+    assert fake_aws.backend.calls['query_objects'] == calls + 2
+
+
+def test_status_command(fake_aws, make_pipeline, project, capsys):
+    with project.as_cwd():
+        assert cli.main(['progname', 'status', '--cache-ttl', '0']) == 0
+        out, err = capsys.readouterr()
+        assert '(not deployed)' in out
+        assert fake_aws.conn.pipelines == {}
+
+        add_runs(fake_aws.conn, make_pipeline(), 4)
+        assert cli.main(['progname', 'status', '--runs', '2',
+                         '--format', 'json', '--cache-ttl', '0']) == 0
+        out, err = capsys.readouterr()
+        statuses = json.loads(out[out.index('['):])
+        assert [(s['group'], s['name'], len(s['runs']))
+                for s in statuses] == [('dev', 'echoer', 2)]
+
+        add_runs(fake_aws.conn, make_pipeline(), 1, failed=[0],
+                 start=datetime.utcnow() - timedelta(minutes=5),
+                 prefix='late')
+        assert cli.main(['progname', 'status', '--cache-ttl', '0']) == 1
+        out, err = capsys.readouterr()
+        assert 'FAILED' in out
+        assert not project.join(status.DEFAULT_CACHE_PATH).exists()
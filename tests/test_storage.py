@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import threading
+
+from pipewelder import Pipewelder, hashing, profiling, storage
+from benchmarks.fake_aws import (FakeBackend, FakeBucket,
+                                 FakeDataPipelineConnection, FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+INPUT_DIR = 'dev/echoer/inputs'
+MANIFEST = INPUT_DIR + '/.pipewelder-manifest.json'
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def make_bucket():
+    backend = FakeBackend()
+    return backend, FakeS3Connection(backend).get_bucket('pipewelder-example')
+
+
+def put(bucket, name, content):
+    bucket.new_key(INPUT_DIR + '/' + name).set_contents_from_string(content)
+
+
+def test_manifest_avoids_listing():
+    backend, bucket = make_bucket()
+    objects = [('run', b'echo'), ('tasks/a.txt', b'a'), ('tasks/b.txt', b'b')]
+    assert storage.publish(bucket, INPUT_DIR, objects)
+    assert backend.calls['s3.list'] == 1
+    assert storage.read_manifest(bucket, INPUT_DIR) == {
+        'run': {'etag': hashlib.md5(b'echo').hexdigest(), 'size': 4},
+        'tasks/a.txt': {'etag': hashlib.md5(b'a').hexdigest(),
+                        'size': 1},
+        'tasks/b.txt': {'etag': hashlib.md5(b'b').hexdigest(),
+                        'size': 1}}
+
+    puts = backend.calls['s3.put_object']
+    objects = [('run', b'echo'), ('tasks/a.txt', b'changed')]
+    assert storage.publish(bucket, INPUT_DIR, objects)
+    assert backend.calls['s3.list'] == 1
+    # the changed file and the manifest
+    assert backend.calls['s3.put_object'] == puts + 2
+    assert sorted(bucket.contents) == [MANIFEST, INPUT_DIR + '/run',
+                                       INPUT_DIR + '/tasks/a.txt']
+
+    # nothing changed, so not even the manifest is written
+    puts = backend.calls['s3.put_object']
+    assert storage.publish(bucket, INPUT_DIR, objects)
+    assert backend.calls['s3.put_object'] == puts
+
+
+def test_listing_fallback(tmpdir):
+    backend, bucket = make_bucket()
+    put(bucket, 'run', b'echo')
+    put(bucket, 'tasks/old.txt', b'old')
+    put(bucket, 'other.txt', b'other')
+    put(bucket, 'versions/v1/run', b'echo')
+    tmpdir.join('run').write('echo')
+    tmpdir.join('tasks', 'new.txt').write('new', ensure=True)
+    puts = backend.calls['s3.put_object']
+    assert storage.publish_files(bucket, INPUT_DIR, str(tmpdir),
+                                 deletable='tasks/')
+    assert backend.calls['s3.list'] == 1
+    # only the new file and the manifest
+    assert backend.calls['s3.put_object'] == puts + 2
+    assert sorted(bucket.contents) == [
+        MANIFEST, INPUT_DIR + '/other.txt', INPUT_DIR + '/run',
+        INPUT_DIR + '/tasks/new.txt', INPUT_DIR + '/versions/v1/run']
+
+
+def test_corrupt_manifest():
+    for content in [b'{"format": 1, "obj', b'{"format": 99}',
+                    json.dumps({'format': 1, 'objects': {'run': 1}})
+                    .encode('utf-8')]:
+        backend, bucket = make_bucket()
+        bucket.new_key(MANIFEST).set_contents_from_string(content)
+        assert storage.read_manifest(bucket, INPUT_DIR) is None
+        put(bucket, 'stale.txt', b'')
+        assert storage.publish(bucket, INPUT_DIR, [('run', b'echo')])
+        assert backend.calls['s3.list'] == 1
+        assert sorted(bucket.contents) == [MANIFEST, INPUT_DIR + '/run']
+        assert storage.read_manifest(bucket, INPUT_DIR) is not None
+
+
+def test_multipart_upload(tmpdir, monkeypatch):
+    monkeypatch.setattr(hashing, 'MULTIPART_THRESHOLD', 1024)
+    monkeypatch.setattr(hashing, 'PART_SIZE', 1024)
+    backend, bucket = make_bucket()
+    tmpdir.join('run').write('echo')
+    tmpdir.join('tasks', 'big.bin').write_binary(os.urandom(2500),
+                                                 ensure=True)
+    assert storage.publish_files(bucket, INPUT_DIR, str(tmpdir))
+    assert backend.calls['s3.upload_part'] == 3
+    assert bucket.contents[INPUT_DIR + '/tasks/big.bin'] == \
+        tmpdir.join('tasks', 'big.bin').read_binary()
+
+    # listed ETags match those computed locally
+    bucket.contents.pop(MANIFEST)
+    puts = backend.calls['s3.put_object']
+    assert storage.publish_files(bucket, INPUT_DIR, str(tmpdir))
+    assert backend.calls['s3.upload_part'] == 3
+    assert backend.calls['s3.put_object'] == puts + 1
+
+
+def test_delete_keys_streams():
+    backend, bucket = make_bucket()
+    names = ['outputs/{0:05d}'.format(i) for i in range(5000)]
+    for name in names:
+        bucket.contents[name] = b''
+    bucket.undeletable.add('outputs/01234')
+
+    def listing():
+        for i, name in enumerate(names):
+            if i == len(names) - 1:
+                # deletion keeps pace with the listing
+                assert backend.calls['s3.delete_objects'] >= 2
+            yield name
+    deleted, errors = storage.delete_keys(bucket, listing(), concurrency=1)
+    assert backend.calls['s3.delete_objects'] == 5
+    assert deleted == 4999
+    assert errors == [('outputs/01234', 'Access Denied')]
+    assert list(bucket.contents) == ['outputs/01234']
+
+
+def test_list_keys_pages(monkeypatch):
+    monkeypatch.setattr(FakeBucket, 'LIST_LIMIT', 2)
+    backend, bucket = make_bucket()
+    for name in ['a', 'b', 'c', 'd', 'e']:
+        put(bucket, name, b'')
+    ident = threading.current_thread().ident
+    profiler = profiling.Profiler(sampling=False)
+    profiler.start()
+    try:
+        names = []
+        for name in storage.list_keys(bucket, INPUT_DIR + '/'):
+            # work between pages is the caller's, not the network's
+            assert profiler.current_phase(ident) is None
+            names.append(name[len(INPUT_DIR) + 1:])
+    finally:
+        profiler.stop()
+    assert names == ['a', 'b', 'c', 'd', 'e']
+    assert backend.calls['s3.list'] == 3
+    assert [(name, calls) for name, seconds, calls in profiler.summary()] \
+        == [('network', 3)]
+
+
+def test_collect_versions():
+    backend, bucket = make_bucket()
+    for version in ['v1', 'v2', 'v3']:
+        put(bucket, 'versions/{0}/run'.format(version), b'echo')
+    put(bucket, 'run', b'echo')
+    assert storage.collect_versions(bucket, INPUT_DIR, ['v2', 'v3']) == 1
+    assert sorted(bucket.contents) == [
+        INPUT_DIR + '/run', INPUT_DIR + '/versions/v2/run',
+        INPUT_DIR + '/versions/v3/run']
+
+
+def test_clean():
+    backend = FakeBackend()
+    pw = Pipewelder(FakeDataPipelineConnection(backend),
+                    data_path('pipeline_definition.json'),
+                    FakeS3Connection(backend), values={'myEnv': 'dev'})
+    pw.add_pipeline(data_path('echoer'))
+    bucket = pw.s3_conn.get_bucket('pipewelder-example')
+    for name in ['inputs/run', 'outputs/2015-01-01/stdout.txt',
+                 'outputs-old/stdout.txt', 'logs/df-1/log.txt']:
+        bucket.new_key('dev/echoer/' + name).set_contents_from_string('')
+    assert pw.clean()
+    assert sorted(bucket.contents) == ['dev/echoer/inputs/run',
+                                       'dev/echoer/outputs-old/stdout.txt']
+    bucket.new_key('dev/echoer/logs/x').set_contents_from_string('')
+    bucket.undeletable.add('dev/echoer/logs/x')
+    assert not pw.clean()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from pipewelder import core, tracing
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+class StubConnection(object):
+    def create_pipeline(self, name, unique_id, description=None, tags=None):
+        return {'pipelineId': 'df-stub'}
+
+    def put_pipeline_definition(self, *args):
+        return {'errored': False}
+
+
+def read_spans(path):
+    with open(path) as f:
+        return dict((span['name'], span)
+                    for span in (json.loads(line) for line in f))
+
+
+def test_span_is_noop_without_exporters():
+    with tracing.span('anything') as span:
+        assert span is None
+
+
+def test_pipeline_spans_nest(tmpdir):
+    template = core.definition_from_file(data_path('pipeline_definition.json'))
+    pipeline = core.Pipeline(StubConnection(), None, template,
+                             data_path('echoer'))
+    path = str(tmpdir.join('spans.jsonl'))
+    exporter = tracing.FileExporter(path)
+    tracing.add_exporter(exporter)
+    try:
+        with tracing.span('run'):
+            assert pipeline.put_definition()
+    finally:
+        tracing.remove_exporter(exporter)
+        exporter.close()
+    spans = read_spans(path)
+    run = spans['run']
+    put = spans['Pipeline.put_definition']
+    assert put['parent_id'] == run['span_id']
+    assert put['attributes'] == {'pipeline': 'echoer'}
+    for name in ['create_pipeline', 'put_pipeline_definition']:
+        assert spans[name]['parent_id'] == put['span_id']
+        assert spans[name]['trace_id'] == run['trace_id']
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import boto.datapipeline
+from pytest import raises
+
+from pipewelder import transport
+
+
+def connection():
+    return boto.datapipeline.connect_to_region(
+        'us-west-2', **transport.REPLAY_CREDENTIALS)
+
+
+def fake_aws(request, sender=None, override_num_retries=None,
+             retry_handler=None):
+    body = json.dumps({'pipelineId': 'df-recorded'}).encode('utf-8')
+    return transport.RecordedResponse(
+        200, 'OK', [('Content-Type', 'application/x-amz-json-1.1')], body)
+
+
+def test_record_and_replay(tmpdir):
+    path = str(tmpdir.join('cassette.json'))
+    conn = connection()
+    conn._mexe = fake_aws
+    recorder = transport.RecordingTransport()
+    recorder.install(conn)
+    response = conn.create_pipeline('name', 'unique')
+    assert response == {'pipelineId': 'df-recorded'}
+    recorder.save(path)
+
+    player = transport.ReplayTransport(transport.Cassette.load(path), speed=0)
+    conn = player.install(connection())
+    # The body differs, so this falls back to matching on the operation.
+    assert conn.create_pipeline('other', 'unique') == response
+    assert player.summary()['calls'] == {'CreatePipeline': 1}
+    with raises(transport.ReplayError):
+        conn.create_pipeline('name', 'unique')
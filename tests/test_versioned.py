@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+
+import py
+
+from pipewelder import Pipewelder
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+INPUT_DIR = 'dev/echoer/inputs'
+
+
+def data_path(path):
+    return os.path.join(DATA_DIR, path)
+
+
+def make_pipewelder(dirpath, conn, s3_conn):
+    pw = Pipewelder(conn, data_path('pipeline_definition.json'),
+                    s3_conn, values={'myEnv': 'dev'}, versioned=True)
+    pw.add_pipeline(dirpath)
+    return pw
+
+
+def test_upload_to_version(tmpdir):
+    backend = FakeBackend()
+    s3_conn = FakeS3Connection(backend)
+    copy = tmpdir.join('echoer')
+    py.path.local(data_path('echoer')).copy(copy, mode=True)
+    pw = make_pipewelder(str(copy), FakeDataPipelineConnection(backend),
+                         s3_conn)
+    pipeline = pw.pipelines['echoer']
+    version = pipeline.input_version()
+    version_dir = INPUT_DIR + '/versions/' + version
+    bucket = s3_conn.get_bucket('pipewelder-example')
+    bucket.new_key(INPUT_DIR + '/tasks/old.txt').set_contents_from_string('')
+
+    # nothing outside the new version is touched
+    assert pw.upload()
+    assert sorted(bucket.contents) == [
+        INPUT_DIR + '/tasks/old.txt',
+        version_dir + '/.pipewelder-manifest.json',
+        version_dir + '/.pipewelder-version',
+        version_dir + '/run',
+        version_dir + '/tasks/first.txt',
+        version_dir + '/tasks/second.txt',
+        version_dir + '/values.json']
+    assert {'id': 'myS3InputDir',
+            'stringValue': 's3://pipewelder-example/' + version_dir} \
+        in pipeline.api_values()
+
+    # a published version is not uploaded again
+    puts = backend.calls['s3.put_object']
+    assert pw.upload()
+    assert backend.calls['s3.put_object'] == puts
+
+
+def test_activate_requires_upload(tmpdir):
+    backend = FakeBackend()
+    pw = make_pipewelder(data_path('echoer'),
+                         FakeDataPipelineConnection(backend),
+                         FakeS3Connection(backend))
+    assert not pw.activate()
+    assert backend.calls['activate_pipeline'] == 0
+    assert pw.upload()
+    assert pw.activate()
+    assert backend.calls['activate_pipeline'] == 1
+
+
+def test_old_versions_collected(tmpdir):
+    backend = FakeBackend()
+    conn = FakeDataPipelineConnection(backend)
+    s3_conn = FakeS3Connection(backend)
+    bucket = s3_conn.get_bucket('pipewelder-example')
+    copy = tmpdir.join('echoer')
+    py.path.local(data_path('echoer')).copy(copy, mode=True)
+    versions = []
+    for content in ['one', 'two', 'three']:
+        copy.join('tasks', 'first.txt').write(content)
+        pw = make_pipewelder(str(copy), conn, s3_conn)
+        assert pw.upload() and pw.activate()
+        pw.wait()
+        versions.append(pw.pipelines['echoer'].input_version())
+    present = set(name.split('/')[4] for name in bucket.contents)
+    assert present == set(versions[1:])
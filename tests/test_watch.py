@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+
+import pytest
+
+from pipewelder import util, watch
+from pipewelder.cli import pipewelder_configs, build_pipewelder
+from benchmarks.fake_aws import (FakeBackend, FakeDataPipelineConnection,
+                                 FakeS3Connection)
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'test_data')
+
+
+@pytest.fixture
+def tree(tmpdir):
+    root = str(tmpdir)
+    shutil.copy(os.path.join(DATA_DIR, 'pipeline_definition.json'), root)
+    for name in ['first', 'second']:
+        dirpath = os.path.join(root, name)
+        shutil.copytree(os.path.join(DATA_DIR, 'echoer'), dirpath)
+        values_path = os.path.join(dirpath, 'values.json')
+        values = util.load_json(values_path)
+        values['values']['myName'] = name
+        with open(values_path, 'w') as f:
+            json.dump(values, f)
+    with open(os.path.join(root, 'pipewelder.json'), 'w') as f:
+        json.dump({"dev": {"dirs": ["*"], "region": "us-west-2",
+                           "values": {"myEnv": "dev"}}}, f)
+    with util.cd(root):
+        yield root
+
+
+@pytest.fixture
+def watcher(tree):
+    backend = FakeBackend()
+    conn = FakeDataPipelineConnection(backend)
+    s3_conn = FakeS3Connection(backend)
+    w = watch.Watcher(lambda: pipewelder_configs('pipewelder.json'),
+                      lambda config: build_pipewelder(conn, config, s3_conn),
+                      watch.PollingObserver(tree, interval=0))
+    w.start()
+    w.backend = backend
+    return w
+
+
+def touch(path, text='changed\n'):
+    with open(path, 'a') as f:
+        f.write(text)
+    return os.path.abspath(path)
+
+
+def test_polling_observer(tree):
+    observer = watch.PollingObserver(tree, interval=0)
+    assert observer.poll() == set()
+    changed = touch(os.path.join('first', 'tasks', 'first.txt'))
+    os.remove(os.path.join('second', 'run'))
+    assert observer.poll() == set([changed,
+                                   os.path.join(tree, 'second', 'run')])
+    assert observer.poll() == set()
+
+
+def test_task_change_redeploys_one_pipeline(watcher):
+    path = touch(os.path.join('first', 'tasks', 'second.txt'))
+    assert watcher.handle([path]) == [('dev', 'first', True)]
+    assert watcher.backend.calls['activate_pipeline'] == 1
+    assert watcher.handle([path + '~']) == []
+
+
+def test_template_change_fans_out(watcher):
+    path = touch('pipeline_definition.json', ' ')
+    results = watcher.handle([path])
+    assert sorted(results) == [('dev', 'first', True),
+                               ('dev', 'second', True)]
+
+
+def test_new_pipeline_directory(watcher):
+    shutil.copytree('first', 'third')
+    path = touch(os.path.join('third', 'values.json'), ' ')
+    with open(path) as f:
+        values = json.load(f)
+    values['values']['myName'] = 'third'
+    with open(path, 'w') as f:
+        json.dump(values, f)
+    assert watcher.handle([path]) == [('dev', 'third', True)]
+    assert 'third' in watcher.welders['dev'].pipelines
+
+
+def test_moved_pipelines_warn(watcher, caplog):
+    with open('pipewelder.json', 'w') as f:
+        json.dump({"dev": {"dirs": ["*"], "values": {"myEnv": "dev"},
+                           "shards": [{"region": "us-east-1"}]}}, f)
+    results = watcher.handle([os.path.abspath('pipewelder.json')])
+    assert sorted(results) == [('dev/us-east-1', 'first', True),
+                               ('dev/us-east-1', 'second', True)]
+    moved = [r.getMessage() for r in caplog.records
+             if r.levelname == 'WARNING']
+    assert len(moved) == 2
+    assert all("moved from 'dev' to 'dev/us-east-1'" in message and
+               "still deployed in region 'us-west-2'" in message
+               for message in moved)